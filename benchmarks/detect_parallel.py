@@ -0,0 +1,70 @@
+"""
+Curva de escalabilidade da deteção de defeitos em faixas paralelas (1..N threads).
+
+Uso (a partir da raiz do projeto):
+    python -m benchmarks.detect_parallel --max-workers 8 --repeat 5
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+import cv2
+
+from config.config_registry import get_config, INSPECTION_PARAMS_SCHEMA
+from models.align_image import align_with_template
+from models.defect_detector import PreparedTemplate, DETECT_PARAM_KEYS
+from models.parallel_detector import ParallelDefectDetector, resolve_workers
+
+
+def _detect_params(params):
+    return tuple(params[key] for key in DETECT_PARAM_KEYS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--template", default="data/raw/fba_template.jpg")
+    parser.add_argument("--current", default="data/raw/fba_actual-1.jpg")
+    parser.add_argument("--mask", default="data/mask/leaf_mask.png")
+    parser.add_argument("--params", default="config/inspection_params.json")
+    parser.add_argument("--max-workers", type=int, default=0, help="0 = número de cores")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cv-threads", type=int, default=None,
+                        help="cv2.setNumThreads (por omissão fica o valor do OpenCV)")
+    args = parser.parse_args()
+
+    if args.cv_threads is not None:
+        cv2.setNumThreads(args.cv_threads)
+
+    template = cv2.imread(args.template)
+    mask = cv2.imread(args.mask, cv2.IMREAD_GRAYSCALE)
+    aligned, _ = align_with_template(cv2.imread(args.current), template)
+    aligned = cv2.bitwise_and(aligned, aligned, mask=mask)
+    prepared = PreparedTemplate(template, mask)
+    params = _detect_params(get_config(args.params, INSPECTION_PARAMS_SCHEMA))
+
+    max_workers = resolve_workers(args.max_workers)
+    print(f"Cores disponíveis: {resolve_workers(0)}, threads OpenCV: {cv2.getNumThreads()}")
+    print(f"{'workers':>7} | {'mediana (s)':>11} | {'speedup':>7} | {'eficiência':>10}")
+
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        detector = ParallelDefectDetector(prepared, mask, workers=workers)
+        times = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            detector.detect(aligned, *params)  # aquecimento (buffers das faixas)
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                detector.detect(aligned, *params)
+                times.append(time.perf_counter() - start)
+        detector.close()
+
+        median = statistics.median(times)
+        baseline = baseline or median
+        speedup = baseline / median
+        print(f"{workers:>7} | {median:>11.4f} | {speedup:>7.2f} | {speedup / workers:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
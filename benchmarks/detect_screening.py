@@ -0,0 +1,113 @@
+"""
+Triagem em dois passos (DefectDetector.detect_screened) vs deteção completa (DefectDetector.detect).
+
+Para cada amostra confirma que o conjunto de defeitos (máscara final e registos) é o mesmo
+e compara os tempos. Amostras: as folhas em data/raw e, a partir do template, uma folha boa
+(recomprimida em JPEG) e folhas com defeitos pequenos pintados.
+
+Uso (a partir da raiz do projeto):
+    python -m benchmarks.detect_screening
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from config.config_registry import get_config, INSPECTION_PARAMS_SCHEMA
+from models.align_image import align_with_template
+from models.defect_detector import DefectDetector, PreparedTemplate, DETECT_PARAM_KEYS
+
+SAMPLE_SHEETS = ("data/raw/fba_actual-1.jpg", "data/raw/fba_actual - 2.jpg", "data/raw/fba_actual - Cópia.jpg")
+
+
+def _detect_params(params):
+    return tuple(params[key] for key in DETECT_PARAM_KEYS)
+
+
+def _synthetic_sheets(template, mask):
+    # Folha boa: o template recomprimido (ruído de compressão, sem defeitos)
+    _, encoded = cv2.imencode(".jpg", template, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    good = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+    yield "template (jpeg 90)", good
+
+    # Defeitos pequenos em pontos aleatórios dentro da máscara
+    rng = np.random.default_rng(0)
+    ys, xs = np.nonzero(mask)
+    for name, color, radius in (("mancha escura", (20, 20, 20), 4), ("mancha amarela", (0, 220, 255), 5),
+                                ("mancha azul", (255, 80, 0), 5), ("mancha vermelha", (0, 0, 230), 4),
+                                ("risco escuro", None, 0)):
+        sheet = good.copy()
+        for i in rng.choice(len(xs), 3, replace=False):
+            center = (int(xs[i]), int(ys[i]))
+            if color is None:
+                cv2.line(sheet, center, (center[0] + 40, center[1] + 25), (30, 30, 30), 2)
+            else:
+                cv2.circle(sheet, center, radius, color, -1)
+        yield name, sheet
+
+
+def _same_defects(a, b):
+    mask_a, defects_a = a[0], a[1]
+    mask_b, defects_b = b[0], b[1]
+    fields = ["x", "y", "w", "h", "area"]
+    return np.array_equal(mask_a, mask_b) and np.array_equal(np.sort(defects_a[fields]), np.sort(defects_b[fields]))
+
+
+def _timed(fn, repeat):
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--template", default="data/raw/fba_template.jpg")
+    parser.add_argument("--mask", default="data/mask/leaf_mask.png")
+    parser.add_argument("--params", default="config/inspection_params.json")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    template = cv2.imread(args.template)
+    mask = cv2.imread(args.mask, cv2.IMREAD_GRAYSCALE)
+    config = get_config(args.params, INSPECTION_PARAMS_SCHEMA)
+    params = _detect_params(config)
+    screening = dict(scale=config["screening_scale"], relax=config["screening_relax"])
+    detector = DefectDetector(PreparedTemplate(template, mask), mask)
+
+    samples = []
+    for path in SAMPLE_SHEETS:
+        current = cv2.imread(path)
+        if current is None:
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            aligned, _ = align_with_template(current, template)
+        samples.append((path, aligned))
+    samples.extend(_synthetic_sheets(template, mask))
+
+    print(f"{'amostra':<34} | {'defeitos':>8} | {'completa (s)':>12} | {'triagem (s)':>11} | iguais")
+    all_equal = True
+    for name, aligned in samples:
+        aligned = cv2.bitwise_and(aligned, aligned, mask=mask)
+        full_time, full = _timed(lambda: detector.detect(aligned, *params), args.repeat)
+        full = [x.copy() if isinstance(x, np.ndarray) else x for x in full]
+        screened_time, screened = _timed(lambda: detector.detect_screened(aligned, *params, **screening),
+                                         args.repeat)
+        equal = _same_defects(full, screened)
+        all_equal &= equal
+        print(f"{name:<34} | {len(full[1]):>8} | {full_time:>12.4f} | {screened_time:>11.4f} | "
+              f"{'sim' if equal else 'NÃO'}")
+
+    sys.exit(0 if all_equal else 1)
+
+
+if __name__ == "__main__":
+    main()
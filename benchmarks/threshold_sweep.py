@@ -0,0 +1,74 @@
+"""
+Curvas "defeitos vs threshold" num só varrimento (component_count_curve) vs uma rotulagem por threshold.
+
+Para cada canal confirma a contagem em todos os thresholds (ou só em --step) contra
+cv2.connectedComponentsWithStats e compara os tempos.
+
+Uso (a partir da raiz do projeto):
+    python -m benchmarks.threshold_sweep --step 8
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from config.config_registry import get_config, INSPECTION_PARAMS_SCHEMA
+from models.align_image import align_with_template
+from models.defect_detector import PreparedTemplate
+from models.incremental_detector import IncrementalDefectDetector
+
+
+def _labelled_count(diff, t, min_area):
+    _, _, stats, _ = cv2.connectedComponentsWithStats(cv2.compare(diff, t, cv2.CMP_GT), connectivity=8)
+    return int(np.count_nonzero(stats[1:, cv2.CC_STAT_AREA] >= min_area))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--template", default="data/raw/fba_template.jpg")
+    parser.add_argument("--current", default="data/raw/fba_actual-1.jpg")
+    parser.add_argument("--mask", default="data/mask/leaf_mask.png")
+    parser.add_argument("--params", default="config/inspection_params.json")
+    parser.add_argument("--step", type=int, default=1, help="Verifica os thresholds 0, step, 2*step, ...")
+    args = parser.parse_args()
+
+    template = cv2.imread(args.template)
+    mask = cv2.imread(args.mask, cv2.IMREAD_GRAYSCALE)
+    with contextlib.redirect_stdout(io.StringIO()):
+        aligned, _ = align_with_template(cv2.imread(args.current), template)
+    aligned = cv2.bitwise_and(aligned, aligned, mask=mask)
+    params = get_config(args.params, INSPECTION_PARAMS_SCHEMA)
+    min_area, gradient = params["detect_area"], params["dark_gradient_threshold"]
+
+    detector = IncrementalDefectDetector(PreparedTemplate(template, mask), mask)
+    start = time.perf_counter()
+    curves = detector.threshold_curves(aligned, min_area, gradient)
+    sweep_time = time.perf_counter() - start
+
+    # As mesmas diferenças que threshold_curves usa
+    raw = detector._raw
+    dark = cv2.bitwise_and(raw["diff_dark_raw"], cv2.compare(raw["morph_grad"], gradient, cv2.CMP_GT))
+    diffs = {"dark": dark, "bright": raw["diff_yellow"], "blue": raw["diff_blue"], "red": raw["diff_red"]}
+
+    print(f"Varrimento dos 4 canais: {sweep_time:.3f} s (área mín. {min_area}, gradiente {gradient})")
+    print(f"{'canal':<7} | {'thresholds':>10} | {'rotulagem (s)':>13} | iguais")
+    all_equal = True
+    for name, diff in diffs.items():
+        diff = cv2.bitwise_and(diff, diff, mask=mask)
+        thresholds = range(0, 256, args.step)
+        start = time.perf_counter()
+        expected = [_labelled_count(diff, t, min_area) for t in thresholds]
+        label_time = time.perf_counter() - start
+        equal = list(curves[name][list(thresholds)]) == expected
+        all_equal &= equal
+        print(f"{name:<7} | {len(thresholds):>10} | {label_time:>13.3f} | {'sim' if equal else 'NÃO'}")
+
+    sys.exit(0 if all_equal else 1)
+
+
+if __name__ == "__main__":
+    main()
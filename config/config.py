@@ -19,5 +19,5 @@ RAW_IMAGE_FOLDER = "data/raw"
 MASK_SAVE_PATH = "data/masks"
 
 # === Outras configurações ===
-IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png"]
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp"]
 CAMERA_INDEX = 0  # índice da câmera padrão (0 é o default para OpenCV)
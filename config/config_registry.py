@@ -0,0 +1,262 @@
+# config_registry.py
+
+import json
+import os
+import threading
+import time
+
+# === Esquemas (chave -> (tipo, valor por defeito)) ===
+ALIGNMENT_SCHEMA = {
+    "max_features": (int, 1000),
+    "good_match_percent": (float, 0.2),
+    "mode": (str, "orb"),
+    "matcher": (str, "bf"),
+    "lowe_ratio": (float, 0.75),
+    "grid_rows": (int, 0),
+    "grid_cols": (int, 0),
+    "ecc_iterations": (int, 50),
+    "ecc_epsilon": (float, 1e-5),
+    "ecc_gauss_size": (int, 5),
+    "ecc_scales": (list, [0.25]),
+    "phase_scale": (float, 0.25),
+    "phase_polar_size": (int, 512),
+    "phase_min_response": (float, 0.3),
+    "phase_refine_iterations": (int, 2),
+    "session_tolerance_px": (float, 1.0),
+    "session_search_px": (int, 12),
+    "session_min_score": (float, 0.8),
+    "warp_regions": (str, "full"),
+    "gate_enabled": (bool, True),
+    "gate_min_inliers": (int, 20),
+    "gate_min_inlier_ratio": (float, 0.3),
+    "gate_max_rmse": (float, 3.0),
+    "gate_min_correlation": (float, 0.0),
+    "gate_min_det": (float, 0.8),
+    "gate_max_det": (float, 1.25),
+    "gate_max_condition": (float, 1.2),
+}
+
+DETECT_MARGINS_SCHEMA = {
+    "blur_ksize": (int, 5),
+    "canny_threshold1": (int, 50),
+    "canny_threshold2": (int, 150),
+    "min_area": (int, 100000),
+}
+
+INSPECTION_PARAMS_SCHEMA = {
+    "dark_threshold": (int, 30),
+    "bright_threshold": (int, 30),
+    "blue_threshold": (int, 25),
+    "red_threshold": (int, 25),
+    "dark_morph_kernel_size": (int, 3),
+    "dark_morph_iterations": (int, 1),
+    "bright_morph_kernel_size": (int, 3),
+    "bright_morph_iterations": (int, 1),
+    "dark_gradient_threshold": (int, 10),
+    "detect_area": (int, 1),
+    "detect_mode": (str, "full"),
+    "detect_workers": (int, 0),
+    "screening_scale": (float, 0.25),
+    "screening_relax": (float, 0.35),
+    "can_assignment": (str, "raster"),
+    "detect_reference": (str, "template"),
+    "golden_model_path": (str, "data/golden_model.npz"),
+    "golden_z": (float, 4.0),
+    "golden_min_delta": (int, 3),
+}
+
+
+def _parse_bool(value):
+    # bool("false") seria True: aceita só true/false/1/0 (texto, bool ou número)
+    if isinstance(value, str):
+        text = value.lower()
+        if text in ("true", "1"):
+            return True
+        if text in ("false", "0"):
+            return False
+        raise ValueError(value)
+    if value in (True, False):
+        return bool(value)
+    raise ValueError(value)
+
+
+def _parse_float_list(value):
+    # Lista de números: JSON ("[0.25, 0.5]"), texto separado por vírgulas ("0.25, 0.5") ou um só número
+    if isinstance(value, str):
+        value = json.loads(value) if value.startswith("[") else [v for v in value.split(",") if v.strip()]
+    elif isinstance(value, (int, float)):
+        value = [value]
+    if not isinstance(value, list) or not value:
+        raise ValueError(value)
+    return [float(v) for v in value]
+
+
+# Tipos do esquema que não se convertem chamando o próprio tipo
+_PARSERS = {bool: _parse_bool, list: _parse_float_list}
+
+
+def _apply_schema(raw, schema):
+    typed = dict(raw)
+    for key, (cast, default) in schema.items():
+        value = raw.get(key, default)
+        parse = _PARSERS.get(cast, cast)
+        try:
+            typed[key] = parse(value.strip() if isinstance(value, str) else value)
+        except (TypeError, ValueError):
+            print(f"[WARN] Valor inválido para '{key}': {value!r}, a usar {default!r}")
+            typed[key] = default
+    return typed
+
+
+class _ConfigEntry:
+    def __init__(self):
+        self.raw = None
+        self.mtime_ns = None
+        self.checked_at = 0.0
+        self.typed = {}
+
+
+class ConfigRegistry:
+    """
+    In-process cache of JSON config files.
+
+    Each file is parsed once and kept in memory. The file's mtime is checked at
+    most once every `check_interval` seconds, so hot paths (one call per sheet)
+    do no filesystem I/O or JSON parsing unless the file was actually edited.
+    Subscribers are called with `(path, config)` whenever a reload changes it.
+    """
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._entries = {}
+        self._subscribers = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _key(path):
+        return os.path.abspath(path)
+
+    def get(self, path, schema=None):
+        """
+        Returns the config at `path` as a dict (a copy, safe to modify).
+
+        Args:
+            path (str): JSON file path.
+            schema (dict, optional): {key: (type, default)} used to coerce values.
+
+        Raises:
+            FileNotFoundError: If the file was never loaded and does not exist.
+        """
+        key = self._key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _ConfigEntry()
+                self._entries[key] = entry
+            self._refresh(path, key, entry)
+
+            if entry.raw is None:
+                raise FileNotFoundError(path)
+            if schema is None:
+                return dict(entry.raw)
+
+            schema_id = id(schema)
+            if schema_id not in entry.typed:
+                entry.typed[schema_id] = _apply_schema(entry.raw, schema)
+            return dict(entry.typed[schema_id])
+
+    def _refresh(self, path, key, entry):
+        now = time.monotonic()
+        if entry.raw is not None and now - entry.checked_at < self.check_interval:
+            return
+        entry.checked_at = now
+
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            if entry.raw is None:
+                self._entries.pop(key, None)
+                raise
+            # Mantém o último valor válido se o ficheiro desaparecer temporariamente
+            return
+
+        if mtime_ns == entry.mtime_ns:
+            return
+
+        try:
+            with open(path, "r") as f:
+                raw = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            if entry.raw is None:
+                self._entries.pop(key, None)
+                raise
+            # Ficheiro a meio de ser escrito: tenta novamente na próxima verificação
+            print(f"[WARN] Falha ao recarregar {path}: {e}")
+            return
+
+        changed = entry.raw is not None and raw != entry.raw
+        entry.raw = raw
+        entry.mtime_ns = mtime_ns
+        entry.typed = {}
+        if changed:
+            self._notify(key, path, raw)
+
+    def save(self, path, data):
+        """Writes `data` to `path` and updates the cache without re-reading it."""
+        key = self._key(path)
+        with self._lock:
+            with open(path, "w") as f:
+                json.dump(data, f, indent=4)
+
+            entry = self._entries.setdefault(key, _ConfigEntry())
+            changed = entry.raw != data
+            entry.raw = json.loads(json.dumps(data))
+            entry.mtime_ns = os.stat(path).st_mtime_ns
+            entry.checked_at = time.monotonic()
+            entry.typed = {}
+            if changed:
+                self._notify(key, path, entry.raw)
+
+    def invalidate(self, path=None):
+        """Forces the next `get` to re-check the file (all files if `path` is None)."""
+        with self._lock:
+            entries = self._entries.values() if path is None else [self._entries.get(self._key(path))]
+            for entry in entries:
+                if entry is not None:
+                    entry.checked_at = 0.0
+
+    def subscribe(self, path, callback):
+        with self._lock:
+            self._subscribers.setdefault(self._key(path), []).append(callback)
+
+    def unsubscribe(self, path, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(self._key(path), [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def _notify(self, key, path, raw):
+        for callback in list(self._subscribers.get(key, [])):
+            try:
+                callback(path, dict(raw))
+            except Exception as e:
+                print(f"[WARN] Erro no callback de configuração ({path}): {e}")
+
+
+registry = ConfigRegistry()
+
+
+def get_config(path, schema=None):
+    return registry.get(path, schema)
+
+
+def save_config(path, data):
+    registry.save(path, data)
+
+
+def subscribe(path, callback):
+    registry.subscribe(path, callback)
+
+
+def unsubscribe(path, callback):
+    registry.unsubscribe(path, callback)
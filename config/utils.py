@@ -1,8 +1,13 @@
-import json
+from config.config_registry import get_config, save_config
+
+
+def load_params(json_path, schema=None):
+    return get_config(json_path, schema)
+
+
+def save_params(json_path, params):
+    save_config(json_path, params)
 
-def load_params(json_path):
-    with open(json_path, "r") as f:
-        return json.load(f)
 
 def center_window(window, width=800, height=600):
     window.update_idletasks()
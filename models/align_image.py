@@ -2,73 +2,510 @@ import time
 
 import cv2
 import numpy as np
-import json
+
+from config.config_registry import get_config, ALIGNMENT_SCHEMA
 
 orb = cv2.ORB_create(nfeatures=1500)
 
-def align_with_template(current_img, template_img, config_path="config/config_alignment.json", resize_scale=0.5):
+ALIGNMENT_MODES = ("orb", "pyramid_ecc", "phase")
+
+
+def _to_gray(img):
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+
+
+def _scale_matrix(sx, sy):
+    # cv2.resize alinha centros de pixel: x' = (x + 0.5) * s - 0.5
+    return np.array([[sx, 0, 0.5 * sx - 0.5], [0, sy, 0.5 * sy - 0.5], [0, 0, 1]], dtype=np.float64)
+
+
+def _scaled_shape(img, scale):
+    # Tamanho que cv2.resize(fx=scale, fy=scale) produz
+    return round(img.shape[0] * scale), round(img.shape[1] * scale)
+
+
+def extract_orb_features(img, resize_scale=0.5, detector=orb):
     """
-    Alinha a imagem atual com o template usando ORB + Homografia, redimensionando temporariamente para acelerar o processo.
+    Redimensiona a imagem, converte para cinza e extrai keypoints/descritores ORB.
+    As coordenadas dos keypoints ficam no espaço da imagem redimensionada.
     """
-    start_time = time.perf_counter()
+    small = cv2.resize(img, (0, 0), fx=resize_scale, fy=resize_scale, interpolation=cv2.INTER_AREA)
+    return detector.detectAndCompute(_to_gray(small), None)
 
-    # Carregar parâmetros
-    with open(config_path, "r") as f:
-        config = json.load(f)
 
-    max_features = config.get("max_features", 1000)
-    good_match_percent = config.get("good_match_percent", 0.2)
+def _grid_bucket(pts, responses, shape, rows, cols, per_cell):
+    """
+    Índices dos keypoints a manter: no máximo `per_cell` (maior resposta) por célula de uma grelha rows x cols,
+    para que os pontos cubram a folha toda de forma uniforme.
+    """
+    h, w = shape[:2]
+    cell_x = np.clip((pts[:, 0] * cols / w).astype(np.int32), 0, cols - 1)
+    cell_y = np.clip((pts[:, 1] * rows / h).astype(np.int32), 0, rows - 1)
+    cell = cell_y * cols + cell_x
 
-    # Função utilitária
-    def to_gray(img):
-        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+    order = np.lexsort((-responses, cell))  # por célula, resposta decrescente
+    sorted_cells = cell[order]
+    first = np.searchsorted(sorted_cells, sorted_cells, side="left")
+    rank = np.arange(len(order)) - first
+    return np.sort(order[rank < per_cell])
 
-    # Redimensionar para acelerar alinhamento
-    template_small = cv2.resize(template_img, (0, 0), fx=resize_scale, fy=resize_scale, interpolation=cv2.INTER_AREA)
-    current_small = cv2.resize(current_img, (0, 0), fx=resize_scale, fy=resize_scale, interpolation=cv2.INTER_AREA)
 
-    template_gray = to_gray(template_small)
-    current_gray = to_gray(current_small)
+def _match_descriptors(desc1, desc2, config):
+    """
+    Devolve (idx1, idx2): índices dos matches aceites em desc1 (template) e desc2 (atual).
 
-    # ORB + Matching
-    #orb = cv2.ORB_create(nfeatures=max_features)
-    kpts1, desc1 = orb.detectAndCompute(template_gray, None)
-    kpts2, desc2 = orb.detectAndCompute(current_gray, None)
+    "bf": força bruta Hamming com crossCheck, mantém a fração `good_match_percent` de menor distância.
+    "flann_lsh": FLANN com índice LSH e teste de razão de Lowe (`lowe_ratio`).
+    """
+    if config["matcher"] == "flann_lsh":
+        index_params = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)  # FLANN_INDEX_LSH
+        matcher = cv2.FlannBasedMatcher(index_params, dict(checks=50))
+        knn = matcher.knnMatch(desc1, desc2, k=2)
+        pairs = np.array([(m[0].queryIdx, m[0].trainIdx, m[0].distance, m[1].distance)
+                          for m in knn if len(m) == 2], dtype=np.float64).reshape(-1, 4)
+        if not len(pairs):
+            raise ValueError("Nenhum match encontrado.")
+        good = pairs[pairs[:, 2] < config["lowe_ratio"] * pairs[:, 3]]
+        return good[:, 0].astype(np.intp), good[:, 1].astype(np.intp)
 
-    if desc1 is None or desc2 is None:
-        raise ValueError("Não foi possível extrair descritores ORB.")
+    if config["matcher"] != "bf":
+        raise ValueError(f"Matcher desconhecido: {config['matcher']}")
 
     matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
     matches = matcher.match(desc1, desc2)
     if not matches:
         raise ValueError("Nenhum match encontrado.")
 
-    matches = sorted(matches, key=lambda x: x.distance)
-    num_good = max(4, int(len(matches) * good_match_percent))
-    good_matches = matches[:num_good]
+    pairs = np.array([(m.queryIdx, m.trainIdx, m.distance) for m in matches], dtype=np.float64)
+    num_good = max(4, int(len(pairs) * config["good_match_percent"]))
+    good = pairs[np.argsort(pairs[:, 2], kind="stable")[:num_good]]
+    return good[:, 0].astype(np.intp), good[:, 1].astype(np.intp)
 
-    if len(good_matches) < 4:
-        raise ValueError("Matches insuficientes para homografia.")
 
-    # Pontos ajustados ao tamanho redimensionado
-    pts1 = np.float32([kpts1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-    pts2 = np.float32([kpts2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+def _estimate_homography(kpts1, desc1, kpts2, desc2, config, resize_scale, shape1=None, shape2=None):
+    """
+    Faz o matching ORB e devolve a homografia (atual -> template) em coordenadas de resolução total.
+    `shape1`/`shape2` são os tamanhos das imagens onde os keypoints foram detetados (para a grelha).
+
+    Returns:
+        tuple: (H, stats) com stats = {"matches", "inliers", "rmse"} (rmse dos inliers, em píxeis de resolução total)
+    """
+    if desc1 is None or desc2 is None:
+        raise ValueError("Não foi possível extrair descritores ORB.")
+
+    # Coordenadas dos keypoints como arrays (sem ciclos Python por match)
+    pts1 = cv2.KeyPoint_convert(kpts1).reshape(-1, 2)
+    pts2 = cv2.KeyPoint_convert(kpts2).reshape(-1, 2)
+
+    rows, cols = config["grid_rows"], config["grid_cols"]
+    if rows > 0 and cols > 0 and shape1 is not None and shape2 is not None:
+        per_cell = int(np.ceil(config["max_features"] / (rows * cols)))
+        keep1 = _grid_bucket(pts1, np.array([kp.response for kp in kpts1]), shape1, rows, cols, per_cell)
+        keep2 = _grid_bucket(pts2, np.array([kp.response for kp in kpts2]), shape2, rows, cols, per_cell)
+        pts1, desc1 = pts1[keep1], desc1[keep1]
+        pts2, desc2 = pts2[keep2], desc2[keep2]
+
+    idx1, idx2 = _match_descriptors(desc1, desc2, config)
+    if len(idx1) < 4:
+        raise ValueError("Matches insuficientes para homografia.")
 
     # Compensar escala nos pontos
-    pts1 /= resize_scale
-    pts2 /= resize_scale
+    src = (pts2[idx2] / resize_scale).reshape(-1, 1, 2).astype(np.float32)
+    dst = (pts1[idx1] / resize_scale).reshape(-1, 1, 2).astype(np.float32)
 
     # Calcular homografia nos pontos originais
-    H, _ = cv2.findHomography(pts2, pts1, cv2.RANSAC)
+    H, inlier_mask = cv2.findHomography(src, dst, cv2.RANSAC)
     if H is None:
         raise ValueError("Homografia falhou.")
 
+    inliers = inlier_mask.ravel().astype(bool)
+    residuals = cv2.perspectiveTransform(src[inliers], H) - dst[inliers]
+    rmse = float(np.sqrt(np.mean(np.sum(residuals ** 2, axis=-1)))) if inliers.any() else float("inf")
+    return H, {"matches": len(src), "inliers": int(inliers.sum()), "rmse": rmse}
+
+
+def _expected_det(template_img, current_img):
+    # det(H) de um alinhamento correto (atual -> template): área do template / área do frame
+    th, tw = template_img.shape[:2]
+    ch, cw = current_img.shape[:2]
+    return (th * tw) / (ch * cw)
+
+
+class AlignmentQuality:
+    """
+    Quality metrics of one alignment, used to reject a sheet before defect detection.
+
+    `matches`, `inliers` and `rmse` (inlier reprojection error, full resolution
+    pixels) come from the ORB/RANSAC stage and are None when the mode has none
+    ("phase"; "pyramid_ecc" keeps only the counts of its coarse level). `correlation` is the phase correlation peak ("phase") or the
+    ECC correlation coefficient of the last level ("pyramid_ecc"). `det` and
+    `condition` are taken from the linear 2x2 part of the normalized H: a
+    scale far from the camera/template ratio or a strong shear means a bad fit.
+    `expected_det` is that ratio (template area / frame area, see _expected_det)
+    and `relative_det` = det / expected_det is what the gate bounds apply to.
+    """
+
+    def __init__(self, mode, H, matches=None, inliers=None, rmse=None, correlation=None, expected_det=1.0):
+        self.mode = mode
+        self.matches = matches
+        self.inliers = inliers
+        self.rmse = rmse
+        self.correlation = correlation
+
+        linear = H[:2, :2] / H[2, 2]
+        self.det = float(np.linalg.det(linear))
+        self.condition = float(np.linalg.cond(linear))
+        self.expected_det = float(expected_det)
+        self.relative_det = self.det / self.expected_det
+
+    @property
+    def inlier_ratio(self):
+        if not self.matches or self.inliers is None:
+            return None
+        return self.inliers / self.matches
+
+    def rejection_reasons(self, config):
+        """
+        Checks the metrics against the "gate_*" keys of the alignment config.
+
+        Returns:
+            list: Human readable reasons; empty if the alignment is accepted.
+        """
+        reasons = []
+        if self.inliers is not None and self.inliers < config["gate_min_inliers"]:
+            reasons.append(f"inliers {self.inliers} < {config['gate_min_inliers']}")
+        ratio = self.inlier_ratio
+        if ratio is not None and ratio < config["gate_min_inlier_ratio"]:
+            reasons.append(f"rácio de inliers {ratio:.2f} < {config['gate_min_inlier_ratio']}")
+        if self.rmse is not None and self.rmse > config["gate_max_rmse"]:
+            reasons.append(f"RMSE {self.rmse:.2f}px > {config['gate_max_rmse']}")
+        if self.correlation is not None and self.correlation < config["gate_min_correlation"]:
+            reasons.append(f"correlação {self.correlation:.3f} < {config['gate_min_correlation']}")
+        # Frames de outra resolução têm det(H) ~ área do template / área do frame: compara-se o quociente
+        if not config["gate_min_det"] <= self.relative_det <= config["gate_max_det"]:
+            reasons.append(f"det(H) {self.det:.3f} / esperado {self.expected_det:.3f} = {self.relative_det:.3f} "
+                           f"fora de [{config['gate_min_det']}, {config['gate_max_det']}]")
+        if self.condition > config["gate_max_condition"]:
+            reasons.append(f"cond(H) {self.condition:.3f} > {config['gate_max_condition']}")
+        return reasons
+
+    def as_dict(self):
+        return {"mode": self.mode, "matches": self.matches, "inliers": self.inliers,
+                "inlier_ratio": self.inlier_ratio, "rmse": self.rmse, "correlation": self.correlation,
+                "det": self.det, "expected_det": self.expected_det, "condition": self.condition}
+
+    def __str__(self):
+        parts = [self.mode]
+        if self.inliers is not None:
+            parts.append(f"inliers={self.inliers}/{self.matches}")
+        if self.rmse is not None:
+            parts.append(f"rmse={self.rmse:.2f}px")
+        if self.correlation is not None:
+            parts.append(f"corr={self.correlation:.3f}")
+        parts.append(f"det={self.det:.3f} cond={self.condition:.3f}")
+        return " ".join(parts)
+
+
+class TemplatePyramid:
+    """
+    Template-side data for the "pyramid_ecc" mode, built once per template.
+
+    Holds the ORB features of the coarse level and, for each ECC level, the
+    gray template and the leaf mask resized to that level.
+    """
+
+    def __init__(self, template_img, mask=None, coarse_scale=0.125, ecc_scales=(0.25,)):
+        self.coarse_scale = coarse_scale
+        self.ecc_scales = tuple(sorted(ecc_scales))
+        self.shape = template_img.shape[:2]
+
+        self.levels = {}
+        h, w = self.shape
+        for scale in (coarse_scale,) + self.ecc_scales:
+            # dsize explícito: o cv2.resize usa então exatamente a razão dsize/tamanho, como em level_matrix
+            size = (max(1, round(w * scale)), max(1, round(h * scale)))
+            gray = _to_gray(cv2.resize(template_img, size, interpolation=cv2.INTER_AREA))
+            level_mask = None
+            if mask is not None:
+                level_mask = cv2.resize(mask, (gray.shape[1], gray.shape[0]), interpolation=cv2.INTER_NEAREST)
+            self.levels[scale] = (gray, level_mask)
+
+        self.coarse_keypoints, self.coarse_descriptors = orb.detectAndCompute(self.levels[coarse_scale][0], None)
+
+    def level_matrix(self, scale):
+        # Coordenadas de resolução total do template -> coordenadas do nível
+        h, w = self.levels[scale][0].shape
+        return _scale_matrix(w / self.shape[1], h / self.shape[0])
+
+
+def _current_pyramid(current_img, template_pyramid):
+    """
+    Reduz a imagem atual para o tamanho de cada nível do template (a câmara pode ter outra resolução).
+    A redução é feita em cadeia, do maior para o menor nível.
+
+    Returns:
+        dict: {escala: (imagem cinza, matriz resolução total -> nível)}
+    """
+    ch, cw = current_img.shape[:2]
+    levels = {}
+    previous = _to_gray(current_img)
+    for scale in sorted(template_pyramid.levels, reverse=True):
+        h, w = template_pyramid.levels[scale][0].shape
+        interpolation = cv2.INTER_AREA if w <= previous.shape[1] else cv2.INTER_LINEAR
+        previous = cv2.resize(previous, (w, h), interpolation=interpolation)
+        levels[scale] = (previous, _scale_matrix(w / cw, h / ch))
+    return levels
+
+
+def _align_pyramid_ecc(current_img, template_img, config, template_pyramid=None, mask=None):
+    """
+    Homografia grosseira com ORB no nível mais pequeno, refinada com ECC nos níveis seguintes
+    (apenas dentro da máscara da folha).
+
+    Returns:
+        tuple: (H, AlignmentQuality)
+    """
+    ecc_scales = tuple(sorted(config["ecc_scales"]))
+    if template_pyramid is None or template_pyramid.ecc_scales != ecc_scales:
+        template_pyramid = TemplatePyramid(template_img, mask, ecc_scales=ecc_scales)
+
+    coarse_scale = template_pyramid.coarse_scale
+    current_levels = _current_pyramid(current_img, template_pyramid)
+
+    coarse_gray, S_cur = current_levels[coarse_scale]
+    kpts2, desc2 = orb.detectAndCompute(coarse_gray, None)
+    H_level, stats = _estimate_homography(template_pyramid.coarse_keypoints, template_pyramid.coarse_descriptors,
+                                          kpts2, desc2, config, 1.0,
+                                          template_pyramid.levels[coarse_scale][0].shape, coarse_gray.shape)
+    H = np.linalg.inv(template_pyramid.level_matrix(coarse_scale)) @ H_level @ S_cur
+    # O RMSE do nível grosseiro não descreve a H final (refinada pelo ECC); a qualidade vem da correlação
+    stats["rmse"] = None
+    correlation = None
+
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, config["ecc_iterations"], config["ecc_epsilon"])
+    for scale in template_pyramid.ecc_scales:
+        tpl_gray, level_mask = template_pyramid.levels[scale]
+        cur_gray, S_cur = current_levels[scale]
+        S_tpl = template_pyramid.level_matrix(scale)
+
+        # A máscara do ECC aplica-se à imagem de entrada, por isso o template (com a máscara da folha)
+        # entra como entrada: template(W(x)) ~ current(x), logo W é a própria H (atual -> template)
+        warp = (S_tpl @ H @ np.linalg.inv(S_cur)).astype(np.float32)
+        try:
+            correlation, warp = cv2.findTransformECC(cur_gray, tpl_gray, warp, cv2.MOTION_HOMOGRAPHY,
+                                           criteria, level_mask, config["ecc_gauss_size"])
+        except cv2.error as e:
+            # Sem convergência: mantém a estimativa do nível anterior
+            print(f"[WARN] ECC não convergiu no nível {scale}: {e}")
+            continue
+        H = np.linalg.inv(S_tpl) @ warp.astype(np.float64) @ S_cur
+
+    H = H / H[2, 2]
+    return H, AlignmentQuality("pyramid_ecc", H, correlation=correlation,
+                               expected_det=_expected_det(template_img, current_img), **stats)
+
+
+class PhaseTemplate:
+    """
+    Template-side data for the "phase" mode, built once per template.
+
+    Holds the gray template reduced to `scale`, the region of interest (bounding
+    box of the leaf mask) used for phase correlation and the log-polar magnitude
+    spectrum of its central square, used to estimate the rotation.
+    """
+
+    def __init__(self, template_img, mask=None, scale=0.25, polar_size=512):
+        self.scale = scale
+        self.polar_size = polar_size
+        self.shape = template_img.shape[:2]
+
+        h, w = self.shape
+        self.size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        self.gray = _to_gray(cv2.resize(template_img, self.size, interpolation=cv2.INTER_AREA)).astype(np.float32)
+
+        # Multiplicar pela máscara criaria arestas fixas que dominam a correlação; usa-se só a sua caixa
+        x, y, bw, bh = 0, 0, self.size[0], self.size[1]
+        if mask is not None:
+            level_mask = cv2.resize(mask, self.size, interpolation=cv2.INTER_NEAREST)
+            if cv2.countNonZero(level_mask):
+                x, y, bw, bh = cv2.boundingRect(level_mask)
+        self.roi = (x, y, bw, bh)
+        self.window = cv2.createHanningWindow((bw, bh), cv2.CV_32F)
+
+        # Quadrado central da ROI: o espectro só roda com a imagem se as frequências tiverem a mesma escala em x e y
+        side = min(bw, bh)
+        self.square = (x + (bw - side) // 2, y + (bh - side) // 2, side)
+        self.square_window = cv2.createHanningWindow((side, side), cv2.CV_32F)
+        # A DFT é feita num lado rápido (getOptimalDFTSize, ex. 635 -> 640): a janela já leva o quadrado a 0 nas bordas
+        self.dft_size = cv2.getOptimalDFTSize(side)
+        n = self.dft_size
+        fy, fx = np.mgrid[-0.5:0.5:n * 1j, -0.5:0.5:n * 1j]
+        c = np.cos(np.pi * fx) * np.cos(np.pi * fy)
+        self.highpass = ((1.0 - c) * (2.0 - c)).astype(np.float32)
+
+        self.log_polar = self.log_polar_spectrum(self.gray)
+
+    def log_polar_spectrum(self, gray):
+        """Log-polar map of the (high-passed) FFT magnitude of the central square: rotations become row shifts."""
+        x, y, side = self.square
+        patch = gray[y:y + side, x:x + side]
+        patch = (patch - patch.mean()) * self.square_window
+        n = self.dft_size
+        patch = cv2.copyMakeBorder(patch, 0, n - side, 0, n - side, cv2.BORDER_CONSTANT, value=0)
+        spectrum = cv2.dft(patch, flags=cv2.DFT_COMPLEX_OUTPUT)
+        magnitude = np.fft.fftshift(cv2.magnitude(spectrum[..., 0], spectrum[..., 1])) * self.highpass
+        return cv2.warpPolar(magnitude, (self.polar_size, self.polar_size), (n / 2, n / 2), n / 2,
+                             cv2.WARP_POLAR_LOG + cv2.INTER_LINEAR)
+
+    def crop(self, gray):
+        x, y, bw, bh = self.roi
+        return gray[y:y + bh, x:x + bw]
+
+    def level_matrix(self):
+        # Coordenadas de resolução total do template -> coordenadas do nível
+        return _scale_matrix(self.size[0] / self.shape[1], self.size[1] / self.shape[0])
+
+
+def _rigid_from_shifts(centers, shifts):
+    """
+    Transformação rígida (rotação + translação, 3x3) que leva `centers + shifts` para `centers` (Kabsch).
+    """
+    src = centers + shifts
+    src_mean, dst_mean = src.mean(axis=0), centers.mean(axis=0)
+    cov = (src - src_mean).T @ (centers - dst_mean)
+    u, _, vt = np.linalg.svd(cov)
+    R = (u @ vt).T
+    if np.linalg.det(R) < 0:
+        vt[-1] *= -1
+        R = (u @ vt).T
+    A = np.eye(3)
+    A[:2, :2] = R
+    A[:2, 2] = dst_mean - R @ src_mean
+    return A
+
+
+def _align_phase(current_img, template_img, config, phase_template=None, mask=None):
+    """
+    Alinhamento só com rotação + translação por correlação de fase, num nível reduzido (`phase_scale`).
+
+    A rotação vem da correlação de fase dos espectros log-polar, a translação da correlação de fase da ROI.
+    Depois, `phase_refine_iterations` vezes, a ROI é dividida em quadrantes e a transformação rígida é
+    corrigida a partir do deslocamento de cada quadrante.
+
+    Returns:
+        tuple: (H 3x3 afim, atual -> template em resolução total; AlignmentQuality com a resposta mínima
+            dos picos de correlação em `correlation`)
+    """
+    if (phase_template is None or phase_template.scale != config["phase_scale"]
+            or phase_template.polar_size != config["phase_polar_size"]):
+        phase_template = PhaseTemplate(template_img, mask, config["phase_scale"], config["phase_polar_size"])
+
+    ch, cw = current_img.shape[:2]
+    lw, lh = phase_template.size
+    # Mesma redução que o template (não esticar para o tamanho dele: uma folha enquadrada de outra
+    # forma ganharia uma escala que a transformação rígida não corrige); completa-se até (lw, lh)
+    scale = phase_template.scale
+    size = (max(1, round(cw * scale)), max(1, round(ch * scale)))
+    interpolation = cv2.INTER_AREA if scale <= 1 else cv2.INTER_LINEAR
+    cur_gray = cv2.resize(_to_gray(current_img), size, interpolation=interpolation).astype(np.float32)
+    cur_gray = cv2.copyMakeBorder(cur_gray, 0, max(0, lh - size[1]), 0, max(0, lw - size[0]), cv2.BORDER_REPLICATE)
+    S_cur = _scale_matrix(size[0] / cw, size[1] / ch)
+
+    # Rotação: deslocamento vertical (eixo angular) entre os espectros log-polar
+    (_, shift_angle), rot_response = cv2.phaseCorrelate(phase_template.log_polar,
+                                                        phase_template.log_polar_spectrum(cur_gray))
+    angle = shift_angle * 360.0 / phase_template.polar_size
+    x, y, bw, bh = phase_template.roi
+    A = np.vstack([cv2.getRotationMatrix2D((x + bw / 2, y + bh / 2), angle, 1.0), [0, 0, 1]])
+
+    # Translação
+    tpl_roi = phase_template.crop(phase_template.gray)
+    rotated = cv2.warpAffine(cur_gray, A[:2], (lw, lh), borderMode=cv2.BORDER_REPLICATE)
+    (dx, dy), response = cv2.phaseCorrelate(tpl_roi, phase_template.crop(rotated), phase_template.window)
+    A = np.array([[1, 0, -dx], [0, 1, -dy], [0, 0, 1]]) @ A
+
+    # Refinamento por quadrantes (a rotação do espectro tem uma resolução de ~360/polar_size graus)
+    half_w, half_h = bw // 2, bh // 2
+    quadrant_window = cv2.createHanningWindow((half_w, half_h), cv2.CV_32F)
+    for _ in range(config["phase_refine_iterations"]):
+        warped = phase_template.crop(cv2.warpAffine(cur_gray, A[:2], (lw, lh), borderMode=cv2.BORDER_REPLICATE))
+        centers, shifts = [], []
+        for qy in (0, half_h):
+            for qx in (0, half_w):
+                (sx, sy), _ = cv2.phaseCorrelate(tpl_roi[qy:qy + half_h, qx:qx + half_w],
+                                                 warped[qy:qy + half_h, qx:qx + half_w], quadrant_window)
+                centers.append((x + qx + half_w / 2, y + qy + half_h / 2))
+                shifts.append((sx, sy))
+        A = _rigid_from_shifts(np.array(centers), np.array(shifts)) @ A
+
+    H = np.linalg.inv(phase_template.level_matrix()) @ A @ S_cur
+    return H, AlignmentQuality("phase", H, correlation=min(rot_response, response),
+                               expected_det=_expected_det(template_img, current_img))
+
+
+def _align_orb(current_img, template_img, config, resize_scale, template_features=None):
+    # ORB + Matching (features do template vêm da cache quando disponíveis)
+    if template_features is not None and template_features.resize_scale == resize_scale:
+        kpts1, desc1 = template_features.keypoints, template_features.descriptors
+    else:
+        kpts1, desc1 = extract_orb_features(template_img, resize_scale)
+    kpts2, desc2 = extract_orb_features(current_img, resize_scale)
+    H, stats = _estimate_homography(kpts1, desc1, kpts2, desc2, config, resize_scale,
+                                    _scaled_shape(template_img, resize_scale), _scaled_shape(current_img, resize_scale))
+    return H, AlignmentQuality("orb", H, expected_det=_expected_det(template_img, current_img), **stats)
+
+
+def align_with_template(current_img, template_img, config_path="config/config_alignment.json", resize_scale=0.5,
+                        template_features=None, mode=None, template_pyramid=None, mask=None, warper=None,
+                        phase_template=None, return_quality=False):
+    """
+    Alinha a imagem atual com o template usando ORB + Homografia, redimensionando temporariamente para acelerar o processo.
+    Se `template_features` (ver models.template_features) for fornecido, os descritores do template não são recalculados.
+
+    Modos (`mode`, ou a chave "mode" do ficheiro de configuração):
+        "orb": ORB + RANSAC a `resize_scale`.
+        "pyramid_ecc": ORB num nível grosseiro (1/8) refinado com ECC nos níveis "ecc_scales", restrito a `mask`.
+            `template_pyramid` (TemplatePyramid) evita recalcular o lado do template em cada chamada.
+        "phase": só rotação + translação, por correlação de fase a "phase_scale" (`phase_template`: PhaseTemplate).
+            Se o pico de correlação ficar abaixo de "phase_min_response", recorre ao modo "orb".
+
+    Se `warper` (models.region_warp.RegionWarper) for fornecido, só as regiões das latas/máscara são reamostradas.
+    Com `return_quality=True` devolve (aligned, H, AlignmentQuality); ver AlignmentQuality.rejection_reasons.
+    """
+    start_time = time.perf_counter()
+
+    # Carregar parâmetros (cache em memória, recarrega só se o ficheiro mudar)
+    config = get_config(config_path, ALIGNMENT_SCHEMA)
+
+    max_features = config["max_features"]
+
+    mode = mode or config["mode"]
+    if mode not in ALIGNMENT_MODES:
+        raise ValueError(f"Modo de alinhamento desconhecido: {mode}")
+
+    H = None
+    if mode == "pyramid_ecc":
+        H, quality = _align_pyramid_ecc(current_img, template_img, config, template_pyramid, mask)
+    elif mode == "phase":
+        H, quality = _align_phase(current_img, template_img, config, phase_template, mask)
+        if quality.correlation < config["phase_min_response"]:
+            print(f"[WARN] Correlação de fase fraca ({quality.correlation:.3f}), a usar ORB")
+            H, mode = None, "phase->orb"
+    if H is None:
+        H, quality = _align_orb(current_img, template_img, config, resize_scale, template_features)
+
     # Aplicar na imagem em alta resolução
-    h, w = to_gray(template_img).shape
-    aligned = cv2.warpPerspective(current_img, H, (w, h))
+    h, w = template_img.shape[:2]
+    if warper is not None:
+        aligned = warper.warp(current_img, H)
+    elif mode == "phase":
+        aligned = cv2.warpAffine(current_img, H[:2], (w, h))
+    else:
+        aligned = cv2.warpPerspective(current_img, H, (w, h))
 
     end_time = time.perf_counter()
-    print(f"Align Image (com resize) demorou {end_time - start_time:.4f} segundos")
+    print(f"Align Image ({mode}) demorou {end_time - start_time:.4f} segundos [{quality}]")
 
+    if return_quality:
+        return aligned, H, quality
     return aligned, H
-
@@ -0,0 +1,144 @@
+import time
+
+import cv2
+import numpy as np
+
+from config.config_registry import get_config, ALIGNMENT_SCHEMA
+from models.align_image import align_with_template, _to_gray
+
+
+class AlignmentSession:
+    """
+    Remembers the last accepted homography between consecutive sheets.
+
+    Before running the full alignment, the previous H is verified on a few
+    textured template patches: each patch is searched (matchTemplate) in the
+    new frame warped with H around its expected position. If the median
+    residual is within `session_tolerance_px` the previous H is reused (hit),
+    otherwise `align_with_template` runs from scratch (miss).
+    """
+
+    def __init__(self, template_img, mask=None, config_path="config/config_alignment.json",
+                 num_patches=12, patch_size=64, **align_kwargs):
+        self.template_img = template_img
+        self.mask = mask
+        self.config_path = config_path
+        self.patch_size = patch_size
+        self.align_kwargs = dict(align_kwargs, mask=mask)
+
+        self.last_H = None
+        self.last_drift = None
+        self.last_quality = None
+        self.last_rejection = []
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+
+        self.patches = self._select_patches(num_patches)
+
+    def _select_patches(self, num_patches, detect_scale=0.25):
+        # Cantos fortes e bem espalhados (numa versão reduzida do template), longe dos limites da máscara
+        gray = _to_gray(self.template_img)
+        small = cv2.resize(gray, (0, 0), fx=detect_scale, fy=detect_scale, interpolation=cv2.INTER_AREA)
+
+        half = self.patch_size // 2
+        border = int(np.ceil(half * detect_scale)) + 1
+        valid = np.zeros(small.shape, np.uint8)
+        valid[border:-border, border:-border] = 255
+        if self.mask is not None:
+            small_mask = cv2.resize(self.mask, (small.shape[1], small.shape[0]), interpolation=cv2.INTER_NEAREST)
+            small_mask = cv2.erode(small_mask, np.ones((2 * border + 1, 2 * border + 1), np.uint8))
+            valid = cv2.bitwise_and(valid, small_mask)
+
+        min_distance = max(small.shape) / (np.sqrt(num_patches) + 1)
+        corners = cv2.goodFeaturesToTrack(small, num_patches, 0.01, min_distance, mask=valid, blockSize=7)
+        if corners is None:
+            return []
+
+        patches = []
+        for cx, cy in np.round(corners.reshape(-1, 2) / detect_scale).astype(int):
+            patch = gray[cy - half:cy + half, cx - half:cx + half]
+            if patch.shape == (self.patch_size, self.patch_size) and patch.std() > 1.0:
+                patches.append(((int(cx), int(cy)), patch))
+        return patches
+
+    def verify(self, current_img, H, search_px=12, min_score=0.8):
+        """
+        Measures how far `H` is from aligning `current_img`, in template pixels.
+
+        Returns:
+            float or None: Median patch displacement, or None if too few patches matched.
+        """
+        half = self.patch_size // 2
+        win = self.patch_size + 2 * search_px
+        displacements = []
+
+        for (cx, cy), patch in self.patches:
+            x0, y0 = cx - half - search_px, cy - half - search_px
+            # Só a janela de pesquisa é reamostrada para o espaço do template
+            T = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+            window = cv2.warpPerspective(current_img, T @ H, (win, win), borderMode=cv2.BORDER_CONSTANT)
+            result = cv2.matchTemplate(_to_gray(window), patch, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (px, py) = cv2.minMaxLoc(result)
+            if score >= min_score:
+                displacements.append(np.hypot(px - search_px, py - search_px))
+
+        if len(displacements) < max(3, len(self.patches) // 2):
+            return None
+        return float(np.median(displacements))
+
+    def align(self, current_img):
+        """
+        Aligns `current_img`, reusing the previous homography when it still fits.
+
+        After a full alignment the quality gate ("gate_*" config keys) is applied:
+        the reasons end up in `last_rejection` (empty if accepted) and a rejected
+        homography is never reused for the next sheet.
+
+        Returns:
+            tuple: (aligned, H), as `align_with_template`.
+        """
+        start_time = time.perf_counter()
+        config = get_config(self.config_path, ALIGNMENT_SCHEMA)
+
+        if self.last_H is not None and self.patches:
+            self.last_drift = self.verify(current_img, self.last_H,
+                                          config["session_search_px"], config["session_min_score"])
+            if self.last_drift is not None and self.last_drift <= config["session_tolerance_px"]:
+                self.hits += 1
+                self.last_rejection = []
+                warper = self.align_kwargs.get("warper")
+                if warper is not None:
+                    aligned = warper.warp(current_img, self.last_H)
+                else:
+                    h, w = self.template_img.shape[:2]
+                    aligned = cv2.warpPerspective(current_img, self.last_H, (w, h))
+                print(f"Align Image (sessão, H reutilizada, drift={self.last_drift:.2f}px) demorou "
+                      f"{time.perf_counter() - start_time:.4f} segundos")
+                return aligned, self.last_H
+
+        self.misses += 1
+        aligned, H, self.last_quality = align_with_template(current_img, self.template_img, self.config_path,
+                                                            return_quality=True, **self.align_kwargs)
+        self.last_rejection = self.last_quality.rejection_reasons(config) if config["gate_enabled"] else []
+        if self.last_rejection:
+            self.rejections += 1
+            self.last_H = None
+        else:
+            self.last_H = H
+        return aligned, H
+
+    def reset(self):
+        self.last_H = None
+        self.last_drift = None
+        self.last_quality = None
+        self.last_rejection = []
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate, "last_drift": self.last_drift,
+                "rejections": self.rejections}
@@ -0,0 +1,318 @@
+import argparse
+import contextlib
+import csv
+import glob
+import io
+import itertools
+import json
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from config.config import IMAGE_EXTENSIONS
+from config.utils import load_params, save_params
+from models.defect_detector import PreparedTemplate, DETECT_PARAM_KEYS
+from models.incremental_detector import IncrementalDefectDetector
+from models.parallel_detector import resolve_workers
+
+# Colunas de logs/param_history.csv (mesma ordem que o DefectTunerWindow)
+HISTORY_KEYS = ("dark_threshold", "bright_threshold", "blue_threshold", "red_threshold",
+                "dark_morph_kernel_size", "dark_morph_iterations",
+                "bright_morph_kernel_size", "bright_morph_iterations",
+                "dark_gradient_threshold", "detect_area")
+
+# Valores a experimentar por parâmetro (pode ser substituído em parte com --space ficheiro.json)
+SEARCH_SPACE = {
+    "dark_threshold": [20, 30, 40, 50, 60],
+    "bright_threshold": [15, 20, 25, 30, 40],
+    "blue_threshold": [15, 20, 25, 30, 40],
+    "red_threshold": [15, 20, 25, 30, 40],
+    "dark_morph_kernel_size": [1, 3, 5],
+    "dark_morph_iterations": [1, 2],
+    "bright_morph_kernel_size": [1, 3, 5],
+    "bright_morph_iterations": [1, 2],
+    "dark_gradient_threshold": [10, 20, 30, 40, 60],
+    "detect_area": [1, 3, 6, 10, 20],
+}
+
+_worker = None  # estado de cada processo do pool (ver _init_worker)
+
+
+def load_annotations(path):
+    """
+    Ground truth of one sheet: JSON {"defects": [[x, y, w, h], ...]} in aligned-sheet pixels
+    (an empty list marks a good sheet).
+
+    Returns:
+        np.ndarray: int32 (N, 4) boxes.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        boxes = json.load(f).get("defects", [])
+    boxes = np.asarray(boxes, np.int32).reshape(-1, 4)
+    if (boxes[:, 2:] <= 0).any():
+        raise ValueError(f"{path}: caixas com largura/altura <= 0")
+    return boxes
+
+
+def find_labeled_sheets(folder):
+    """
+    Aligned sheets of `folder` that have a `<name>.json` annotation next to them.
+
+    Returns:
+        list: [(name, image_path, boxes)], sorted by name.
+    """
+    sheets = []
+    for path in sorted(glob.glob(os.path.join(folder, "*"))):
+        stem, ext = os.path.splitext(path)
+        if ext.lower() not in IMAGE_EXTENSIONS:
+            continue
+        if not os.path.exists(stem + ".json"):
+            print(f"[WARN] {path} sem anotação ({os.path.basename(stem)}.json), ignorada")
+            continue
+        sheets.append((os.path.basename(stem), path, load_annotations(stem + ".json")))
+    return sheets
+
+
+def _cache_files(cache_dir, name):
+    return {key: os.path.join(cache_dir, f"{name}.{key}.npy")
+            for key in ("aligned",) + IncrementalDefectDetector._RAW_BUFFERS}
+
+
+def build_cache(sheets, template_path, mask_path, cache_dir):
+    """
+    Saves, per sheet, the masked aligned image and its parameter-independent differences
+    (IncrementalDefectDetector.raw_differences) as .npy files, so the workers memory-map them
+    instead of redoing the preprocessing for every candidate. Files newer than the sheet,
+    template and mask are reused.
+
+    Returns:
+        float: Median preprocessing time per sheet (s) of the sheets computed now, or None.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    template = cv2.imread(template_path)
+    mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    detector = IncrementalDefectDetector(PreparedTemplate(template, mask), mask)
+    inputs_mtime = max(os.path.getmtime(template_path), os.path.getmtime(mask_path))
+
+    times = []
+    for name, path, _ in sheets:
+        files = _cache_files(cache_dir, name)
+        newest_input = max(inputs_mtime, os.path.getmtime(path))
+        if all(os.path.exists(f) and os.path.getmtime(f) >= newest_input for f in files.values()):
+            continue
+
+        aligned = cv2.imread(path)
+        if aligned is None or aligned.shape[:2] != detector.shape:
+            raise ValueError(f"{path}: não é uma folha alinhada com o tamanho do template {detector.shape}")
+        aligned = cv2.bitwise_and(aligned, aligned, mask=mask)
+        start = time.perf_counter()
+        raw = detector.raw_differences(aligned)
+        times.append(time.perf_counter() - start)
+
+        np.save(files["aligned"], aligned)
+        for key, array in raw.items():
+            np.save(files[key], array)
+        print(f"[INFO] Cache de {name} criada")
+    return statistics.median(times) if times else None
+
+
+def candidates(space, samples=0, seed=0):
+    """
+    Parameter sets of the grid `space` ({key: [values]}): all of them (samples=0) or `samples`
+    distinct ones drawn at random. Each is a dict with the DETECT_PARAM_KEYS.
+    """
+    keys = list(DETECT_PARAM_KEYS)
+    values = [space[key] for key in keys]
+    total = int(np.prod([len(v) for v in values]))
+    if samples <= 0 or samples >= total:
+        return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+    rng = random.Random(seed)
+    chosen = set()
+    while len(chosen) < samples:
+        chosen.add(tuple(rng.choice(v) for v in values))
+    return [dict(zip(keys, combo)) for combo in sorted(chosen)]
+
+
+def match_defects(records, boxes, tolerance=0):
+    """
+    Matches detected defects to ground-truth boxes by bounding-box overlap (ground truth grown by
+    `tolerance` pixels on each side).
+
+    Returns:
+        tuple: (detections that hit a box, boxes hit by some detection)
+    """
+    if len(records) == 0 or len(boxes) == 0:
+        return 0, 0
+    x0 = boxes[:, 0] - tolerance
+    y0 = boxes[:, 1] - tolerance
+    x1 = boxes[:, 0] + boxes[:, 2] + tolerance
+    y1 = boxes[:, 1] + boxes[:, 3] + tolerance
+    rx, ry = records["x"][:, None], records["y"][:, None]
+    overlap = ((rx < x1) & (rx + records["w"][:, None] > x0) &
+               (ry < y1) & (ry + records["h"][:, None] > y0))
+    return int(overlap.any(axis=1).sum()), int(overlap.any(axis=0).sum())
+
+
+def _init_worker(template_path, mask_path, cache_dir, sheets):
+    global _worker
+    template = cv2.imread(template_path)
+    mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    loaded = []
+    for name, _, boxes in sheets:
+        files = _cache_files(cache_dir, name)
+        arrays = {key: np.load(f, mmap_mode="r") for key, f in files.items()}
+        loaded.append((arrays.pop("aligned"), arrays, boxes))
+    _worker = {"detector": IncrementalDefectDetector(PreparedTemplate(template, mask), mask), "sheets": loaded}
+
+
+def _evaluate(batch, tolerance):
+    # Avalia cada candidato em todas as folhas (diferenças da cache: só as etapas que dependem dos parâmetros)
+    detector = _worker["detector"]
+    results = []
+    for params in batch:
+        args = [params[key] for key in DETECT_PARAM_KEYS]
+        hits = detections = found = expected = 0
+        latencies = []
+        for aligned, raw, boxes in _worker["sheets"]:
+            detector.set_raw_differences(aligned, raw)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, records, *_ = detector.detect(aligned, *args)
+            latencies.append(time.perf_counter() - start)
+            sheet_hits, sheet_found = match_defects(records, boxes, tolerance)
+            hits += sheet_hits
+            detections += len(records)
+            found += sheet_found
+            expected += len(boxes)
+
+        precision = hits / detections if detections else 1.0
+        recall = found / expected if expected else 1.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        results.append(dict(params, precision=precision, recall=recall, f1=f1,
+                            latency_ms=round(1000 * statistics.median(latencies), 2), detections=detections))
+    return results
+
+
+def run_search(sheets, template_path, mask_path, cache_dir, params_list, workers=0, tolerance=0):
+    """
+    Evaluates every parameter set on the labeled sheets in a process pool.
+
+    Returns:
+        list: One dict per candidate: the parameters plus precision, recall, f1, latency_ms
+        (median per-sheet detection time with cached differences) and detections.
+    """
+    workers = resolve_workers(workers)
+    # Lotes pequenos: repartem bem a carga e mostram o progresso
+    batch_size = max(1, min(16, len(params_list) // (4 * workers)))
+    batches = [params_list[i:i + batch_size] for i in range(0, len(params_list), batch_size)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(template_path, mask_path, cache_dir, sheets)) as executor:
+        for batch_results in executor.map(_evaluate, batches, itertools.repeat(tolerance)):
+            results.extend(batch_results)
+            print(f"[INFO] {len(results)}/{len(params_list)} candidatos avaliados")
+    return results
+
+
+def pareto_front(results):
+    """
+    Candidates not dominated on (precision ↑, recall ↑, latency ↓), sorted by f1 then latency.
+    """
+    p = np.array([r["precision"] for r in results])
+    r_ = np.array([r["recall"] for r in results])
+    lat = np.array([r["latency_ms"] for r in results])
+    front = []
+    for i in range(len(results)):
+        dominated = ((p >= p[i]) & (r_ >= r_[i]) & (lat <= lat[i]) &
+                     ((p > p[i]) | (r_ > r_[i]) | (lat < lat[i])))
+        if not dominated.any():
+            front.append(results[i])
+    return sorted(front, key=lambda r: (-r["f1"], r["latency_ms"]))
+
+
+def write_report(results, front, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    front_ids = {id(r) for r in front}
+    columns = list(DETECT_PARAM_KEYS) + ["precision", "recall", "f1", "latency_ms", "detections", "pareto"]
+    with open(path, mode="w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile, delimiter=';')
+        writer.writerow(columns)
+        for r in sorted(results, key=lambda r: (-r["f1"], r["latency_ms"])):
+            writer.writerow([r[c] for c in columns[:-1]] + [int(id(r) in front_ids)])
+
+
+def save_best(best, param_path="config/inspection_params.json", log_path="logs/param_history.csv"):
+    """
+    Writes the chosen parameters to the params file (keeping its other keys) and logs them to
+    the parameter history, as the defect tuner does.
+    """
+    params = {key: str(best[key]) for key in HISTORY_KEYS}
+    existing = load_params(param_path) if os.path.exists(param_path) else {}
+    save_params(param_path, dict(existing, **params))
+
+    os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+    file_exists = os.path.isfile(log_path)
+    with open(log_path, mode="a", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile, delimiter=';')
+        if not file_exists:
+            writer.writerow(["timestamp", "user", "user_type"] + list(params.keys()))
+        writer.writerow([datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "auto_tune", "auto_tune"]
+                        + list(params.values()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Procura automática dos parâmetros de deteção numa pasta "
+                                                 "de folhas alinhadas anotadas (<nome>.json)")
+    parser.add_argument("folder", help="Pasta com as folhas alinhadas e as anotações")
+    parser.add_argument("--template", default="data/raw/fba_template.jpg")
+    parser.add_argument("--mask", default="data/mask/leaf_mask.png")
+    parser.add_argument("--params", default="config/inspection_params.json")
+    parser.add_argument("--space", help="JSON {parâmetro: [valores]} que substitui parte do SEARCH_SPACE")
+    parser.add_argument("--samples", type=int, default=200, help="Candidatos aleatórios da grelha (0 = grelha toda)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=0, help="Processos (0 = número de cores)")
+    parser.add_argument("--tolerance", type=int, default=5, help="Margem (px) das caixas anotadas")
+    parser.add_argument("--cache-dir", help="Cache das diferenças (por omissão <pasta>/.tune_cache)")
+    parser.add_argument("--report", default=f"logs/auto_tune_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    parser.add_argument("--dry-run", action="store_true", help="Não escreve os parâmetros escolhidos")
+    args = parser.parse_args()
+
+    space = dict(SEARCH_SPACE)
+    if args.space:
+        with open(args.space, "r", encoding="utf-8") as f:
+            space.update(json.load(f))
+
+    sheets = find_labeled_sheets(args.folder)
+    if not sheets:
+        raise SystemExit(f"Nenhuma folha anotada em {args.folder}")
+    cache_dir = args.cache_dir or os.path.join(args.folder, ".tune_cache")
+    prep_time = build_cache(sheets, args.template, args.mask, cache_dir)
+    if prep_time is not None:
+        print(f"[INFO] Pré-processamento (feito uma vez por folha): {1000 * prep_time:.0f} ms")
+
+    params_list = candidates(space, args.samples, args.seed)
+    print(f"[INFO] {len(params_list)} candidatos x {len(sheets)} folhas")
+    results = run_search(sheets, args.template, args.mask, cache_dir, params_list, args.workers, args.tolerance)
+    front = pareto_front(results)
+    write_report(results, front, args.report)
+
+    print(f"{'precisão':>8} | {'recall':>6} | {'f1':>5} | {'ms/folha':>8} | parâmetros (frente de Pareto)")
+    for r in front[:15]:
+        values = " ".join(str(r[key]) for key in DETECT_PARAM_KEYS)
+        print(f"{r['precision']:>8.3f} | {r['recall']:>6.3f} | {r['f1']:>5.3f} | {r['latency_ms']:>8.1f} | {values}")
+    print(f"[INFO] Relatório completo em {args.report}")
+
+    best = front[0]
+    if args.dry_run:
+        print("[INFO] --dry-run: parâmetros não guardados")
+    else:
+        save_best(best, args.params)
+        print(f"[INFO] Melhor da frente (f1 {best['f1']:.3f}, {best['latency_ms']:.1f} ms) guardado em {args.params}")
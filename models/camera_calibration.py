@@ -0,0 +1,202 @@
+import argparse
+import glob
+import os
+
+import cv2
+import numpy as np
+
+RECTIFY_MAPS_PATH = "config/camera_rectify_maps.npz"
+
+
+def find_chessboard(img, pattern_size):
+    """
+    Deteta os cantos interiores do tabuleiro de calibração, refinados ao subpíxel.
+
+    Returns:
+        np.array or None: Cantos (N x 1 x 2, float32) ou None se o tabuleiro não for encontrado.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+    found, corners = cv2.findChessboardCorners(
+        gray, pattern_size, flags=cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE)
+    if not found:
+        return None
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+    return cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
+
+
+def _tilt_rotation(rvec):
+    """
+    Rotação mínima que põe o plano do tabuleiro de frente para a câmara (normal do plano -> eixo z).
+    A rotação no próprio plano não é alterada; essa fica para o alinhamento com o template.
+    """
+    R_board, _ = cv2.Rodrigues(rvec)
+    normal = R_board[:, 2]
+    if normal[2] < 0:
+        normal = -normal
+    axis = np.cross(normal, [0.0, 0.0, 1.0])
+    sin_angle = np.linalg.norm(axis)
+    if sin_angle < 1e-12:
+        return np.eye(3)
+    angle = np.arctan2(sin_angle, normal[2])
+    R, _ = cv2.Rodrigues(axis / sin_angle * angle)
+    return R
+
+
+def _rectified_camera_matrix(K, dist, R, size):
+    """
+    Matriz da câmara retificada que mantém todo o campo de visão dentro de `size`, sem mudar a proporção.
+    """
+    w, h = size
+    t = np.linspace(0, 1, 32)
+    border = np.concatenate([
+        np.stack([t * (w - 1), np.zeros_like(t)], axis=1),
+        np.stack([t * (w - 1), np.full_like(t, h - 1)], axis=1),
+        np.stack([np.zeros_like(t), t * (h - 1)], axis=1),
+        np.stack([np.full_like(t, w - 1), t * (h - 1)], axis=1),
+    ]).reshape(-1, 1, 2)
+    mapped = cv2.undistortPoints(border, K, dist, R=R, P=K).reshape(-1, 2)
+
+    (x0, y0), (x1, y1) = mapped.min(axis=0), mapped.max(axis=0)
+    scale = min((w - 1) / (x1 - x0), (h - 1) / (y1 - y0))
+    S = np.array([[scale, 0, -x0 * scale], [0, scale, -y0 * scale], [0, 0, 1]])
+    return S @ K
+
+
+def calibrate_camera(image_paths, pattern_size=(9, 6), square_size=1.0, reference_index=0):
+    """
+    Calibra a câmara a partir de fotografias de um tabuleiro de xadrez.
+
+    Args:
+        image_paths (list): Fotografias do tabuleiro, todas com a resolução de captura.
+        pattern_size (tuple): Cantos interiores do tabuleiro (colunas, linhas).
+        square_size (float): Lado de cada quadrado (só afeta as translações, não os mapas).
+        reference_index (int): Índice em `image_paths` da fotografia com o tabuleiro pousado no plano da
+            folha; a sua inclinação é a que a retificação corrige (ValueError se o tabuleiro não for detetado nela).
+
+    Returns:
+        dict: {"K", "dist", "R", "new_K", "size", "rms"}
+    """
+    objp = np.zeros((pattern_size[0] * pattern_size[1], 3), np.float32)
+    objp[:, :2] = np.mgrid[0:pattern_size[0], 0:pattern_size[1]].T.reshape(-1, 2) * square_size
+
+    object_points, image_points, used_paths = [], [], []
+    size = None
+    for path in image_paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"[WARN] Não foi possível ler {path}")
+            continue
+        if size is None:
+            size = (img.shape[1], img.shape[0])
+        elif (img.shape[1], img.shape[0]) != size:
+            print(f"[WARN] {path} tem outra resolução, ignorada")
+            continue
+        corners = find_chessboard(img, pattern_size)
+        if corners is None:
+            print(f"[WARN] Tabuleiro não encontrado em {path}")
+            continue
+        object_points.append(objp)
+        image_points.append(corners)
+        used_paths.append(path)
+
+    if len(image_points) < 3:
+        raise ValueError("São precisas pelo menos 3 imagens com o tabuleiro detetado.")
+
+    rms, K, dist, rvecs, _ = cv2.calibrateCamera(object_points, image_points, size, None, None)
+    print(f"[INFO] Calibração com {len(image_points)} imagens, erro RMS {rms:.3f}px")
+
+    # reference_index conta em image_paths; rvecs só tem as imagens usadas (used_paths)
+    reference_path = image_paths[reference_index]
+    if reference_path not in used_paths:
+        raise ValueError(f"Tabuleiro não detetado na imagem de referência {reference_path}")
+    print(f"[INFO] Plano de referência: {reference_path}")
+    R = _tilt_rotation(rvecs[used_paths.index(reference_path)])
+    new_K = _rectified_camera_matrix(K, dist, R, size)
+    return {"K": K, "dist": dist, "R": R, "new_K": new_K, "size": size, "rms": rms}
+
+
+def build_rectify_maps(calibration):
+    """
+    Mapas de remap (ponto fixo, CV_16SC2 + CV_16UC1) que corrigem a distorção e a inclinação de uma só vez.
+    """
+    return cv2.initUndistortRectifyMap(calibration["K"], calibration["dist"], calibration["R"],
+                                       calibration["new_K"], calibration["size"], cv2.CV_16SC2)
+
+
+def save_rectify_maps(calibration, path=RECTIFY_MAPS_PATH):
+    map1, map2 = build_rectify_maps(calibration)
+    np.savez_compressed(
+        path,
+        map1=map1,
+        map2=map2,
+        K=calibration["K"],
+        dist=calibration["dist"],
+        R=calibration["R"],
+        new_K=calibration["new_K"],
+        size=np.array(calibration["size"], dtype=np.int64),
+        rms=np.float64(calibration["rms"]),
+    )
+    print(f"[INFO] Mapas de retificação guardados em {path}")
+
+
+class FrameRectifier:
+    """
+    Applies the precomputed undistortion + rectification maps to captured frames.
+
+    The maps are built once by the calibration stage (see `calibrate_camera`),
+    so each frame costs a single cv2.remap with fixed-point maps and the
+    per-sheet alignment only has to absorb the small residual motion.
+    """
+
+    def __init__(self, map1, map2, size, rms=None):
+        self.map1 = map1
+        self.map2 = map2
+        self.size = tuple(size)
+        self.rms = rms
+
+    @classmethod
+    def load(cls, path=RECTIFY_MAPS_PATH):
+        with np.load(path) as data:
+            return cls(data["map1"], data["map2"], tuple(int(v) for v in data["size"]), float(data["rms"]))
+
+    def apply(self, frame, out=None):
+        """
+        Equivalent of cv2.undistort + the rectifying rotation, in one cv2.remap.
+
+        Args:
+            out (np.array, optional): Output buffer to reuse (same size/dtype as `frame`).
+
+        Raises:
+            ValueError: If the frame resolution is not the one used for calibration.
+        """
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            raise ValueError(f"Resolução {frame.shape[1]}x{frame.shape[0]} diferente da calibração "
+                             f"{self.size[0]}x{self.size[1]}")
+        return cv2.remap(frame, self.map1, self.map2, cv2.INTER_LINEAR, dst=out, borderMode=cv2.BORDER_CONSTANT)
+
+
+def load_frame_rectifier(path=RECTIFY_MAPS_PATH):
+    """
+    Returns the FrameRectifier saved at `path`, or None if the rig was never calibrated.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        return FrameRectifier.load(path)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"[WARN] Mapas de retificação inválidos ({path}): {e}")
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibração da câmara e mapas de retificação")
+    parser.add_argument("images", help="Padrão glob das fotografias do tabuleiro, ex.: 'data/calib/*.jpg'")
+    parser.add_argument("--pattern", default="9x6", help="Cantos interiores do tabuleiro, colunas x linhas")
+    parser.add_argument("--square", type=float, default=1.0, help="Lado do quadrado")
+    parser.add_argument("--reference", type=int, default=0, help="Índice da imagem pousada no plano da folha")
+    parser.add_argument("--output", default=RECTIFY_MAPS_PATH)
+    args = parser.parse_args()
+
+    cols, rows = (int(v) for v in args.pattern.lower().split("x"))
+    calibration = calibrate_camera(sorted(glob.glob(args.images)), (cols, rows), args.square, args.reference)
+    save_rectify_maps(calibration, args.output)
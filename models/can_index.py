@@ -0,0 +1,96 @@
+import numpy as np
+import shapely
+
+from models.can_layout import NO_CAN
+
+
+def _polygons(outlines):
+    # Todos os contornos (Nx2 ou Nx1x2) num só lote: anéis a partir das coordenadas concatenadas e do índice de cada um
+    outlines = [np.asarray(o, np.float64).reshape(-1, 2) for o in outlines]
+    sizes = np.array([len(o) for o in outlines], np.intp)
+    rings = shapely.linearrings(np.concatenate(outlines), indices=np.repeat(np.arange(len(outlines)), sizes))
+    polygons = shapely.polygons(rings)
+    # Contornos que se cruzam ou tocam em si próprios dão polígonos inválidos; make_valid mantém a área preenchida
+    invalid = ~shapely.is_valid(polygons)
+    polygons[invalid] = shapely.make_valid(polygons[invalid])
+    return polygons
+
+
+class CanIndex:
+    """
+    Spatial index (shapely.STRtree) over the can polygons, for layouts where the can-number
+    raster (models.can_layout.load_can_labels) is impractical: rotated or scaled recipes,
+    overlapping tolerance zones, sizes that change often.
+
+    All queries take the whole sheet at once: the tree returns the candidate (item, can) pairs
+    by bounding box and the exact test runs vectorized on those pairs. Where cans overlap, the
+    first can of the list wins, as in the raster.
+    """
+
+    def __init__(self, instances):
+        self.numbers = np.array([inst["numero_lata"] for inst in instances], np.int16)
+        # A forma base tem auto-interseções (ver _polygons)
+        self.polygons = _polygons([inst["points"] for inst in instances]) if instances else np.empty(0, object)
+        shapely.prepare(self.polygons)
+        self.tree = shapely.STRtree(self.polygons)
+
+    def _numbers(self, item_count, items, cans):
+        # Para cada item, a primeira lata (na ordem da lista) dos pares (item, lata) dados; NO_CAN sem par
+        first = np.full(item_count, len(self.numbers), np.intp)
+        np.minimum.at(first, items, cans)
+        numbers = np.append(self.numbers, np.int16(NO_CAN))
+        return numbers[first]
+
+    def cans_at(self, xs, ys):
+        """
+        Can number at each point (x, y) of the sheet, NO_CAN outside the cans.
+        """
+        xs = np.asarray(xs, np.float64).ravel()
+        ys = np.asarray(ys, np.float64).ravel()
+        if not len(xs) or not len(self.numbers):
+            return np.full(len(xs), NO_CAN, np.int16)
+        items, cans = self.tree.query(shapely.points(xs, ys))
+        inside = shapely.contains_xy(self.polygons[cans], xs[items], ys[items])
+        return self._numbers(len(xs), items[inside], cans[inside])
+
+    def cans_by_overlap(self, contours, xs=None, ys=None):
+        """
+        Can of each defect contour (sheet coordinates, e.g. DefectDetector.defect_contours): the can
+        with the largest intersection area, so a defect straddling two cans goes to the one that
+        holds most of it. Contours with less than 3 points (or zero area) have no area to compare
+        and fall back to their centroid (xs, ys, e.g. the "cx"/"cy" record fields) or first point.
+
+        Returns:
+            np.ndarray: int16 can numbers, NO_CAN for defects outside every can.
+        """
+        count = len(contours)
+        result = np.full(count, NO_CAN, np.int16)
+        if not count or not len(self.numbers):
+            return result
+
+        if xs is None or ys is None:
+            first_points = np.array([c.reshape(-1, 2)[0] for c in contours], np.float64)
+            xs, ys = first_points[:, 0], first_points[:, 1]
+        xs, ys = np.asarray(xs, np.float64), np.asarray(ys, np.float64)
+
+        sizes = np.array([len(c) for c in contours], np.intp)
+        with_area = np.flatnonzero(sizes >= 3)
+        assigned = np.zeros(count, bool)
+        if len(with_area):
+            polygons = _polygons([contours[i] for i in with_area])
+            items, cans = self.tree.query(polygons, predicate="intersects")
+            areas = shapely.area(shapely.intersection(polygons[items], self.polygons[cans]))
+            keep = areas > 0
+            items, cans, areas = items[keep], cans[keep], areas[keep]
+
+            # Maior área por defeito (empate: a primeira lata da lista)
+            order = np.lexsort((cans, -areas, items))
+            items, cans = items[order], cans[order]
+            first = np.flatnonzero(np.diff(items, prepend=-1))
+            result[with_area[items[first]]] = self.numbers[cans[first]]
+            assigned[with_area[items[first]]] = True
+
+        rest = np.flatnonzero(~assigned)
+        if len(rest):
+            result[rest] = self.cans_at(xs[rest], ys[rest])
+        return result
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+FORMA_BASE_PATH = "data/mask/forma_base.json"
+INSTANCIAS_PATH = "data/mask/instancias_poligonos.txt"
+
+# Valor de can_labels fora das latas (o mesmo do campo "can" de um defeito sem lata)
+NO_CAN = -1
+
+
+def load_forma_base(path=FORMA_BASE_PATH):
+    """
+    Forma base de uma lata: lista de pontos [x, y] centrados na origem (escrita pelo CriarFormaWindow).
+    """
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_can_instances(forma_base_path=FORMA_BASE_PATH, instancias_path=INSTANCIAS_PATH):
+    """
+    Lê a forma base e as instâncias (numero:cx,cy,escala) e devolve os polígonos das latas.
+
+    Returns:
+        list: [{"numero_lata", "center", "scale", "points" (np.array Nx2, coordenadas do template)}]
+    """
+    forma_base = np.array(load_forma_base(forma_base_path), dtype=np.float64)  # lista de [x, y]
+
+    instancias = []
+    with open(instancias_path, "r") as f:
+        for line in f:
+            parts = line.strip().split(":")
+            if len(parts) != 2:
+                continue
+            idx_str, rest = parts
+            cx_str, cy_str, s_str = rest.split(",")
+            cx, cy, s = int(cx_str), int(cy_str), float(s_str)
+
+            instancias.append({
+                "numero_lata": int(idx_str),
+                "center": (cx, cy),
+                "scale": s,
+                "points": forma_base * s + (cx, cy),
+            })
+    return instancias
+
+
+def can_bounding_boxes(instancias, margin=0, shape=None):
+    """
+    Bounding boxes (x, y, w, h) das latas, alargadas por `margin` e recortadas a `shape` (h, w).
+    """
+    boxes = []
+    for inst in instancias:
+        x, y, w, h = cv2.boundingRect(np.round(inst["points"]).astype(np.int32))
+        x0, y0, x1, y1 = x - margin, y - margin, x + w + margin, y + h + margin
+        if shape is not None:
+            x0, y0 = max(0, x0), max(0, y0)
+            x1, y1 = min(shape[1], x1), min(shape[0], y1)
+        boxes.append((x0, y0, x1 - x0, y1 - y0))
+    return boxes
+
+
+def rasterize_can_labels(instancias, shape):
+    """
+    int16 image of `shape` with the number of the can covering each pixel (NO_CAN outside).
+    Where polygons overlap the first can of the list wins, as in a contains() loop over them.
+    """
+    labels = np.full(shape, NO_CAN, np.int16)
+    for inst in reversed(instancias):
+        cv2.fillPoly(labels, [np.round(inst["points"]).astype(np.int32)], int(inst["numero_lata"]))
+    return labels
+
+
+def load_can_labels(shape, forma_base_path=FORMA_BASE_PATH, instancias_path=INSTANCIAS_PATH):
+    """
+    can-number raster (see rasterize_can_labels), cached as data/mask/can_labels_<key>.npy.
+    The key hashes both layout files and the shape, so editing the cans simply produces a new entry.
+    """
+    digest = hashlib.sha1(repr(tuple(shape)).encode("utf-8"))
+    for path in (forma_base_path, instancias_path):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    cache_path = os.path.join(os.path.dirname(instancias_path), f"can_labels_{digest.hexdigest()[:16]}.npy")
+
+    if os.path.exists(cache_path):
+        try:
+            labels = np.load(cache_path)
+            if labels.shape == tuple(shape) and labels.dtype == np.int16:
+                return labels
+            print(f"[WARN] Cache de latas com tamanho/tipo inesperado ({cache_path})")
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Cache de latas inválida ({cache_path}): {e}")
+
+    labels = rasterize_can_labels(load_can_instances(forma_base_path, instancias_path), shape)
+    try:
+        np.save(cache_path, labels)
+        print(f"[INFO] Mapa das latas guardado em {cache_path}")
+    except OSError as e:
+        # A cache é opcional: sem permissão de escrita continua apenas em memória
+        print(f"[WARN] Não foi possível guardar o mapa das latas: {e}")
+    return labels
+
+
+def cans_at(labels, xs, ys):
+    """
+    Can number at each point (x, y) of the sheet, NO_CAN outside the cans (one fancy-index lookup).
+    """
+    h, w = labels.shape
+    xs = np.clip(np.asarray(xs).astype(np.intp), 0, w - 1)
+    ys = np.clip(np.asarray(ys).astype(np.intp), 0, h - 1)
+    return labels[ys, xs]
+
+
+def can_pixel_counts(labels, mask):
+    """
+    Pixels of `mask` (> 0) inside each can: array indexed by can number (length max number + 1).
+    """
+    cans = labels[mask > 0]
+    return np.bincount(cans[cans != NO_CAN], minlength=int(labels.max()) + 1)
+
+
+def _polygon_centroid(inst):
+    # Centróide da área do polígono; o centro da instância se o polígono for degenerado
+    m = cv2.moments(inst["points"].astype(np.float32))
+    if m["m00"] == 0:
+        return inst["center"]
+    return m["m10"] / m["m00"], m["m01"] / m["m00"]
+
+
+class CanLayout:
+    """
+    Everything derived from the can layout files for one sheet size, built once and shared:
+    `instances` (load_can_instances), `numbers`, `polygons` (int32 Nx2), `boxes` (clipped to
+    `shape`), `centroids` (polygon centroids, float64 Nx2), the lazily loaded `labels` raster
+    and the lazily built `index` (models.can_index.CanIndex).
+
+    `refresh` checks the modification time of forma_base.json / instancias_poligonos.txt (at most
+    once every `check_interval` seconds) and rebuilds only when one of them changed; each rebuild
+    increments `version`, so holders of derived data (e.g. DefectDetector.set_cans) can tell
+    whether theirs is stale. A file that cannot be read keeps the last valid layout.
+    """
+
+    def __init__(self, shape, forma_base_path=FORMA_BASE_PATH, instancias_path=INSTANCIAS_PATH,
+                 check_interval=1.0):
+        self.shape = tuple(shape[:2])
+        self.forma_base_path = forma_base_path
+        self.instancias_path = instancias_path
+        self.check_interval = check_interval
+
+        self.version = 0
+        self._mtimes = None
+        self._checked_at = 0.0
+        self._labels = None
+        self._index = None
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def _file_mtimes(self):
+        return tuple(os.stat(path).st_mtime_ns for path in (self.forma_base_path, self.instancias_path))
+
+    def refresh(self):
+        """
+        Rebuilds the layout if a source file changed since the last build.
+
+        Returns:
+            bool: True if it was rebuilt.
+
+        Raises:
+            OSError / ValueError: if the files cannot be read and there is no previous layout.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._mtimes is not None and now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+
+            try:
+                mtimes = self._file_mtimes()
+                if mtimes == self._mtimes:
+                    return False
+                instances = load_can_instances(self.forma_base_path, self.instancias_path)
+            except (OSError, ValueError) as e:
+                if self._mtimes is None:
+                    raise
+                print(f"[WARN] Latas não recarregadas, a manter as anteriores: {e}")
+                return False
+
+            self._build(instances)
+            self._mtimes = mtimes
+            self.version += 1
+            if self.version > 1:
+                print(f"[INFO] Latas recarregadas ({len(instances)} latas, versão {self.version})")
+            return True
+
+    def _build(self, instances):
+        self.instances = instances
+        self.numbers = np.array([inst["numero_lata"] for inst in instances], np.int16)
+        self.polygons = [np.round(inst["points"]).astype(np.int32) for inst in instances]
+        self.boxes = can_bounding_boxes(instances, shape=self.shape)
+        self.centroids = np.array([_polygon_centroid(inst) for inst in instances], np.float64).reshape(-1, 2)
+        self._labels = None
+        self._index = None
+
+    def invalidate(self):
+        """Forces the next `refresh` to check the files (e.g. right after writing them)."""
+        with self._lock:
+            self._checked_at = -float("inf")
+
+    @property
+    def labels(self):
+        # Só quem precisa do mapa o carrega (cache .npy em disco, ver load_can_labels)
+        with self._lock:
+            if self._labels is None:
+                self._labels = load_can_labels(self.shape, self.forma_base_path, self.instancias_path)
+            return self._labels
+
+    @property
+    def index(self):
+        # Índice espacial (STRtree) dos polígonos, para atribuir os defeitos por área (ver models.can_index)
+        from models.can_index import CanIndex
+
+        with self._lock:
+            if self._index is None:
+                self._index = CanIndex(self.instances)
+            return self._index
+
+    def cans_at(self, xs, ys):
+        """Can number at each point (x, y), NO_CAN outside the cans."""
+        return cans_at(self.labels, xs, ys)
+
+    def __len__(self):
+        return len(self.instances)
+
+
+# Um layout por (tamanho, ficheiros), partilhado pelas janelas e pelo detetor do mesmo processo
+_layouts = {}
+_layouts_lock = threading.Lock()
+
+
+def get_can_layout(shape, forma_base_path=FORMA_BASE_PATH, instancias_path=INSTANCIAS_PATH):
+    """
+    Shared CanLayout for `shape` and the given files, refreshed (see CanLayout.refresh).
+
+    Raises:
+        OSError / ValueError: if the layout files cannot be read the first time.
+    """
+    key = (tuple(shape[:2]), os.path.abspath(forma_base_path), os.path.abspath(instancias_path))
+    with _layouts_lock:
+        layout = _layouts.get(key)
+        if layout is None:
+            layout = CanLayout(shape, forma_base_path, instancias_path)
+            _layouts[key] = layout
+            return layout
+    layout.refresh()
+    return layout
+
+
+def invalidate_can_layouts():
+    """Makes every shared CanLayout check its files on the next refresh (call after saving them)."""
+    with _layouts_lock:
+        for layout in _layouts.values():
+            layout.invalidate()
@@ -2,86 +2,811 @@ import cv2
 import numpy as np
 import time
 
-def _apply_morphological_ops(mask, kernel_size, iterations):
+def _equalize_gray(img):
+    # Cinza -> blur 3x3 -> CLAHE, igual para o template e para a imagem atual
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.createCLAHE(clipLimit=3.0, tileGridSize=(4, 4)).apply(cv2.GaussianBlur(gray, (3, 3), 0))
+
+
+def _row_bands(mask, reach):
+    """
+    Bands of rows (r0, r1) holding every nonzero pixel of `mask` plus `reach` rows on each side,
+    or None when they would cover most of the mask (cheaper to process it whole).
     """
-    Applies morphological opening and closing to a binary mask.
+    occupied = mask.max(axis=1) > 0
+    counts = np.concatenate(([0], np.cumsum(occupied)))
+    h = len(occupied)
+    rows = np.arange(h)
+    # Linha dentro de uma faixa se houver alguma linha ocupada a menos de `reach`
+    grown = counts[np.minimum(rows + reach + 1, h)] > counts[np.maximum(rows - reach, 0)]
+    if np.count_nonzero(grown) > 0.75 * h:
+        return None
+    edges = np.flatnonzero(np.diff(grown.astype(np.int8), prepend=0, append=0))
+    return list(zip(edges[::2], edges[1::2]))
 
-    Args:
-        mask (np.array): The input binary mask.
-        kernel_size (int): The size of the square kernel.
-        iterations (int): The number of iterations for each operation.
 
-    Returns:
-        np.array: The cleaned binary mask.
+def outer_contours(mask):
+    # Contornos exteriores das manchas de `mask` (as que estão dentro do buraco de outra não têm nenhum)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def passes_min_area(contour, min_defect_area):
+    """
+    The minimum-area rule of every defect layer (`detect_area`): a blob is a defect when
+    cv2.contourArea of its outer contour is at least `min_defect_area`, as in the original
+    detect_defects. This is the polygon through the border pixel centres (holes included), not the
+    pixel count: thin lines have area 0, a 1-pixel blob too.
     """
-    effective_kernel_size = max(1, kernel_size + 1 if kernel_size % 2 == 0 else kernel_size)
-    kernel = np.ones((effective_kernel_size, effective_kernel_size), np.uint8)
+    return cv2.contourArea(contour) >= min_defect_area
 
-    clean_mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=iterations)
-    clean_mask = cv2.morphologyEx(clean_mask, cv2.MORPH_CLOSE, kernel, iterations=iterations)
 
-    return clean_mask
+# Parâmetros de DefectDetector.detect / detect_defects pela ordem posicional (chaves de inspection_params.json)
+DETECT_PARAM_KEYS = ("dark_threshold", "bright_threshold",
+                     "dark_morph_kernel_size", "dark_morph_iterations",
+                     "bright_morph_kernel_size", "bright_morph_iterations",
+                     "detect_area", "dark_gradient_threshold",
+                     "blue_threshold", "red_threshold")
 
-def detect_defects(tpl, aligned, mask,
-                   dark_threshold, bright_threshold,
-                   dark_morph_kernel_size, dark_morph_iterations,
-                   bright_morph_kernel_size, bright_morph_iterations,
-                   min_defect_area,
-                   dark_gradient_threshold,
-                   blue_threshold, red_threshold):
+# Classe de cada defeito (campo "defect_class"): índice neste tuplo
+DEFECT_CLASSES = ("escuro", "amarelo", "azul", "vermelho")
+
+# Um registo por defeito (componente conexa da máscara final), em coordenadas da folha
+DEFECT_DTYPE = np.dtype([
+    ("label", np.int32),         # valor do defeito em DefectDetector.labels
+    ("area", np.int32),          # píxeis
+    ("x", np.int32), ("y", np.int32), ("w", np.int32), ("h", np.int32),
+    ("cx", np.float32), ("cy", np.float32),
+    ("delta_gray", np.float32),  # média de template - atual no cinza equalizado (> 0: mais escuro)
+    ("delta_a", np.float32),     # média de atual - template no canal LAB a (> 0: mais vermelho)
+    ("delta_b", np.float32),     # média de atual - template no canal LAB b (> 0: amarelo, < 0: azul)
+    ("defect_class", np.uint8),
+    ("can", np.int16),           # número da lata, -1 se não for conhecido
+])
+
+# Uma linha por lata do layout (DefectDetector.can_statistics), por ordem do número da lata
+CAN_STATS_DTYPE = np.dtype([
+    ("can", np.int16),
+    ("defects", np.int32),       # defeitos atribuídos à lata (campo "can" dos registos)
+    ("area", np.int32),          # píxeis de defeito dentro do polígono da lata
+    ("max_delta_l", np.float32), # maior |atual - template| num píxel de defeito da lata, LAB L
+    ("max_delta_a", np.float32), # idem, LAB a
+    ("max_delta_b", np.float32), # idem, LAB b
+    ("classes", np.uint8),       # bit i: a lata tem píxeis de um defeito da classe DEFECT_CLASSES[i]
+])
+
+
+class PreparedTemplate:
     """
-    Detects defects by comparing a template image with an aligned current image using
-    grayscale and color difference methods.
+    Template-side preprocessing of `detect_defects`, computed once per template.
 
-    Returns:
-        tuple: (final_defect_mask, filtered_contours,
-               darker_mask_filtered, brighter_mask,
-               blue_mask, red_mask)
+    Holds the masked template, its equalized gray image (blur + CLAHE) and the
+    LAB a/b channels, so each call only preprocesses the current image.
+    """
+
+    def __init__(self, tpl, mask=None):
+        if mask is not None:
+            tpl = cv2.bitwise_and(tpl, tpl, mask=mask)
+        self.image = tpl
+        self.shape = tpl.shape[:2]
+        self.gray_eq = _equalize_gray(tpl)
+
+        lab = cv2.cvtColor(tpl, cv2.COLOR_BGR2LAB)
+        self.lab_a = np.ascontiguousarray(lab[:, :, 1])
+        self.lab_b = np.ascontiguousarray(lab[:, :, 2])
+
+
+def prepare_template(tpl, mask=None):
+    """
+    Returns `tpl` as a PreparedTemplate (unchanged if it already is one).
+    """
+    if isinstance(tpl, PreparedTemplate):
+        return tpl
+    return PreparedTemplate(tpl, mask)
+
+
+class DefectDetector:
+    """
+    Stateful version of `detect_defects` for repeated inspections against one template.
+
+    All intermediate images are preallocated at the template size and reused,
+    the CLAHE object and the structuring elements are created once, and every
+    OpenCV call writes into its buffer through `dst=`. Steady-state detection
+    therefore does (almost) no large allocations.
+
+    With `cans` (models.can_layout.load_can_instances or a CanLayout), `detect_by_can`
+    only processes the bounding box of each can instead of the whole sheet.
+
+    With `set_threshold_maps` (e.g. models.golden_model.GoldenModel.threshold_maps)
+    the dark/yellow/blue/red thresholds are per-pixel maps instead of the scalar
+    parameters, which are then ignored.
+
+    Defects are returned as a DEFECT_DTYPE record array (one row per connected
+    component of the final mask); their outlines are only traced on demand by
+    `defect_contours`, from the label image kept in `labels`.
+
+    The masks returned by `detect` and `labels` are these internal buffers: they
+    are overwritten by the next call, so copy them if they must outlive it.
     """
-    start_time = time.perf_counter()
 
-    # --- Grayscale Preprocessing ---
-    t_gray = cv2.cvtColor(tpl, cv2.COLOR_BGR2GRAY)
-    a_gray = cv2.cvtColor(aligned, cv2.COLOR_BGR2GRAY)
-    t_gray_eq = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(4, 4)).apply(cv2.GaussianBlur(t_gray, (3, 3), 0))
-    a_gray_eq = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(4, 4)).apply(cv2.GaussianBlur(a_gray, (3, 3), 0))
+    _STAGE_BUFFERS = ("diff", "darker", "gradient", "gradient_mask", "darker_filtered",
+                      "lab_a", "lab_b", "brighter", "blue", "red", "opened",
+                      "darker_clean", "brighter_clean", "blue_clean", "red_clean", "combined")
+
+    def __init__(self, tpl, mask, cans=None):
+        self.template = prepare_template(tpl)
+        self.mask = mask
+        self.shape = self.template.shape
+
+        self._clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(4, 4))
+        self._gradient_kernel = np.ones((5, 5), np.uint8)
+        self._kernels = {}
+
+        h, w = self.shape
+        names = ("gray", "blurred", "gray_eq", "final") + self._STAGE_BUFFERS
+        self._buffers = {name: np.empty((h, w), np.uint8) for name in names}
+        self._lab = np.empty((h, w, 3), np.uint8)
+        self.labels = np.zeros((h, w), np.int32)
+
+        # Buffers dos recortes por lata (criados no primeiro detect_by_can, crescem se a margem aumentar)
+        self._crop_buffers = None
+        self._crop_lab = None
+        self._coarse = None
+
+        self.threshold_maps = None
+
+        self.cans = []
+        self.can_layout = None
+        if cans is not None:
+            self.set_cans(cans)
+
+    def set_threshold_maps(self, maps):
+        """
+        Per-pixel thresholds {"dark", "bright", "blue", "red"} (uint8 maps of the template size),
+        or None to go back to the scalar thresholds.
+        """
+        if maps is not None:
+            for name in ("dark", "bright", "blue", "red"):
+                if maps[name].shape != self.shape:
+                    raise ValueError(f"Mapa de limiares '{name}' {maps[name].shape} diferente do template {self.shape}")
+        self.threshold_maps = maps
+
+    def _thresholds(self, region, dark_threshold, bright_threshold, blue_threshold, red_threshold):
+        # Limiares escalares, ou os mapas por píxel recortados à região (rows, cols) a processar
+        if self.threshold_maps is None:
+            return dark_threshold, bright_threshold, blue_threshold, red_threshold
+        return tuple(self.threshold_maps[name][region] for name in ("dark", "bright", "blue", "red"))
+
+    @staticmethod
+    def _threshold(src, threshold, dst):
+        # 255 onde src > limiar; o limiar é um inteiro ou um mapa uint8 do tamanho de src
+        if np.ndim(threshold) == 0:
+            return cv2.threshold(src, threshold, 255, cv2.THRESH_BINARY, dst=dst)[1]
+        return cv2.compare(src, threshold, cv2.CMP_GT, dst=dst)
+
+    def set_cans(self, cans):
+        """
+        Precomputes, for each can, its bounding box and the leaf mask restricted to its polygon
+        (so a defect in overlapping boxes is only reported once, by the can that contains it).
+
+        `cans` is a list of instances or a shared models.can_layout.CanLayout; with a layout,
+        `refresh_cans` redoes this only when the layout files have changed.
+        """
+        from models.can_layout import CanLayout, can_bounding_boxes
+
+        self.can_layout = None
+        if isinstance(cans, CanLayout):
+            self.can_layout, self._can_layout_version = cans, cans.version
+            instances = cans.instances
+            boxes = cans.boxes if cans.shape == self.shape else can_bounding_boxes(instances, shape=self.shape)
+        else:
+            instances, boxes = cans, can_bounding_boxes(cans, shape=self.shape)
+
+        self.cans = []
+        for inst, (x, y, bw, bh) in zip(instances, boxes):
+            if bw <= 0 or bh <= 0:
+                continue
+            can_mask = np.zeros((bh, bw), np.uint8)
+            cv2.fillPoly(can_mask, [np.round(inst["points"] - (x, y)).astype(np.int32)], 255)
+            if self.mask is not None:
+                cv2.bitwise_and(can_mask, self.mask[y:y + bh, x:x + bw], dst=can_mask)
+            self.cans.append((inst["numero_lata"], (x, y, bw, bh), can_mask))
+
+    def refresh_cans(self):
+        """
+        Refreshes the CanLayout given to `set_cans` and rebuilds the per-can masks if it changed
+        (one stat per check interval otherwise). Returns True when they were rebuilt.
+        """
+        if self.can_layout is None:
+            return False
+        self.can_layout.refresh()
+        if self.can_layout.version == self._can_layout_version:
+            return False
+        self.set_cans(self.can_layout)
+        return True
+
+    def _kernel(self, kernel_size):
+        # Tamanho efetivo ímpar e >= 1 (um tamanho par sobe para o ímpar seguinte)
+        effective_kernel_size = max(1, kernel_size + 1 if kernel_size % 2 == 0 else kernel_size)
+        kernel = self._kernels.get(effective_kernel_size)
+        if kernel is None:
+            kernel = np.ones((effective_kernel_size, effective_kernel_size), np.uint8)
+            self._kernels[effective_kernel_size] = kernel
+        return kernel
+
+    def _clean(self, mask, kernel_size, iterations, opened, dst):
+        """
+        Opening then closing of `mask` into `dst`. Only the bands of rows with pixels, grown by the
+        reach of the operations, are processed; the rest of `dst` is 0, as the full-image result
+        would be (masks of a class are often empty or have a few small blobs).
+        """
+        kernel = self._kernel(kernel_size)
+        reach = (iterations + 1) * (kernel.shape[0] // 2) + 1
+        bands = _row_bands(mask, reach)
+        if bands is None:
+            cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, dst=opened, iterations=iterations)
+            cv2.morphologyEx(opened, cv2.MORPH_CLOSE, kernel, dst=dst, iterations=iterations)
+            return dst
+
+        dst.fill(0)
+        for r0, r1 in bands:
+            cv2.morphologyEx(mask[r0:r1], cv2.MORPH_OPEN, kernel, dst=opened[r0:r1], iterations=iterations)
+            cv2.morphologyEx(opened[r0:r1], cv2.MORPH_CLOSE, kernel, dst=dst[r0:r1], iterations=iterations)
+        return dst
+
+    def _equalize(self, aligned):
+        b = self._buffers
+        cv2.cvtColor(aligned, cv2.COLOR_BGR2GRAY, dst=b["gray"])
+        cv2.GaussianBlur(b["gray"], (3, 3), 0, dst=b["blurred"])
+        self._clahe.apply(b["blurred"], dst=b["gray_eq"])
+        return b["gray_eq"]
+
+    def _difference_masks(self, aligned, gray_eq, t_gray_eq, t_lab_a, t_lab_b, b, lab,
+                          dark_threshold, bright_threshold,
+                          dark_morph_kernel_size, dark_morph_iterations,
+                          bright_morph_kernel_size, bright_morph_iterations,
+                          dark_gradient_threshold,
+                          blue_threshold, red_threshold,
+                          region=(slice(None), slice(None))):
+        """
+        Dark/yellow/blue/red masks and their cleaned union (b["combined"]) for one region.
+        `b` maps the stage names to output arrays of the region size; `region` is its
+        (rows, cols) slice of the sheet (for the per-pixel threshold maps).
+        """
+        dark_threshold, bright_threshold, blue_threshold, red_threshold = self._thresholds(
+            region, dark_threshold, bright_threshold, blue_threshold, red_threshold)
+
+        # --- Darker Defect Detection ---
+        cv2.subtract(t_gray_eq, gray_eq, dst=b["diff"])
+        self._threshold(b["diff"], dark_threshold, b["darker"])
+        cv2.morphologyEx(gray_eq, cv2.MORPH_GRADIENT, self._gradient_kernel, dst=b["gradient"])
+        cv2.threshold(b["gradient"], dark_gradient_threshold, 255, cv2.THRESH_BINARY, dst=b["gradient_mask"])
+        cv2.bitwise_and(b["darker"], b["gradient_mask"], dst=b["darker_filtered"])
+
+        # --- Color Defect Detection in LAB Space ---
+        cv2.cvtColor(aligned, cv2.COLOR_BGR2LAB, dst=lab)
+        cv2.extractChannel(lab, 1, dst=b["lab_a"])
+        cv2.extractChannel(lab, 2, dst=b["lab_b"])
+
+        cv2.subtract(b["lab_b"], t_lab_b, dst=b["diff"])
+        self._threshold(b["diff"], bright_threshold, b["brighter"])
+
+        cv2.subtract(t_lab_b, b["lab_b"], dst=b["diff"])
+        self._threshold(b["diff"], blue_threshold, b["blue"])
+
+        cv2.subtract(b["lab_a"], t_lab_a, dst=b["diff"])
+        self._threshold(b["diff"], red_threshold, b["red"])
+
+        # --- Morphological Cleaning ---
+        opened = b["opened"]
+        self._clean(b["darker_filtered"], dark_morph_kernel_size, dark_morph_iterations, opened, b["darker_clean"])
+        self._clean(b["brighter"], bright_morph_kernel_size, bright_morph_iterations, opened, b["brighter_clean"])
+        self._clean(b["blue"], bright_morph_kernel_size, bright_morph_iterations, opened, b["blue_clean"])
+        self._clean(b["red"], bright_morph_kernel_size, bright_morph_iterations, opened, b["red_clean"])
+
+        # --- Combine ---
+        combined = b["combined"]
+        cv2.bitwise_or(b["darker_clean"], b["brighter_clean"], dst=combined)
+        cv2.bitwise_or(combined, b["blue_clean"], dst=combined)
+        cv2.bitwise_or(combined, b["red_clean"], dst=combined)
+        return combined
+
+    def detect(self, aligned,
+               dark_threshold, bright_threshold,
+               dark_morph_kernel_size, dark_morph_iterations,
+               bright_morph_kernel_size, bright_morph_iterations,
+               min_defect_area,
+               dark_gradient_threshold,
+               blue_threshold, red_threshold):
+        """
+        Same parameters (minus `tpl` and `mask`) and same result as `detect_defects`.
+
+        Returns:
+            tuple: (final_defect_mask, defects,
+                   darker_mask_filtered, brighter_mask,
+                   blue_mask, red_mask) with `defects` a DEFECT_DTYPE record array.
+        """
+        if aligned.shape[:2] != self.shape:
+            raise ValueError(f"Imagem alinhada {aligned.shape[:2]} com tamanho diferente do template {self.shape}")
+
+        start_time = time.perf_counter()
+        b = self._buffers
+        tpl = self.template
+
+        gray_eq = self._equalize(aligned)
+        combined = self._difference_masks(aligned, gray_eq, tpl.gray_eq, tpl.lab_a, tpl.lab_b, b, self._lab,
+                                          dark_threshold, bright_threshold,
+                                          dark_morph_kernel_size, dark_morph_iterations,
+                                          bright_morph_kernel_size, bright_morph_iterations,
+                                          dark_gradient_threshold,
+                                          blue_threshold, red_threshold)
+
+        # --- Mask ROI ---
+        final_defect_mask = b["final"]
+        final_defect_mask.fill(0)  # com máscara, o bitwise_and não escreve fora dela
+        cv2.bitwise_and(combined, combined, dst=final_defect_mask, mask=self.mask)
 
-    # --- Darker Defect Detection ---
-    diff_dark_raw = cv2.subtract(t_gray_eq, a_gray_eq)
-    darker_mask = cv2.threshold(diff_dark_raw, dark_threshold, 255, cv2.THRESH_BINARY)[1]
-    morph_grad = cv2.morphologyEx(a_gray_eq, cv2.MORPH_GRADIENT, np.ones((5, 5), np.uint8))
-    _, gradient_mask_dark = cv2.threshold(morph_grad, dark_gradient_threshold, 255, cv2.THRESH_BINARY)
-    darker_mask_filtered = cv2.bitwise_and(darker_mask, gradient_mask_dark)
+        defects, _ = self._extract_defects(aligned, final_defect_mask, min_defect_area)
 
-    # --- Color Defect Detection in LAB Space ---
-    tpl_lab = cv2.cvtColor(tpl, cv2.COLOR_BGR2LAB)
-    aligned_lab = cv2.cvtColor(aligned, cv2.COLOR_BGR2LAB)
+        end_time = time.perf_counter()
+        print(f"detect_defects took {end_time - start_time:.4f} seconds")
 
-    diff_bright_yellow_raw = cv2.subtract(aligned_lab[:, :, 2], tpl_lab[:, :, 2])
-    _, brighter_mask = cv2.threshold(diff_bright_yellow_raw, bright_threshold, 255, cv2.THRESH_BINARY)
+        return final_defect_mask, defects, b["darker_filtered"], b["brighter"], b["blue"], b["red"]
 
-    diff_blue_raw = cv2.subtract(tpl_lab[:, :, 2], aligned_lab[:, :, 2])
-    _, blue_mask = cv2.threshold(diff_blue_raw, blue_threshold, 255, cv2.THRESH_BINARY)
+    def _extract_defects(self, aligned, defect_mask, min_defect_area, x0=0, y0=0, label_offset=0, can=-1):
+        """
+        Connected components of `defect_mask` (the region of the sheet starting at (x0, y0)) that pass
+        the minimum area (passes_min_area), as DEFECT_DTYPE records in sheet coordinates. Their labels
+        (numbered from `label_offset` + 1) are written into `self.labels`.
 
-    diff_red_raw = cv2.subtract(aligned_lab[:, :, 1], tpl_lab[:, :, 1])
-    _, red_mask = cv2.threshold(diff_red_raw, red_threshold, 255, cv2.THRESH_BINARY)
+        Needs the equalized gray image and the dark/yellow/blue/red masks of the same call in the
+        sheet buffers (for the mean deltas and the class of each defect).
 
-    # --- Morphological Cleaning ---
-    darker_clean = _apply_morphological_ops(darker_mask_filtered, dark_morph_kernel_size, dark_morph_iterations)
-    brighter_clean = _apply_morphological_ops(brighter_mask, bright_morph_kernel_size, bright_morph_iterations)
-    blue_clean = _apply_morphological_ops(blue_mask, bright_morph_kernel_size, bright_morph_iterations)
-    red_clean = _apply_morphological_ops(red_mask, bright_morph_kernel_size, bright_morph_iterations)
+        Returns:
+            tuple: (records, last label used)
+        """
+        # Uma componente ocupa sempre linhas seguidas: só as faixas de linhas com defeitos são etiquetadas
+        # (as estatísticas do connectedComponentsWithStats custam o mesmo numa folha quase vazia)
+        occupied = defect_mask.max(axis=1) > 0
+        edges = np.flatnonzero(np.diff(occupied.astype(np.int8), prepend=0, append=0))
 
-    # --- Combine and Mask ROI ---
-    combined = cv2.bitwise_or(darker_clean, brighter_clean)
-    combined = cv2.bitwise_or(combined, blue_clean)
-    combined = cv2.bitwise_or(combined, red_clean)
-    final_defect_mask = cv2.bitwise_and(combined, combined, mask=mask)
+        records = []
+        for r0, r1 in zip(edges[::2], edges[1::2]):
+            strip_records, count = self._strip_defects(aligned, defect_mask[r0:r1], min_defect_area,
+                                                       x0, y0 + r0, label_offset, can,
+                                                       overwrite=defect_mask.shape == self.shape)
+            records.append(strip_records)
+            label_offset += count
+        if not records:
+            return np.zeros(0, DEFECT_DTYPE), label_offset
+        return np.concatenate(records), label_offset
 
-    contours, _ = cv2.findContours(final_defect_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    filtered_contours = [cnt for cnt in contours if cv2.contourArea(cnt) >= min_defect_area]
+    def _strip_defects(self, aligned, defect_mask, min_defect_area, x0, y0, label_offset, can, overwrite):
+        # Uma faixa de _extract_defects; `overwrite` escreve também os zeros da faixa em self.labels
+        # (na folha inteira; nas latas as caixas sobrepõem-se e self.labels é limpo antes)
+        h, w = defect_mask.shape
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            defect_mask, connectivity=8, ltype=cv2.CV_32S)
+        np.add(labels, label_offset, out=labels, where=labels > 0)
+        np.copyto(self.labels[y0:y0 + h, x0:x0 + w], labels, where=True if overwrite else labels > 0)
 
-    end_time = time.perf_counter()
-    print(f"detect_defects took {end_time - start_time:.4f} seconds")
+        # Área mínima pelo contorno exterior (passes_min_area), não pelos píxeis. Cada contorno pertence à
+        # componente do seu primeiro ponto; as que ficam dentro do buraco de outra não têm contorno exterior e
+        # ficam de fora, como no detect_defects original
+        contours = outer_contours(defect_mask)
+        keep = np.zeros(0, np.intp)
+        if contours:
+            first = np.array([c[0, 0] for c in contours])
+            components = labels[first[:, 1], first[:, 0]] - label_offset
+            # contourArea <= (w - 1) * (h - 1): só se mede o contorno das componentes cuja caixa lá pode chegar
+            box_area = (stats[components, cv2.CC_STAT_WIDTH] - 1) * (stats[components, cv2.CC_STAT_HEIGHT] - 1)
+            keep = np.sort(np.array([components[i] for i in np.flatnonzero(box_area >= min_defect_area)
+                                     if passes_min_area(contours[i], min_defect_area)], np.intp))
+        records = np.zeros(len(keep), DEFECT_DTYPE)
+        if not len(keep):
+            return records, count - 1
 
-    return final_defect_mask, filtered_contours, darker_mask_filtered, brighter_mask, blue_mask, red_mask
+        records["label"] = keep + label_offset
+        records["area"] = stats[keep, cv2.CC_STAT_AREA]
+        records["x"] = stats[keep, cv2.CC_STAT_LEFT] + x0
+        records["y"] = stats[keep, cv2.CC_STAT_TOP] + y0
+        records["w"] = stats[keep, cv2.CC_STAT_WIDTH]
+        records["h"] = stats[keep, cv2.CC_STAT_HEIGHT]
+        records["cx"] = centroids[keep, 0] + x0
+        records["cy"] = centroids[keep, 1] + y0
+        records["can"] = can
+
+        # Píxeis dos defeitos mantidos (índices planos na folha) e a posição do respetivo registo
+        pixels = np.flatnonzero(labels)
+        position = np.zeros(count, np.intp)
+        position[keep] = np.arange(1, len(keep) + 1)
+        position = position[labels.ravel()[pixels] - label_offset]
+        kept = position > 0
+        pixels, position = pixels[kept], position[kept] - 1
+        rows, cols = np.divmod(pixels, w)
+        pixels = (rows + y0) * self.shape[1] + cols + x0
+
+        def mean(values):
+            return np.bincount(position, weights=values, minlength=len(keep)) / records["area"]
+
+        def take(img):
+            return img.reshape(-1, *img.shape[2:])[pixels]
+
+        b = self._buffers
+        tpl = self.template
+        # LAB só dos píxeis dos defeitos (a conversão é píxel a píxel, igual à da imagem inteira)
+        lab = cv2.cvtColor(take(aligned)[None], cv2.COLOR_BGR2LAB)[0].astype(np.int16)
+        records["delta_gray"] = mean(take(tpl.gray_eq).astype(np.int16) - take(b["gray_eq"]))
+        records["delta_a"] = mean(lab[:, 1] - take(tpl.lab_a))
+        records["delta_b"] = mean(lab[:, 2] - take(tpl.lab_b))
+
+        # Classe: a máscara (escuro, amarelo, azul, vermelho) com mais píxeis no defeito
+        votes = np.stack([np.bincount(position, weights=take(b[name]), minlength=len(keep))
+                          for name in ("darker_filtered", "brighter", "blue", "red")], axis=1)
+        records["defect_class"] = votes.argmax(axis=1)
+        return records, count - 1
+
+    def can_statistics(self, aligned, defects, can_layout):
+        """
+        Per-can summary of the last detection: a CAN_STATS_DTYPE array with one row per can of
+        `can_layout` (models.can_layout.CanLayout), cans without defects included.
+
+        `defects` are the records of that detection with their "can" field filled (detect_by_can
+        or CanLayout.cans_at); the counts follow it. Area, maximum deltas and classes are taken
+        per pixel of the final mask through the can raster, so a defect straddling two cans
+        contributes its pixels to each of them. One pass of bincount / maximum.at, no loop over
+        the defects.
+        """
+        numbers = np.sort(can_layout.numbers)
+        n = len(numbers)
+        stats = np.zeros(n, CAN_STATS_DTYPE)
+        stats["can"] = numbers
+        if not n or not len(defects):
+            return stats
+
+        # Linha de cada número de lata (deslocado de 1, para NO_CAN = -1); a linha n recolhe o que fica fora
+        row_of = np.full(int(numbers.max()) + 2, n, np.intp)
+        row_of[numbers.astype(np.intp) + 1] = np.arange(n)
+        cans = defects["can"].astype(np.intp) + 1
+        cans[(cans < 0) | (cans >= len(row_of))] = 0
+        stats["defects"] = np.bincount(row_of[cans], minlength=n + 1)[:n]
+
+        # Píxeis dos defeitos mantidos, só nas linhas ocupadas por eles (fora delas self.labels pode ser antigo)
+        y0, y1 = int(defects["y"].min()), int((defects["y"] + defects["h"]).max())
+        # (a máscara é 0/255: a vista bool evita a comparação != 0 do flatnonzero em uint8)
+        pixels = np.flatnonzero(self._buffers["final"][y0:y1].view(bool)) + y0 * self.shape[1]
+        record_of = np.full(int(defects["label"].max()) + 1, -1, np.intp)
+        record_of[defects["label"]] = np.arange(len(defects))
+        labels = self.labels.ravel()[pixels]
+        record = record_of[np.minimum(labels, len(record_of) - 1)]
+        kept = (labels < len(record_of)) & (record >= 0)
+        pixels, record = pixels[kept], record[kept]
+        if not len(pixels):
+            return stats
+        rows = row_of[can_layout.labels.ravel()[pixels].astype(np.intp) + 1]
+
+        stats["area"] = np.bincount(rows, minlength=n + 1)[:n]
+        classes = np.zeros(n + 1, np.uint8)
+        np.bitwise_or.at(classes, rows, np.left_shift(1, defects["defect_class"][record]).astype(np.uint8))
+        stats["classes"] = classes[:n]
+
+        # LAB só dos píxeis dos defeitos, como em _strip_defects
+        tpl = self.template
+        lab = cv2.cvtColor(aligned.reshape(-1, 3)[pixels][None], cv2.COLOR_BGR2LAB)[0].astype(np.int16)
+        tpl_l = cv2.cvtColor(tpl.image.reshape(-1, 3)[pixels][None], cv2.COLOR_BGR2LAB)[0, :, 0]
+        for field, delta in (("max_delta_l", lab[:, 0] - tpl_l),
+                             ("max_delta_a", lab[:, 1] - tpl.lab_a.ravel()[pixels]),
+                             ("max_delta_b", lab[:, 2] - tpl.lab_b.ravel()[pixels])):
+            peak = np.zeros(n + 1, np.float32)
+            np.maximum.at(peak, rows, np.abs(delta).astype(np.float32))
+            stats[field] = peak[:n]
+        return stats
+
+    def defect_contours(self, records):
+        """
+        Outer contours (sheet coordinates) of the given defects, traced from `self.labels`.
+        Only call it for the defects that are actually drawn; the records must come from the last detection.
+
+        Returns:
+            list: One contour per record, in the same order.
+        """
+        contours = []
+        for label, x, y, w, h in zip(records["label"], records["x"], records["y"], records["w"], records["h"]):
+            component = (self.labels[y:y + h, x:x + w] == label).view(np.uint8)
+            found, _ = cv2.findContours(component, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                        offset=(int(x), int(y)))
+            if found:
+                contours.append(max(found, key=len))
+        return contours
+
+    @staticmethod
+    def roi_margin(dark_morph_kernel_size, dark_morph_iterations, bright_morph_kernel_size, bright_morph_iterations):
+        """
+        Border (px) around each can box so that the cropped result equals the full-sheet one inside the box:
+        5x5 gradient (2 px) on the dark path, plus open + close (2 * iterations * radius each) on every path.
+        """
+        dark_radius = max(1, dark_morph_kernel_size + 1 if dark_morph_kernel_size % 2 == 0
+                          else dark_morph_kernel_size) // 2
+        bright_radius = max(1, bright_morph_kernel_size + 1 if bright_morph_kernel_size % 2 == 0
+                            else bright_morph_kernel_size) // 2
+        return max(2 + 4 * dark_morph_iterations * dark_radius, 4 * bright_morph_iterations * bright_radius)
+
+    def _crop_workspace(self, max_h, max_w):
+        # Buffers para o maior recorte pedido; os recortes usam vistas [:h, :w] destes buffers
+        if (self._crop_buffers is None or self._crop_lab.shape[0] < max_h or self._crop_lab.shape[1] < max_w):
+            if self._crop_lab is not None:
+                max_h, max_w = max(max_h, self._crop_lab.shape[0]), max(max_w, self._crop_lab.shape[1])
+            names = self._STAGE_BUFFERS + ("can_defects",)
+            self._crop_buffers = {name: np.empty((max_h, max_w), np.uint8) for name in names}
+            self._crop_lab = np.empty((max_h, max_w, 3), np.uint8)
+        return self._crop_buffers, self._crop_lab
+
+    def _crop_masks(self, aligned, gray_eq, crop, crop_buffers, crop_lab,
+                    dark_threshold, bright_threshold,
+                    dark_morph_kernel_size, dark_morph_iterations,
+                    bright_morph_kernel_size, bright_morph_iterations,
+                    dark_gradient_threshold,
+                    blue_threshold, red_threshold):
+        # _difference_masks num recorte (y0, y1, x0, x1) da folha, com os buffers de recorte
+        y0, y1, x0, x1 = crop
+        rows, cols = slice(y0, y1), slice(x0, x1)
+        cb = {name: buf[:y1 - y0, :x1 - x0] for name, buf in crop_buffers.items()}
+        tpl = self.template
+        combined = self._difference_masks(aligned[rows, cols], gray_eq[rows, cols], tpl.gray_eq[rows, cols],
+                                          tpl.lab_a[rows, cols], tpl.lab_b[rows, cols], cb,
+                                          crop_lab[:y1 - y0, :x1 - x0],
+                                          dark_threshold, bright_threshold,
+                                          dark_morph_kernel_size, dark_morph_iterations,
+                                          bright_morph_kernel_size, bright_morph_iterations,
+                                          dark_gradient_threshold,
+                                          blue_threshold, red_threshold,
+                                          region=(rows, cols))
+        return combined, cb
+
+    def detect_by_can(self, aligned,
+                      dark_threshold, bright_threshold,
+                      dark_morph_kernel_size, dark_morph_iterations,
+                      bright_morph_kernel_size, bright_morph_iterations,
+                      min_defect_area,
+                      dark_gradient_threshold,
+                      blue_threshold, red_threshold):
+        """
+        Like `detect`, but every stage after the (sheet-wide) CLAHE only runs on the can bounding boxes,
+        each enlarged by `roi_margin` so the morphology sees the same neighbourhood as on the full sheet.
+
+        Inside the can polygons the result is identical to `detect`; pixels outside every can are ignored.
+
+        Returns:
+            tuple: as `detect`, with the "can" field of every defect set to the number of its can.
+        """
+        if not self.cans:
+            raise ValueError("detect_by_can precisa das latas (set_cans).")
+        if aligned.shape[:2] != self.shape:
+            raise ValueError(f"Imagem alinhada {aligned.shape[:2]} com tamanho diferente do template {self.shape}")
+
+        start_time = time.perf_counter()
+        b = self._buffers
+        h, w = self.shape
+
+        # CLAHE depende da imagem inteira (grelha de 4x4 tiles): continua a ser calculado na folha toda
+        gray_eq = self._equalize(aligned)
+
+        outputs = ("final", "darker_filtered", "brighter", "blue", "red")
+        for name in outputs:
+            b[name].fill(0)
+        self.labels.fill(0)
+
+        margin = self.roi_margin(dark_morph_kernel_size, dark_morph_iterations,
+                                 bright_morph_kernel_size, bright_morph_iterations)
+        crop_buffers, crop_lab = self._crop_workspace(
+            max(bh for _, (_, _, _, bh), _ in self.cans) + 2 * margin,
+            max(bw for _, (_, _, bw, _), _ in self.cans) + 2 * margin)
+
+        defects, label_offset = [], 0
+        for numero_lata, (x, y, bw, bh), can_mask in self.cans:
+            x0, y0 = max(0, x - margin), max(0, y - margin)
+            x1, y1 = min(w, x + bw + margin), min(h, y + bh + margin)
+            combined, cb = self._crop_masks(aligned, gray_eq, (y0, y1, x0, x1), crop_buffers, crop_lab,
+                                            dark_threshold, bright_threshold,
+                                            dark_morph_kernel_size, dark_morph_iterations,
+                                            bright_morph_kernel_size, bright_morph_iterations,
+                                            dark_gradient_threshold,
+                                            blue_threshold, red_threshold)
+
+            # Só o interior (a caixa da lata) é exato; é esse que volta para as coordenadas da folha
+            box = (slice(y, y + bh), slice(x, x + bw))
+            inner = (slice(y - y0, y - y0 + bh), slice(x - x0, x - x0 + bw))
+            for name in outputs[1:]:
+                np.copyto(b[name][box], cb[name][inner])
+
+            can_defects = cb["can_defects"][:bh, :bw]
+            cv2.bitwise_and(combined[inner], can_mask, dst=can_defects)
+            cv2.bitwise_or(b["final"][box], can_defects, dst=b["final"][box])
+
+            # Etiquetas únicas na folha: as da lata seguinte continuam a numeração desta
+            can_records, label_offset = self._extract_defects(aligned, can_defects, min_defect_area, x, y,
+                                                              label_offset, numero_lata)
+            defects.append(can_records)
+
+        defects = np.concatenate(defects)
+
+        end_time = time.perf_counter()
+        print(f"detect_defects (latas) took {end_time - start_time:.4f} seconds")
+
+        return b["final"], defects, b["darker_filtered"], b["brighter"], b["blue"], b["red"]
+
+    def _coarse_template(self, scale):
+        # Template, máscara e pré-processamento à escala de triagem (calculados uma vez por escala)
+        if self._coarse is None or self._coarse[0] != scale:
+            h, w = self.shape
+            size = (max(1, round(w * scale)), max(1, round(h * scale)))
+            coarse_template = PreparedTemplate(cv2.resize(self.template.image, size, interpolation=cv2.INTER_AREA))
+            coarse_mask = None
+            if self.mask is not None:
+                # Qualquer píxel com alguma cobertura da máscara conta (a triagem tem de ser conservadora)
+                coarse_mask = cv2.threshold(cv2.resize(self.mask, size, interpolation=cv2.INTER_AREA),
+                                            0, 255, cv2.THRESH_BINARY)[1]
+            self._coarse = (scale, size, coarse_template, coarse_mask)
+        return self._coarse
+
+    def screen(self, aligned, dark_threshold, bright_threshold, blue_threshold, red_threshold,
+               scale=0.25, relax=0.35):
+        """
+        Coarse pass: the same dark/yellow/blue/red differences at `scale`, with every threshold
+        multiplied by `relax` and without the gradient filter or the morphology (both only remove pixels).
+
+        Returns:
+            np.array: Candidate mask at the coarse resolution.
+        """
+        _, size, coarse_template, coarse_mask = self._coarse_template(scale)
+        small = cv2.resize(aligned, size, interpolation=cv2.INTER_AREA)
+
+        gray_eq = _equalize_gray(small)
+        candidates = cv2.threshold(cv2.subtract(coarse_template.gray_eq, gray_eq),
+                                   dark_threshold * relax, 255, cv2.THRESH_BINARY)[1]
+
+        lab = cv2.cvtColor(small, cv2.COLOR_BGR2LAB)
+        lab_a, lab_b = lab[:, :, 1], lab[:, :, 2]
+        for diff, threshold in ((cv2.subtract(lab_b, coarse_template.lab_b), bright_threshold),
+                                (cv2.subtract(coarse_template.lab_b, lab_b), blue_threshold),
+                                (cv2.subtract(lab_a, coarse_template.lab_a), red_threshold)):
+            cv2.bitwise_or(candidates, cv2.threshold(diff, threshold * relax, 255, cv2.THRESH_BINARY)[1],
+                           dst=candidates)
+
+        if coarse_mask is not None:
+            cv2.bitwise_and(candidates, coarse_mask, dst=candidates)
+        return candidates
+
+    def detect_screened(self, aligned,
+                        dark_threshold, bright_threshold,
+                        dark_morph_kernel_size, dark_morph_iterations,
+                        bright_morph_kernel_size, bright_morph_iterations,
+                        min_defect_area,
+                        dark_gradient_threshold,
+                        blue_threshold, red_threshold,
+                        scale=0.25, relax=0.35, window_pad=16, max_fraction=0.4):
+        """
+        Two-pass detection: `screen` at `scale` finds candidate pixels; the full resolution pipeline
+        then only runs on windows around them (`window_pad` px of slack plus the `roi_margin` halo).
+
+        A sheet without candidates is accepted without any full resolution work. The full `detect`
+        is used instead when the windows cover more than `max_fraction` of the sheet or when a
+        defect reaches the edge of its window (it could continue outside), so the result is the
+        same as `detect` whenever the coarse pass flags every defect.
+
+        Returns:
+            tuple: as `detect`, except for the class masks (darker_mask_filtered, brighter, blue,
+                red) when the full `detect` is not used: they are only computed inside the windows
+                and are 0 elsewhere (all 0 on a sheet without candidates), even where `detect` would
+                flag pixels that form no defect. A per-pixel readout of them (InspectionWindow's
+                hover) shows 0 there; the final mask and the records are as `detect`.
+        """
+        if aligned.shape[:2] != self.shape:
+            raise ValueError(f"Imagem alinhada {aligned.shape[:2]} com tamanho diferente do template {self.shape}")
+        params = (dark_threshold, bright_threshold,
+                  dark_morph_kernel_size, dark_morph_iterations,
+                  bright_morph_kernel_size, bright_morph_iterations,
+                  min_defect_area,
+                  dark_gradient_threshold,
+                  blue_threshold, red_threshold)
+
+        start_time = time.perf_counter()
+        b = self._buffers
+        h, w = self.shape
+        outputs = ("final", "darker_filtered", "brighter", "blue", "red")
+
+        # Com mapas por píxel, a triagem usa o menor limiar de cada mapa (continua conservadora)
+        screen_thresholds = self._thresholds((slice(None), slice(None)), dark_threshold, bright_threshold,
+                                             blue_threshold, red_threshold)
+        candidates = self.screen(aligned, *(int(np.min(t)) for t in screen_thresholds), scale, relax)
+        windows = []
+        if cv2.countNonZero(candidates):
+            # Candidatos próximos juntam-se numa só janela
+            radius = max(1, int(np.ceil(window_pad * scale)))
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * radius + 1, 2 * radius + 1))
+            count, _, stats, _ = cv2.connectedComponentsWithStats(cv2.dilate(candidates, kernel), connectivity=8)
+            for cx, cy, cw, ch, _ in stats[1:count]:
+                x0, y0 = max(0, int(cx / scale) - window_pad), max(0, int(cy / scale) - window_pad)
+                x1 = min(w, int(np.ceil((cx + cw) / scale)) + window_pad)
+                y1 = min(h, int(np.ceil((cy + ch) / scale)) + window_pad)
+                windows.append((x0, y0, x1, y1))
+
+        if sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in windows) > max_fraction * h * w:
+            print(f"[INFO] Triagem: {len(windows)} janelas cobrem demasiado da folha, deteção completa")
+            return self.detect(aligned, *params)
+
+        for name in outputs:
+            b[name].fill(0)
+
+        if windows:
+            # CLAHE continua a ser da folha inteira (a grelha de tiles depende do tamanho da imagem)
+            gray_eq = self._equalize(aligned)
+            halo = self.roi_margin(dark_morph_kernel_size, dark_morph_iterations,
+                                   bright_morph_kernel_size, bright_morph_iterations)
+            crop_buffers, crop_lab = self._crop_workspace(
+                max(y1 - y0 for _, y0, _, y1 in windows) + 2 * halo,
+                max(x1 - x0 for x0, _, x1, _ in windows) + 2 * halo)
+
+            for x0, y0, x1, y1 in windows:
+                cx0, cy0 = max(0, x0 - halo), max(0, y0 - halo)
+                cx1, cy1 = min(w, x1 + halo), min(h, y1 + halo)
+                combined, cb = self._crop_masks(aligned, gray_eq, (cy0, cy1, cx0, cx1), crop_buffers, crop_lab,
+                                                dark_threshold, bright_threshold,
+                                                dark_morph_kernel_size, dark_morph_iterations,
+                                                bright_morph_kernel_size, bright_morph_iterations,
+                                                dark_gradient_threshold,
+                                                blue_threshold, red_threshold)
+
+                window = (slice(y0, y1), slice(x0, x1))
+                inner = (slice(y0 - cy0, y1 - cy0), slice(x0 - cx0, x1 - cx0))
+                for name in outputs[1:]:
+                    np.copyto(b[name][window], cb[name][inner])
+                final = b["final"][window]
+                mask = None if self.mask is None else self.mask[window]
+                cv2.bitwise_or(final, combined[inner], dst=final, mask=mask)
+
+                # Defeito encostado à borda da janela (que não é borda da folha): pode continuar fora dela
+                if ((y0 > 0 and final[0].any()) or (y1 < h and final[-1].any())
+                        or (x0 > 0 and final[:, 0].any()) or (x1 < w and final[:, -1].any())):
+                    print("[INFO] Triagem: defeito no limite de uma janela, deteção completa")
+                    return self.detect(aligned, *params)
+
+        final_defect_mask = b["final"]
+        defects, _ = self._extract_defects(aligned, final_defect_mask, min_defect_area)
+
+        end_time = time.perf_counter()
+        print(f"detect_defects (triagem, {len(windows)} janelas) took {end_time - start_time:.4f} seconds")
+
+        return final_defect_mask, defects, b["darker_filtered"], b["brighter"], b["blue"], b["red"]
+
+
+def detect_defects(tpl, aligned, mask,
+                   dark_threshold, bright_threshold,
+                   dark_morph_kernel_size, dark_morph_iterations,
+                   bright_morph_kernel_size, bright_morph_iterations,
+                   min_defect_area,
+                   dark_gradient_threshold,
+                   blue_threshold, red_threshold):
+    """
+    Detects defects by comparing a template image with an aligned current image using
+    grayscale and color difference methods.
+
+    `tpl` may be the (masked) template image or a PreparedTemplate; with the latter
+    only the current image is preprocessed. For repeated calls use a DefectDetector,
+    which also reuses its intermediate buffers (and can trace the defect contours).
+
+    A defect is a connected component of the final mask whose outer contour has a cv2.contourArea of at
+    least `min_defect_area` (see passes_min_area).
+
+    Returns:
+        tuple: (final_defect_mask, defects,
+               darker_mask_filtered, brighter_mask,
+               blue_mask, red_mask) with `defects` a DEFECT_DTYPE record array.
+    """
+    return DefectDetector(tpl, mask).detect(aligned,
+                                            dark_threshold, bright_threshold,
+                                            dark_morph_kernel_size, dark_morph_iterations,
+                                            bright_morph_kernel_size, bright_morph_iterations,
+                                            min_defect_area,
+                                            dark_gradient_threshold,
+                                            blue_threshold, red_threshold)
@@ -1,18 +1,18 @@
 import cv2
 import numpy as np
-import json
 import os
 
+from config.config_registry import get_config, DETECT_MARGINS_SCHEMA
+
 
 def detect_folha_bordas(aligned_img, config_path="config/config_detect_borda.json", save_path="mask_coords.txt"):
-    # Carregar parâmetros do ficheiro JSON
-    with open(config_path, "r") as f:
-        config = json.load(f)
-
-    blur_ksize = config.get("blur_ksize", 5)
-    canny1 = config.get("canny_threshold1", 50)
-    canny2 = config.get("canny_threshold2", 150)
-    min_area = config.get("min_area", 100000)
+    # Carregar parâmetros do ficheiro JSON (cache em memória)
+    config = get_config(config_path, DETECT_MARGINS_SCHEMA)
+
+    blur_ksize = config["blur_ksize"]
+    canny1 = config["canny_threshold1"]
+    canny2 = config["canny_threshold2"]
+    min_area = config["min_area"]
 
     # Converter para escala de cinza
     gray = cv2.cvtColor(aligned_img, cv2.COLOR_BGR2GRAY)
@@ -0,0 +1,224 @@
+import argparse
+import glob
+import os
+import struct
+import zipfile
+
+import cv2
+import numpy as np
+
+from config.config_registry import get_config, ALIGNMENT_SCHEMA
+from models.align_image import align_with_template
+from models.defect_detector import PreparedTemplate, _equalize_gray
+
+GOLDEN_MODEL_PATH = "data/golden_model.npz"
+
+# Canais modelados, os mesmos que a deteção compara: cinza equalizado (escuro) e LAB a/b (cor)
+CHANNELS = ("gray_eq", "lab_a", "lab_b")
+
+
+def sheet_channels(aligned):
+    """
+    Canais de uma folha alinhada (e já mascarada), calculados como em DefectDetector.
+
+    Returns:
+        tuple: (gray_eq, lab_a, lab_b), uint8
+    """
+    lab = cv2.cvtColor(aligned, cv2.COLOR_BGR2LAB)
+    return _equalize_gray(aligned), lab[:, :, 1], lab[:, :, 2]
+
+
+class GoldenModelBuilder:
+    """
+    Streaming per-pixel mean/variance (Welford) of the CHANNELS of known-good sheets.
+
+    Only the running mean and M2 (float32, one plane per channel) plus two scratch
+    planes are kept, so any number of sheets can be added one at a time.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.count = 0
+        self.mean = np.zeros((len(CHANNELS),) + self.shape, np.float32)
+        self.m2 = np.zeros_like(self.mean)
+        self._delta = np.empty(self.shape, np.float32)
+        self._scratch = np.empty(self.shape, np.float32)
+
+    def add(self, channels):
+        if len(channels) != len(CHANNELS) or channels[0].shape != self.shape:
+            raise ValueError(f"Esperados {len(CHANNELS)} canais de {self.shape}")
+        self.count += 1
+        delta, scratch = self._delta, self._scratch
+        for mean, m2, channel in zip(self.mean, self.m2, channels):
+            np.subtract(channel, mean, out=delta)            # x - média antiga
+            np.multiply(delta, 1.0 / self.count, out=scratch)
+            mean += scratch                                  # média nova
+            np.subtract(delta, scratch, out=scratch)         # x - média nova
+            np.multiply(delta, scratch, out=scratch)
+            m2 += scratch
+
+    def std(self):
+        if self.count < 2:
+            raise ValueError("São precisas pelo menos 2 folhas para o desvio padrão.")
+        return np.sqrt(self.m2 / (self.count - 1))
+
+
+def build_golden_model(image_paths, template_img, mask=None, config_path="config/config_alignment.json"):
+    """
+    Aligns each known-good sheet with the template and accumulates it in a GoldenModelBuilder.
+    Sheets that do not load or fail the alignment quality gate are skipped.
+    """
+    config = get_config(config_path, ALIGNMENT_SCHEMA)
+    builder = GoldenModelBuilder(template_img.shape[:2])
+    for path in image_paths:
+        current = cv2.imread(path)
+        if current is None:
+            print(f"[WARN] Não foi possível ler {path}")
+            continue
+        aligned, _, quality = align_with_template(current, template_img, config_path, mask=mask,
+                                                  return_quality=True)
+        reasons = quality.rejection_reasons(config) if config["gate_enabled"] else []
+        if reasons:
+            print(f"[WARN] {path} ignorada (alinhamento): {'; '.join(reasons)}")
+            continue
+        if mask is not None:
+            aligned = cv2.bitwise_and(aligned, aligned, mask=mask)
+        builder.add(sheet_channels(aligned))
+        print(f"[INFO] {path} acumulada ({builder.count})")
+    return builder
+
+
+def save_golden_model(builder, path=GOLDEN_MODEL_PATH):
+    # np.savez sem compressão: os membros podem ser mapeados em memória (ver _load_npz)
+    np.savez(
+        path,
+        mean=builder.mean.astype(np.float16),
+        std=builder.std().astype(np.float16),
+        count=np.int64(builder.count),
+        channels=np.array(CHANNELS),
+    )
+    print(f"[INFO] Modelo dourado ({builder.count} folhas) guardado em {path}")
+
+
+def _load_npz(path, mmap=True):
+    """
+    Like np.load for an .npz, but the uncompressed members are np.memmap views of the file
+    (np.load ignores mmap_mode inside .npz archives).
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            # Dados do membro = cabeçalho local do zip (30 bytes + nome + extra) + cabeçalho .npy
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if not shape or dtype.hasobject:
+                f.seek(info.header_offset + 30 + name_length + extra_length)
+                arrays[name] = np.lib.format.read_array(f)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r", shape=shape,
+                                     order="F" if fortran_order else "C", offset=f.tell())
+    return arrays
+
+
+class GoldenModel:
+    """
+    Per-pixel mean and standard deviation of known-good sheets (float16, memory-mapped).
+
+    Detection against the model is a z-score test per pixel: a pixel is darker than
+    normal when (mean - x) > z * std on the equalized gray channel, and likewise on
+    LAB b (yellow / blue) and LAB a (red). `threshold_maps` turns z into uint8
+    per-pixel thresholds for DefectDetector, so the test costs the same as the
+    global thresholds against a single template.
+    """
+
+    def __init__(self, mean, std, count):
+        self.mean = mean
+        self.std = std
+        self.count = int(count)
+        self.shape = tuple(mean.shape[1:])
+        self._maps_key = None
+        self._maps = None
+
+    @classmethod
+    def load(cls, path=GOLDEN_MODEL_PATH, mmap=True):
+        data = _load_npz(path, mmap)
+        channels = tuple(str(c) for c in data["channels"])
+        if channels != CHANNELS:
+            raise ValueError(f"Canais {channels} diferentes de {CHANNELS}")
+        return cls(data["mean"], data["std"], data["count"])
+
+    def channel(self, name):
+        i = CHANNELS.index(name)
+        return self.mean[i], self.std[i]
+
+    def prepared_template(self, tpl, mask=None):
+        """
+        PreparedTemplate whose gray/LAB planes are the (rounded) model means. `tpl` is still used
+        for the image itself (screening pass, previews).
+        """
+        prepared = PreparedTemplate(tpl, mask)
+        if prepared.shape != self.shape:
+            raise ValueError(f"Modelo dourado {self.shape} com tamanho diferente do template {prepared.shape}")
+        for name in CHANNELS:
+            mean, _ = self.channel(name)
+            setattr(prepared, name, np.clip(np.round(mean.astype(np.float32)), 0, 255).astype(np.uint8))
+        return prepared
+
+    def threshold_maps(self, z, min_delta=1):
+        """
+        Per-pixel thresholds floor(z * std), at least `min_delta` (pixels that never changed
+        in the good sheets would otherwise flag any compression noise).
+
+        Returns:
+            dict: {"dark", "bright", "blue", "red"} -> uint8 maps (cached for the last z/min_delta).
+        """
+        key = (float(z), int(min_delta))
+        if self._maps_key != key:
+            def to_map(name):
+                _, std = self.channel(name)
+                threshold = np.floor(std.astype(np.float32) * z)
+                return np.clip(threshold, min_delta, 255).astype(np.uint8)
+
+            color = to_map("lab_b")
+            self._maps = {"dark": to_map("gray_eq"), "bright": color, "blue": color, "red": to_map("lab_a")}
+            self._maps_key = key
+        return self._maps
+
+
+def load_golden_model(path=GOLDEN_MODEL_PATH):
+    """
+    Returns the GoldenModel saved at `path`, or None if it was never built.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        return GoldenModel.load(path)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        print(f"[WARN] Modelo dourado inválido ({path}): {e}")
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Modelo dourado (média/desvio por píxel) a partir de folhas boas")
+    parser.add_argument("images", help="Padrão glob das fotografias de folhas boas, ex.: 'data/golden/*.jpg'")
+    parser.add_argument("--template", default="data/raw/fba_template.jpg")
+    parser.add_argument("--mask", default="data/mask/leaf_mask.png")
+    parser.add_argument("--output", default=GOLDEN_MODEL_PATH)
+    args = parser.parse_args()
+
+    template = cv2.imread(args.template)
+    mask = cv2.imread(args.mask, cv2.IMREAD_GRAYSCALE)
+    builder = build_golden_model(sorted(glob.glob(args.images)), template, mask)
+    save_golden_model(builder, args.output)
@@ -0,0 +1,220 @@
+import time
+
+import cv2
+import numpy as np
+
+from models.defect_detector import DefectDetector
+from models.threshold_sweep import component_count_curve
+
+
+class IncrementalDefectDetector(DefectDetector):
+    """
+    DefectDetector for tuning the parameters on a single image (DefectTunerWindow).
+
+    The parameter-independent part (equalized gray, its 5x5 gradient and the raw
+    dark/yellow/blue/red differences against the template) is computed once per
+    image, and every later stage is memoized by the parameters it depends on.
+    Moving one slider then only redoes that threshold, its morphology, the final
+    union and the defect extraction; `recomputed` lists the stages of the last call.
+
+    The image is recognised by identity: pass the same array on every call and
+    call `invalidate` if it is modified in place.
+    """
+
+    _RAW_BUFFERS = ("gray_eq", "diff_dark_raw", "morph_grad", "diff_yellow", "diff_blue", "diff_red")
+
+    def __init__(self, tpl, mask, cans=None):
+        super().__init__(tpl, mask, cans)
+        h, w = self.shape
+        self._own_raw = {name: np.empty((h, w), np.uint8) for name in self._RAW_BUFFERS}
+        # O cinza equalizado é o do próprio detetor (_equalize escreve-o, _extract_defects lê-o)
+        self._own_raw["gray_eq"] = self._buffers["gray_eq"]
+        self._raw = self._own_raw
+        self._image = None
+        self._stages = {}  # etapa -> parâmetros com que o seu buffer foi calculado
+        self._defects = None
+        self._curves = {}  # canal -> (parâmetros, curva) da imagem atual
+        self.recomputed = []
+
+    def invalidate(self):
+        self._image = None
+        self._stages.clear()
+        self._curves.clear()
+
+    def set_threshold_maps(self, maps):
+        super().set_threshold_maps(maps)
+        self._stages.clear()
+
+    def _prepare_image(self, aligned):
+        # Diferenças brutas, independentes dos parâmetros: uma vez por imagem
+        if aligned is self._image:
+            return
+        self._raw = self._own_raw  # diferenças externas (set_raw_differences) podem ser só de leitura
+        b, raw = self._buffers, self._raw
+        tpl = self.template
+
+        gray_eq = self._equalize(aligned)
+        cv2.subtract(tpl.gray_eq, gray_eq, dst=raw["diff_dark_raw"])
+        cv2.morphologyEx(gray_eq, cv2.MORPH_GRADIENT, self._gradient_kernel, dst=raw["morph_grad"])
+
+        cv2.cvtColor(aligned, cv2.COLOR_BGR2LAB, dst=self._lab)
+        cv2.extractChannel(self._lab, 1, dst=b["lab_a"])
+        cv2.extractChannel(self._lab, 2, dst=b["lab_b"])
+        cv2.subtract(b["lab_b"], tpl.lab_b, dst=raw["diff_yellow"])
+        cv2.subtract(tpl.lab_b, b["lab_b"], dst=raw["diff_blue"])
+        cv2.subtract(b["lab_a"], tpl.lab_a, dst=raw["diff_red"])
+
+        self._image = aligned
+        self._stages.clear()
+        self._curves.clear()
+        self.recomputed.append("raw")
+
+    def raw_differences(self, aligned):
+        """
+        Parameter-independent differences of `aligned` ({"gray_eq", "diff_dark_raw", "morph_grad",
+        "diff_yellow", "diff_blue", "diff_red"} -> uint8 views of the detector buffers), e.g. to cache
+        them on disk.
+        """
+        self._prepare_image(aligned)
+        return self._raw
+
+    def set_raw_differences(self, aligned, raw):
+        """
+        Uses differences computed earlier by `raw_differences` (possibly read-only memmaps) for `aligned`,
+        so detecting on a cached sheet skips the preprocessing.
+        """
+        missing = set(self._RAW_BUFFERS) - set(raw)
+        if missing:
+            raise ValueError(f"Diferenças em falta: {sorted(missing)}")
+        if aligned.shape[:2] != self.shape or any(raw[name].shape != self.shape for name in self._RAW_BUFFERS):
+            raise ValueError(f"Diferenças com tamanho diferente do template {self.shape}")
+        self._raw = {name: raw[name] for name in self._RAW_BUFFERS}
+        # _extract_defects lê o cinza equalizado do buffer (delta_gray dos registos)
+        np.copyto(self._buffers["gray_eq"], raw["gray_eq"])
+        self._image = aligned
+        self._stages.clear()
+        self._curves.clear()
+
+    def _stage(self, name, key, compute):
+        # Recalcula a etapa só se os parâmetros de que depende mudaram; devolve a chave (para as etapas seguintes)
+        if self._stages.get(name) != key:
+            compute()
+            self._stages[name] = key
+            self.recomputed.append(name)
+        return key
+
+    def detect(self, aligned,
+               dark_threshold, bright_threshold,
+               dark_morph_kernel_size, dark_morph_iterations,
+               bright_morph_kernel_size, bright_morph_iterations,
+               min_defect_area,
+               dark_gradient_threshold,
+               blue_threshold, red_threshold):
+        """
+        Same parameters and result as `DefectDetector.detect`, recomputing only the stages
+        whose parameters changed since the previous call on the same image.
+        """
+        if aligned.shape[:2] != self.shape:
+            raise ValueError(f"Imagem alinhada {aligned.shape[:2]} com tamanho diferente do template {self.shape}")
+
+        start_time = time.perf_counter()
+        self.recomputed = []
+        self._prepare_image(aligned)  # repõe self._raw numa imagem nova: só depois se lê
+        b, raw = self._buffers, self._raw
+
+        thresholds = self._thresholds((slice(None), slice(None)),
+                                      dark_threshold, bright_threshold, blue_threshold, red_threshold)
+        dark_t, bright_t, blue_t, red_t = thresholds
+        # Com mapas por píxel os limiares escalares não contam: a chave passa a ser o próprio mapa
+        maps = None if self.threshold_maps is None else id(self.threshold_maps)
+
+        def dark():
+            self._threshold(raw["diff_dark_raw"], dark_t, b["darker"])
+            cv2.threshold(raw["morph_grad"], dark_gradient_threshold, 255, cv2.THRESH_BINARY, dst=b["gradient_mask"])
+            cv2.bitwise_and(b["darker"], b["gradient_mask"], dst=b["darker_filtered"])
+
+        dark_key = self._stage("darker_filtered", (maps or dark_threshold, dark_gradient_threshold), dark)
+        color_keys = {}
+        for name, diff, threshold, value in (("brighter", "diff_yellow", bright_t, bright_threshold),
+                                             ("blue", "diff_blue", blue_t, blue_threshold),
+                                             ("red", "diff_red", red_t, red_threshold)):
+            color_keys[name] = self._stage(name, maps or value,
+                                           lambda: self._threshold(raw[diff], threshold, b[name]))
+
+        # --- Morphological Cleaning ---
+        clean_keys = [self._stage("darker_clean", (dark_key, dark_morph_kernel_size, dark_morph_iterations),
+                                  lambda: self._clean(b["darker_filtered"], dark_morph_kernel_size,
+                                                      dark_morph_iterations, b["opened"], b["darker_clean"]))]
+        for name in ("brighter", "blue", "red"):
+            clean_keys.append(self._stage(f"{name}_clean",
+                                          (color_keys[name], bright_morph_kernel_size, bright_morph_iterations),
+                                          lambda: self._clean(b[name], bright_morph_kernel_size,
+                                                              bright_morph_iterations, b["opened"],
+                                                              b[f"{name}_clean"])))
+
+        # --- Combine + Mask ROI ---
+        def combine():
+            combined = b["combined"]
+            cv2.bitwise_or(b["darker_clean"], b["brighter_clean"], dst=combined)
+            cv2.bitwise_or(combined, b["blue_clean"], dst=combined)
+            cv2.bitwise_or(combined, b["red_clean"], dst=combined)
+            b["final"].fill(0)
+            cv2.bitwise_and(combined, combined, dst=b["final"], mask=self.mask)
+
+        final_key = self._stage("final", tuple(clean_keys), combine)
+
+        def extract():
+            self._defects, _ = self._extract_defects(aligned, b["final"], min_defect_area)
+
+        self._stage("defects", (final_key, min_defect_area), extract)
+
+        end_time = time.perf_counter()
+        print(f"detect_defects (incremental: {', '.join(self.recomputed) or 'cache'}) "
+              f"took {end_time - start_time:.4f} seconds")
+
+        return b["final"], self._defects, b["darker_filtered"], b["brighter"], b["blue"], b["red"]
+
+    def threshold_curves(self, aligned, min_defect_area, dark_gradient_threshold):
+        """
+        Defect count vs threshold for each channel: for every t in 0..255, the number of components of
+        the raw difference > t (inside the mask, dark one after the gradient filter) with at least
+        `min_defect_area` pixels. See `component_count_curve`; the morphology is not included, the
+        area is the pixel count (not the outline area that `detect` applies, see passes_min_area, so
+        small or thin blobs are counted more generously) and, with per-pixel threshold maps, t is a
+        global threshold on the same differences.
+
+        Returns:
+            dict: {"dark", "bright", "blue", "red"} -> int64[256], memoized per image and parameters.
+        """
+        self._prepare_image(aligned)
+        raw = self._raw
+        curves = {}
+        for name, key in (("dark", (min_defect_area, dark_gradient_threshold)),
+                          ("bright", min_defect_area), ("blue", min_defect_area), ("red", min_defect_area)):
+            cached = self._curves.get(name)
+            if cached is None or cached[0] != key:
+                if name == "dark":
+                    gradient = cv2.compare(raw["morph_grad"], dark_gradient_threshold, cv2.CMP_GT)
+                    diff = cv2.bitwise_and(raw["diff_dark_raw"], gradient)
+                else:
+                    diff = raw[{"bright": "diff_yellow", "blue": "diff_blue", "red": "diff_red"}[name]]
+                cached = (key, component_count_curve(diff, min_defect_area, self.mask))
+                self._curves[name] = cached
+            curves[name] = cached[1]
+        return curves
+
+    def stage_key(self, name):
+        """
+        Parameters the buffer of stage `name` ("darker_filtered", "brighter", "blue", "red", "final",
+        "defects", ...) was last computed with, or None. Lets callers memoize their own derived data.
+        """
+        return self._stages.get(name)
+
+    # Os outros modos escrevem nos mesmos buffers: a memória das etapas deixa de valer
+    def detect_by_can(self, *args, **kwargs):
+        self.invalidate()
+        return super().detect_by_can(*args, **kwargs)
+
+    def detect_screened(self, *args, **kwargs):
+        self.invalidate()
+        return super().detect_screened(*args, **kwargs)
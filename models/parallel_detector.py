@@ -0,0 +1,156 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from models.defect_detector import DefectDetector
+
+
+def resolve_workers(workers):
+    # 0 (ou negativo) = um por core disponível
+    if workers and workers > 0:
+        return workers
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _bands(height, count, halo):
+    """
+    Faixas horizontais (y0, y1, ty0, ty1): linhas [y0, y1) são o resultado da faixa,
+    [ty0, ty1) as linhas processadas (com `halo` linhas de contexto de cada lado).
+    """
+    edges = np.linspace(0, height, count + 1).round().astype(int)
+    return [(int(y0), int(y1), max(0, int(y0) - halo), min(height, int(y1) + halo))
+            for y0, y1 in zip(edges[:-1], edges[1:]) if y1 > y0]
+
+
+class ParallelDefectDetector(DefectDetector):
+    """
+    DefectDetector that splits the sheet into overlapping horizontal bands and
+    runs them on a ThreadPoolExecutor (OpenCV releases the GIL).
+
+    Each band is processed with a halo of `roi_margin` rows, so its interior is
+    identical to the single-image result, and written straight into the shared
+    full-size buffers (bands never write the same rows). CLAHE stays a single
+    sheet-wide call because its tile grid depends on the whole image, and the
+    defects are extracted once from the stitched mask, so a defect crossing a
+    band seam comes out as one record, exactly as in `detect`.
+
+    `workers` <= 1 falls back to the serial `DefectDetector.detect`.
+    """
+
+    def __init__(self, tpl, mask, cans=None, workers=0, bands=None):
+        super().__init__(tpl, mask, cans)
+        self.workers = resolve_workers(workers)
+        self.band_count = bands or self.workers
+        self._executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        self._band_workspaces = {}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _band_workspace(self, index, rows):
+        # Buffers próprios de cada faixa (as faixas correm em paralelo); crescem se o halo aumentar
+        workspace = self._band_workspaces.get(index)
+        if workspace is None or workspace[1].shape[0] < rows:
+            w = self.shape[1]
+            names = self._STAGE_BUFFERS + ("gray",)
+            workspace = ({name: np.empty((rows, w), np.uint8) for name in names}, np.empty((rows, w, 3), np.uint8))
+            self._band_workspaces[index] = workspace
+        buffers, lab = workspace
+        return {name: buf[:rows] for name, buf in buffers.items()}, lab[:rows]
+
+    def _equalize(self, aligned):
+        if self._executor is None:
+            return super()._equalize(aligned)
+
+        b = self._buffers
+
+        # Cinza + blur 3x3 por faixa (1 linha de halo), escritos diretamente no buffer da folha
+        def blur_band(index, band):
+            y0, y1, ty0, ty1 = band
+            tb, _ = self._band_workspace(index, ty1 - ty0)
+            gray, blurred = tb["gray"], tb["diff"]
+            cv2.cvtColor(aligned[ty0:ty1], cv2.COLOR_BGR2GRAY, dst=gray)
+            cv2.GaussianBlur(gray, (3, 3), 0, dst=blurred)
+            np.copyto(b["blurred"][y0:y1], blurred[y0 - ty0:y1 - ty0])
+
+        self._run_bands(blur_band, _bands(self.shape[0], self.band_count, 1))
+
+        # CLAHE depende da imagem inteira: uma única chamada (o OpenCV já a paraleliza internamente)
+        self._clahe.apply(b["blurred"], dst=b["gray_eq"])
+        return b["gray_eq"]
+
+    def _run_bands(self, fn, bands):
+        futures = [self._executor.submit(fn, index, band) for index, band in enumerate(bands)]
+        for future in futures:
+            future.result()  # propaga exceções das faixas
+
+    def detect(self, aligned,
+               dark_threshold, bright_threshold,
+               dark_morph_kernel_size, dark_morph_iterations,
+               bright_morph_kernel_size, bright_morph_iterations,
+               min_defect_area,
+               dark_gradient_threshold,
+               blue_threshold, red_threshold):
+        """
+        Same parameters and result as `DefectDetector.detect`, computed band by band in parallel.
+        """
+        if self._executor is None:
+            return super().detect(aligned,
+                                  dark_threshold, bright_threshold,
+                                  dark_morph_kernel_size, dark_morph_iterations,
+                                  bright_morph_kernel_size, bright_morph_iterations,
+                                  min_defect_area,
+                                  dark_gradient_threshold,
+                                  blue_threshold, red_threshold)
+        if aligned.shape[:2] != self.shape:
+            raise ValueError(f"Imagem alinhada {aligned.shape[:2]} com tamanho diferente do template {self.shape}")
+
+        start_time = time.perf_counter()
+        b = self._buffers
+        tpl = self.template
+        gray_eq = self._equalize(aligned)
+
+        halo = self.roi_margin(dark_morph_kernel_size, dark_morph_iterations,
+                               bright_morph_kernel_size, bright_morph_iterations)
+        outputs = ("darker_filtered", "brighter", "blue", "red")
+
+        def detect_band(index, band):
+            y0, y1, ty0, ty1 = band
+            tb, lab = self._band_workspace(index, ty1 - ty0)
+            rows = slice(ty0, ty1)
+            combined = self._difference_masks(aligned[rows], gray_eq[rows], tpl.gray_eq[rows],
+                                              tpl.lab_a[rows], tpl.lab_b[rows], tb, lab,
+                                              dark_threshold, bright_threshold,
+                                              dark_morph_kernel_size, dark_morph_iterations,
+                                              bright_morph_kernel_size, bright_morph_iterations,
+                                              dark_gradient_threshold,
+                                              blue_threshold, red_threshold,
+                                              region=(rows, slice(None)))
+
+            # Só o interior da faixa é exato: é esse que vai para os buffers da folha
+            inner = slice(y0 - ty0, y1 - ty0)
+            for name in outputs:
+                np.copyto(b[name][y0:y1], tb[name][inner])
+            final = b["final"][y0:y1]
+            final.fill(0)
+            cv2.bitwise_and(combined[inner], combined[inner], dst=final,
+                            mask=None if self.mask is None else self.mask[y0:y1])
+
+        self._run_bands(detect_band, _bands(self.shape[0], self.band_count, halo))
+
+        # Defeitos extraídos da máscara já cosida: os que atravessam uma junção ficam inteiros
+        final_defect_mask = b["final"]
+        defects, _ = self._extract_defects(aligned, final_defect_mask, min_defect_area)
+
+        end_time = time.perf_counter()
+        print(f"detect_defects ({self.workers} threads) took {end_time - start_time:.4f} seconds")
+
+        return final_defect_mask, defects, b["darker_filtered"], b["brighter"], b["blue"], b["red"]
@@ -0,0 +1,119 @@
+import cv2
+import numpy as np
+
+
+def _band_regions(coverage, band_height):
+    """
+    Decompõe uma máscara de cobertura em retângulos sem sobreposição:
+    em cada faixa horizontal de `band_height` linhas, um retângulo por sequência contígua de colunas ocupadas.
+    """
+    regions = []
+    h = coverage.shape[0]
+    for y0 in range(0, h, band_height):
+        y1 = min(h, y0 + band_height)
+        cols = np.concatenate(([0], coverage[y0:y1].any(axis=0).view(np.int8), [0]))
+        edges = np.flatnonzero(np.diff(cols))
+        for x0, x1 in zip(edges[::2], edges[1::2]):
+            regions.append((int(x0), y0, int(x1 - x0), y1 - y0))
+    return regions
+
+
+class RegionWarper:
+    """
+    Warps only selected template-space regions instead of the whole sheet.
+
+    The first time a homography is seen each region is warped directly with
+    cv2.warpPerspective. If the same H comes back (e.g. an AlignmentSession
+    hit), fixed-point remap grids (cv2.convertMaps) are built for it and every
+    following sheet only pays one cv2.remap per region. Pixels outside the
+    regions stay at zero.
+    """
+
+    def __init__(self, template_shape, regions):
+        self.shape = tuple(template_shape[:2])
+        self.regions = [tuple(int(v) for v in r) for r in regions if r[2] > 0 and r[3] > 0]
+        self._last_key = None
+        self._maps_key = None
+        self._maps = None
+
+    @classmethod
+    def for_mask(cls, mask, boxes=None, margin=8, band_height=64):
+        """
+        Builds a warper covering every non-zero pixel of `mask` (dilated by `margin`).
+
+        Args:
+            mask (np.array): Template-space mask (e.g. leaf_mask.png).
+            boxes (list, optional): Extra (x, y, w, h) boxes to cover, e.g. the can bounding boxes.
+                If None, only the bounding box of the mask is used.
+            margin (int): Border kept around the mask.
+            band_height (int): Height of the horizontal bands used to split the covered area.
+        """
+        h, w = mask.shape[:2]
+        if boxes is None:
+            x, y, bw, bh = cv2.boundingRect(mask)
+            x0, y0 = max(0, x - margin), max(0, y - margin)
+            return cls(mask.shape, [(x0, y0, min(w, x + bw + margin) - x0, min(h, y + bh + margin) - y0)])
+
+        coverage = mask > 0
+        if margin > 0:
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * margin + 1, 2 * margin + 1))
+            coverage = cv2.dilate(mask, kernel) > 0
+        for x, y, bw, bh in boxes:
+            coverage[max(0, y):max(0, y + bh), max(0, x):max(0, x + bw)] = True
+        return cls(mask.shape, _band_regions(coverage, band_height))
+
+    @property
+    def area(self):
+        return sum(w * h for _, _, w, h in self.regions)
+
+    def _build_maps(self, H):
+        H_inv = np.linalg.inv(H)
+        maps = []
+        for x, y, w, h in self.regions:
+            # Coordenadas no template -> coordenadas na imagem atual
+            xs, ys = np.meshgrid(np.arange(x, x + w, dtype=np.float32), np.arange(y, y + h, dtype=np.float32))
+            pts = cv2.perspectiveTransform(np.dstack((xs, ys)), H_inv)
+            maps.append(cv2.convertMaps(pts, None, cv2.CV_16SC2))
+        return maps
+
+    def warp(self, current_img, H, out=None):
+        """
+        Equivalent of cv2.warpPerspective(current_img, H, template size), restricted to the regions.
+
+        Args:
+            out (np.array, optional): Output buffer to reuse (template size, same dtype/channels).
+        """
+        H = np.asarray(H, dtype=np.float64)
+        key = H.tobytes()
+        if key != self._maps_key and key == self._last_key:
+            # Mesma homografia pela segunda vez: passa a valer a pena ter as grelhas de remap
+            self._maps = self._build_maps(H)
+            self._maps_key = key
+        self._last_key = key
+
+        if out is None:
+            out = np.zeros(self.shape + current_img.shape[2:], dtype=current_img.dtype)
+
+        if key == self._maps_key:
+            for (x, y, w, h), (map1, map2) in zip(self.regions, self._maps):
+                cv2.remap(current_img, map1, map2, cv2.INTER_LINEAR, dst=out[y:y + h, x:x + w],
+                          borderMode=cv2.BORDER_CONSTANT)
+        else:
+            for x, y, w, h in self.regions:
+                T = np.array([[1, 0, -x], [0, 1, -y], [0, 0, 1]], dtype=np.float64)
+                cv2.warpPerspective(current_img, T @ H, (w, h), dst=out[y:y + h, x:x + w],
+                                    borderMode=cv2.BORDER_CONSTANT)
+        return out
+
+
+def build_region_warper(warp_regions, mask, can_boxes=None):
+    """
+    Warper for the "warp_regions" alignment setting: "full" (None), "mask_bbox" or "cans".
+    """
+    if warp_regions == "full" or mask is None:
+        return None
+    if warp_regions == "mask_bbox":
+        return RegionWarper.for_mask(mask)
+    if warp_regions == "cans":
+        return RegionWarper.for_mask(mask, can_boxes or [])
+    raise ValueError(f"Valor de warp_regions desconhecido: {warp_regions}")
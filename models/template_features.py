@@ -0,0 +1,129 @@
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+from models.align_image import orb, extract_orb_features
+
+
+def _orb_params(detector):
+    # Parâmetros que alteram os keypoints/descritores produzidos
+    return (
+        detector.getMaxFeatures(), detector.getScaleFactor(), detector.getNLevels(),
+        detector.getEdgeThreshold(), detector.getFirstLevel(), detector.getWTA_K(),
+        int(detector.getScoreType()), detector.getPatchSize(), detector.getFastThreshold(),
+    )
+
+
+def _keypoints_to_array(keypoints):
+    return np.array(
+        [(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id) for kp in keypoints],
+        dtype=np.float32,
+    ).reshape(-1, 7)
+
+
+def _array_to_keypoints(arr):
+    return tuple(
+        cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response), int(octave), int(class_id))
+        for x, y, size, angle, response, octave, class_id in arr
+    )
+
+
+class TemplateFeatures:
+    """
+    ORB keypoints and descriptors of the template, computed at `resize_scale`.
+
+    Keypoint coordinates are in the resized template space, exactly as
+    `align_with_template` would have computed them.
+    """
+
+    def __init__(self, keypoints, descriptors, resize_scale, template_shape, key):
+        self.keypoints = keypoints
+        self.descriptors = descriptors
+        self.resize_scale = resize_scale
+        self.template_shape = template_shape
+        self.key = key
+
+
+class TemplateFeatureStore:
+    """
+    Computes the template ORB features once and persists them next to the template.
+
+    The cache file is keyed by the SHA-1 of the template file contents plus the
+    ORB and resize parameters, so editing the template or the detector settings
+    simply produces a new cache entry.
+    """
+
+    def __init__(self, template_path, resize_scale=0.5, detector=orb):
+        self.template_path = template_path
+        self.resize_scale = resize_scale
+        self.detector = detector
+
+    def cache_key(self):
+        with open(self.template_path, "rb") as f:
+            content_hash = hashlib.sha1(f.read()).hexdigest()
+        params = repr((_orb_params(self.detector), float(self.resize_scale)))
+        return hashlib.sha1(f"{content_hash}:{params}".encode("utf-8")).hexdigest()[:16]
+
+    def cache_path(self, key):
+        stem, _ = os.path.splitext(self.template_path)
+        return f"{stem}.features_{key}.npz"
+
+    def load(self, template_img=None):
+        """
+        Loads the cached features, computing and saving them if needed.
+
+        Args:
+            template_img (np.array, optional): Already decoded template, avoids reading it
+                again when the cache has to be rebuilt.
+
+        Returns:
+            TemplateFeatures: The template keypoints and descriptors.
+        """
+        key = self.cache_key()
+        path = self.cache_path(key)
+
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    return TemplateFeatures(
+                        _array_to_keypoints(data["keypoints"]),
+                        data["descriptors"],
+                        float(data["resize_scale"]),
+                        tuple(int(v) for v in data["template_shape"]),
+                        key,
+                    )
+            except (OSError, KeyError, ValueError) as e:
+                print(f"[WARN] Cache de features inválida ({path}): {e}")
+
+        if template_img is None:
+            template_img = cv2.imread(self.template_path)
+        if template_img is None:
+            raise ValueError(f"Não foi possível ler o template: {self.template_path}")
+
+        keypoints, descriptors = extract_orb_features(template_img, self.resize_scale, self.detector)
+        if descriptors is None:
+            raise ValueError("Não foi possível extrair descritores ORB do template.")
+
+        features = TemplateFeatures(tuple(keypoints), descriptors, self.resize_scale, template_img.shape[:2], key)
+        self.save(features, path)
+        return features
+
+    def save(self, features, path):
+        try:
+            np.savez(
+                path,
+                keypoints=_keypoints_to_array(features.keypoints),
+                descriptors=features.descriptors,
+                resize_scale=np.float64(features.resize_scale),
+                template_shape=np.array(features.template_shape, dtype=np.int64),
+            )
+            print(f"[INFO] Features do template guardadas em {path}")
+        except OSError as e:
+            # A cache é opcional: sem permissão de escrita continua apenas em memória
+            print(f"[WARN] Não foi possível guardar features do template: {e}")
+
+
+def load_template_features(template_path, template_img=None, resize_scale=0.5):
+    return TemplateFeatureStore(template_path, resize_scale).load(template_img)
@@ -0,0 +1,145 @@
+import cv2
+import numpy as np
+
+# Vizinhos "para a frente" da conectividade 8: direita, baixo, baixo-direita, baixo-esquerda
+_FORWARD_OFFSETS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+# Acima desta fração de píxeis ativos um nível sai mais barato rotulado diretamente com o OpenCV
+_DENSE_FRACTION = 1 / 8
+
+
+def _find(parent, nodes):
+    # Raiz de cada nó (vetorizado, só os que ainda não chegaram à raiz); comprime o caminho dos nós pedidos
+    roots = parent[nodes]
+    pending = np.flatnonzero(parent[roots] != roots)
+    while len(pending):
+        roots[pending] = parent[roots[pending]]
+        pending = pending[parent[roots[pending]] != roots[pending]]
+    parent[nodes] = roots
+    return roots
+
+
+def _unique(values, marker):
+    # np.unique para índices < len(marker), sem ordenar por hash: marca e recolhe
+    marker[values] = True
+    found = np.flatnonzero(marker)
+    marker[found] = False
+    return found
+
+
+def _forward_edges(ids, value_img):
+    # Arestas entre vizinhos-8 ativos; o peso é o menor dos dois valores (a aresta existe enquanto t < peso)
+    h, w = ids.shape
+    edge_a, edge_b, edge_w = [], [], []
+    for dy, dx in _FORWARD_OFFSETS:
+        rows_a, rows_b = slice(0, h - dy), slice(dy, h)
+        cols_a = slice(0, w - dx) if dx >= 0 else slice(-dx, w)
+        cols_b = slice(dx, w) if dx >= 0 else slice(0, w + dx)
+        weight = np.minimum(value_img[rows_a, cols_a], value_img[rows_b, cols_b])
+        keep = weight > 0
+        edge_a.append(ids[rows_a, cols_a][keep])
+        edge_b.append(ids[rows_b, cols_b][keep])
+        edge_w.append(weight[keep])
+    return np.concatenate(edge_a), np.concatenate(edge_b), np.concatenate(edge_w)
+
+
+def _labelled_count(active, min_area):
+    _, _, stats, _ = cv2.connectedComponentsWithStats(active, connectivity=8)
+    return int(np.count_nonzero(stats[1:, cv2.CC_STAT_AREA] >= min_area))
+
+
+def component_count_curve(diff, min_area=1, mask=None):
+    """
+    Number of 8-connected components of (diff > t) with at least `min_area` pixels, for every t in 0..255.
+
+    Single sweep instead of 256 labellings: the active pixels and the edges between 8-neighbours are
+    bucketed by gray level (an edge exists while both of its pixels are > t) and a vectorized union-find
+    adds them from 255 down, one level per batch, keeping the component sizes and how many reach
+    `min_area`. The few lowest levels, where most of the sheet is active (compression noise), are
+    cheaper to label directly and are counted with cv2.connectedComponentsWithStats instead.
+
+    This is the raw threshold test of one channel: the morphology (opening/closing) the detector
+    applies afterwards is not included.
+
+    Args:
+        diff (np.ndarray): uint8 difference image (e.g. the template - image difference of a channel).
+        min_area (int): Minimum component size in pixels (as `min_defect_area`).
+        mask (np.ndarray, optional): Only pixels where mask > 0 count.
+
+    Returns:
+        np.ndarray: int64[256], counts[t] for threshold t (counts[255] is always 0).
+    """
+    if diff.dtype != np.uint8 or diff.ndim != 2:
+        raise ValueError("Esperada uma imagem de diferenças uint8 2D")
+    min_area = max(int(min_area), 1)
+    counts = np.zeros(256, np.int64)
+
+    if mask is not None:
+        diff = cv2.bitwise_and(diff, diff, mask=(mask > 0).view(np.uint8))
+    histogram = cv2.calcHist([diff], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+    added = np.cumsum(histogram[::-1])[::-1]  # added[v] = píxeis com valor >= v
+
+    # Níveis densos (muitos píxeis acima do limiar): rotulagem direta
+    sweep_from = 1
+    while sweep_from < 256 and added[sweep_from] > _DENSE_FRACTION * diff.size:
+        counts[sweep_from - 1] = _labelled_count(cv2.compare(diff, sweep_from - 1, cv2.CMP_GT), min_area)
+        sweep_from += 1
+    if sweep_from > 255 or added[sweep_from] == 0:
+        return counts
+
+    # Índice compacto dos píxeis >= sweep_from (-1 nos restantes), por valor decrescente: os já
+    # acrescentados ao descer até ao nível v são sempre o prefixo [0, added[v])
+    value_img = np.where(diff >= sweep_from, diff, 0).astype(np.uint8)
+    pixels = np.flatnonzero(value_img)
+    by_value = np.argsort(value_img.ravel()[pixels], kind="stable")[::-1]
+    ids = np.full(diff.shape, -1, np.int32)
+    ids.ravel()[pixels[by_value]] = np.arange(len(pixels), dtype=np.int32)
+    edge_a, edge_b, edge_w = _forward_edges(ids, value_img)
+    del ids, value_img, pixels, by_value
+
+    # Arestas agrupadas por nível: as do nível v são [edge_start[v], edge_end[v])
+    order = np.argsort(edge_w, kind="stable")
+    edge_a, edge_b = edge_a[order], edge_b[order]
+    per_level = np.bincount(edge_w, minlength=256)
+    edge_end = np.cumsum(per_level)
+    edge_start = edge_end - per_level
+    del order, edge_w
+
+    n = int(added[sweep_from])
+    parent = np.arange(n, dtype=np.int32)
+    size = np.ones(n, np.int64)
+    marker = np.zeros(n, bool)
+    big = 0
+    for v in range(255, sweep_from - 1, -1):
+        if min_area == 1:
+            big += int(histogram[v])  # cada píxel novo é um componente de 1 píxel
+
+        root_a = _find(parent, edge_a[edge_start[v]:edge_end[v]])
+        root_b = _find(parent, edge_b[edge_start[v]:edge_end[v]])
+        differ = root_a != root_b
+        root_a, root_b = root_a[differ], root_b[differ]
+        if len(root_a):
+            # Raízes envolvidas neste nível (ainda com o tamanho antigo)
+            involved = _unique(np.concatenate((root_a, root_b)), marker)
+            big -= int(np.count_nonzero(size[involved] >= min_area))
+
+            # União paralela: cada raiz passa a apontar para a menor das ligadas, até todas as arestas fecharem
+            while len(root_a):
+                np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+                root_a, root_b = _find(parent, root_a), _find(parent, root_b)
+                differ = root_a != root_b
+                root_a, root_b = root_a[differ], root_b[differ]
+
+            # Tamanho de cada raiz final: soma das raízes que absorveu
+            final = _find(parent, involved)
+            merged = _unique(final, marker)
+            total = np.bincount(final, weights=size[involved], minlength=merged[-1] + 1)
+            size[merged] = total[merged].astype(np.int64)
+            big += int(np.count_nonzero(size[merged] >= min_area))
+
+        if v % 8 == 0:
+            # Compressão total do que já foi acrescentado (de vez em quando: custa a soma dos valores)
+            _find(parent, np.arange(added[v], dtype=np.int32))
+        counts[v - 1] = big
+
+    return counts
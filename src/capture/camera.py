@@ -2,6 +2,11 @@ import cv2
 import datetime
 import os
 
+from models.camera_calibration import load_frame_rectifier
+
+_rectifier = None
+
+
 def capture_image(save_dir="data/raw"):
     # Garante que o diretório existe
     os.makedirs(save_dir, exist_ok=True)
@@ -18,6 +23,18 @@ def capture_image(save_dir="data/raw"):
     if not ret:
         raise RuntimeError("Erro: não foi possível capturar a imagem.")
 
+    # Correção de distorção/inclinação: um único remap com os mapas da calibração
+    global _rectifier
+    if _rectifier is None:
+        _rectifier = load_frame_rectifier()
+    if _rectifier is not None:
+        if _rectifier.size == (frame.shape[1], frame.shape[0]):
+            frame = _rectifier.apply(frame)
+        else:
+            # Mapas de outra resolução: apply() falharia; guarda-se o frame sem correção
+            print(f"[WARN] Calibração para {_rectifier.size[0]}x{_rectifier.size[1]}, captura em "
+                  f"{frame.shape[1]}x{frame.shape[0]}: imagem guardada sem correção de distorção")
+
     # Gera nome do ficheiro com timestamp
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = os.path.join(save_dir, f"capture_{timestamp}.jpg")
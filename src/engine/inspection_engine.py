@@ -0,0 +1,329 @@
+import argparse
+import csv
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from config.config import TEMPLATE_IMAGE_PATH, IMAGE_EXTENSIONS
+from config.config_registry import ALIGNMENT_SCHEMA, INSPECTION_PARAMS_SCHEMA
+from config.utils import load_params
+from models.align_image import TemplatePyramid, PhaseTemplate
+from models.alignment_session import AlignmentSession
+from models.can_layout import get_can_layout, NO_CAN
+from models.defect_detector import PreparedTemplate, DEFECT_DTYPE, CAN_STATS_DTYPE, DETECT_PARAM_KEYS
+from models.golden_model import load_golden_model
+from models.parallel_detector import ParallelDefectDetector
+from models.region_warp import build_region_warper
+from models.template_features import load_template_features
+
+MASK_PATH = "data/mask/leaf_mask.png"
+PARAMS_PATH = "config/inspection_params.json"
+ALIGNMENT_CONFIG_PATH = "config/config_alignment.json"
+
+# Valores aceites de "can_assignment" (ver InspectionEngine.assign_cans)
+CAN_ASSIGNMENTS = ("raster", "overlap")
+
+# Etapas medidas em InspectionResult.timings, pela ordem em que correm
+STAGES = ("align", "mask", "detect", "contours", "cans", "can_stats")
+
+
+class InspectionResult:
+    """
+    Outcome of one `InspectionEngine.inspect` call.
+
+    `defects` is a DEFECT_DTYPE record array with the "can" field filled, `can_stats` the
+    CAN_STATS_DTYPE per-can summary and `timings` the seconds spent in each stage (STAGES, plus
+    "total"; stages that did not run are absent). A sheet rejected by the alignment gate has
+    `rejection` set and no defects.
+
+    `aligned`, `defect_mask` and `masks` (the dark/yellow/blue/red class masks) are the detector
+    buffers: they are overwritten by the next inspection, so copy them if they must outlive it.
+    """
+
+    def __init__(self):
+        self.rejection = []
+        self.aligned = None
+        self.homography = None
+        self.defect_mask = None
+        self.masks = {}
+        self.defects = np.zeros(0, DEFECT_DTYPE)
+        self.contours = None
+        self.by_can = False
+        self.can_stats = np.zeros(0, CAN_STATS_DTYPE)
+        self.timings = {}
+
+    @property
+    def accepted(self):
+        return not self.rejection
+
+    @property
+    def cans_with_defects(self):
+        cans = self.defects["can"]
+        return sorted(set(cans[cans != NO_CAN].tolist()))
+
+    def summary(self):
+        """Flat dict of the result (for logs and CSV rows): status, counts and per-stage milliseconds."""
+        row = {
+            "status": "ok" if self.accepted else "rejeitada",
+            "defects": len(self.defects),
+            "cans": " ".join(str(n) for n in self.cans_with_defects),
+            "rejection": "; ".join(self.rejection),
+        }
+        for stage in STAGES + ("total",):
+            row[f"{stage}_ms"] = round(self.timings[stage] * 1000, 2) if stage in self.timings else ""
+        return row
+
+
+class InspectionEngine:
+    """
+    Headless align -> mask -> detect -> can mapping pipeline, shared by InspectionWindow and the CLI.
+
+    Everything that depends only on the template, the mask and the can layout is prepared once:
+    the ORB features, pyramids, the alignment session, the prepared template (or golden model)
+    and the detector buffers. Per sheet, `inspect` only rereads what changed on disk (the
+    inspection parameters and the layout files, both mtime-cached) and runs the stages.
+    """
+
+    def __init__(self, template_path=TEMPLATE_IMAGE_PATH, mask_path=MASK_PATH, param_path=PARAMS_PATH,
+                 alignment_config_path=ALIGNMENT_CONFIG_PATH):
+        self.template_path = template_path
+        self.mask_path = mask_path
+        self.param_path = param_path
+
+        self.template_full = cv2.imread(template_path)
+        if self.template_full is None:
+            raise FileNotFoundError(f"Template não encontrado: {template_path}")
+        self.mask_full = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+        if self.mask_full is None:
+            raise FileNotFoundError(f"Máscara não encontrada: {mask_path}")
+
+        # Features ORB do template calculadas uma vez (cache em disco junto ao template)
+        self.template_features = load_template_features(template_path, self.template_full)
+        align_config = load_params(alignment_config_path, ALIGNMENT_SCHEMA)
+        self.template_pyramid = TemplatePyramid(self.template_full, self.mask_full,
+                                                ecc_scales=align_config["ecc_scales"])
+        self.phase_template = PhaseTemplate(self.template_full, self.mask_full, align_config["phase_scale"],
+                                            align_config["phase_polar_size"])
+
+        # Latas partilhadas (ver models.can_layout.get_can_layout); sem elas a deteção continua, sem atribuição
+        try:
+            self.can_layout = get_can_layout(self.mask_full.shape)
+        except (OSError, ValueError) as e:
+            print("❌ Erro ao carregar latas:", e)
+            self.can_layout = None
+
+        # Reamostragem só das regiões das latas/máscara ("warp_regions" em config_alignment.json)
+        self.warp_regions = align_config["warp_regions"]
+        self.region_warper = build_region_warper(self.warp_regions, self.mask_full, self._can_boxes())
+
+        # Sessão de alinhamento: reutiliza a última homografia enquanto a folha não se mexer
+        self.alignment_session = AlignmentSession(self.template_full, self.mask_full,
+                                                  config_path=alignment_config_path,
+                                                  template_features=self.template_features,
+                                                  template_pyramid=self.template_pyramid,
+                                                  phase_template=self.phase_template,
+                                                  warper=self.region_warper)
+
+        # Referência da deteção ("detect_reference"): o template ou o modelo dourado (média/desvio de folhas boas)
+        self.params = load_params(param_path, INSPECTION_PARAMS_SCHEMA)
+        self.golden_model = None
+        if self.params["detect_reference"] == "golden":
+            self.golden_model = load_golden_model(self.params["golden_model_path"])
+            if self.golden_model is None:
+                print("[WARN] Modelo dourado não encontrado, a usar o template")
+            elif self.golden_model.shape != self.mask_full.shape:
+                print(f"[WARN] Modelo dourado {self.golden_model.shape} não corresponde ao template, a usar o template")
+                self.golden_model = None
+
+        # Pré-processamento do template (cinza equalizado, LAB) feito uma vez para todas as folhas
+        if self.golden_model is not None:
+            self.prepared_template = self.golden_model.prepared_template(self.template_full, self.mask_full)
+        else:
+            self.prepared_template = PreparedTemplate(self.template_full, self.mask_full)
+        # Detetor com buffers reutilizados entre folhas, em faixas paralelas ("detect_workers", 0 = todos os cores)
+        self.detector = ParallelDefectDetector(self.prepared_template, self.mask_full, self.can_layout,
+                                               workers=self.params["detect_workers"])
+        self._apply_params(self.params)
+
+    def close(self):
+        self.detector.close()
+
+    def _can_boxes(self):
+        # Caixas das latas para a reamostragem "cans" (None nos outros modos)
+        if self.warp_regions != "cans":
+            return None
+        return self.can_layout.boxes if self.can_layout is not None else []
+
+    def _apply_params(self, params):
+        if params["can_assignment"] not in CAN_ASSIGNMENTS:
+            raise ValueError(f"Valor de can_assignment desconhecido: {params['can_assignment']} "
+                             f"(aceites: {', '.join(CAN_ASSIGNMENTS)})")
+        self.params = params
+        if self.golden_model is not None:
+            # Limiares por píxel (z * desvio); os limiares escalares deixam de ser usados
+            self.detector.set_threshold_maps(
+                self.golden_model.threshold_maps(params["golden_z"], params["golden_min_delta"]))
+
+    def refresh(self):
+        """
+        Picks up edits to the inspection parameters and to the can layout files (both cached by
+        mtime, so this costs a couple of stats when nothing changed).
+        """
+        self._apply_params(load_params(self.param_path, INSPECTION_PARAMS_SCHEMA))
+
+        # Só se as latas mudaram é que o detetor e a reamostragem são refeitos
+        if self.detector.refresh_cans() and self.warp_regions == "cans":
+            self.region_warper = build_region_warper(self.warp_regions, self.mask_full, self._can_boxes())
+            self.alignment_session.align_kwargs["warper"] = self.region_warper
+
+    def detect_params(self):
+        """Current detection parameters, in the positional order of DefectDetector.detect."""
+        return tuple(self.params[key] for key in DETECT_PARAM_KEYS)
+
+    def assign_cans(self, defects, contours=None):
+        """
+        Fills the "can" field of `defects` from the layout, by centroid ("can_assignment": "raster")
+        or by area overlap of the `contours` ("overlap", see models.can_index). Returns `defects`.
+        """
+        if self.can_layout is None or not len(defects):
+            return defects
+        if self.params["can_assignment"] == "overlap" and contours is not None:
+            # Polígonos das latas num STRtree: cada contorno vai para a lata com mais área dele (defeitos entre latas)
+            defects["can"] = self.can_layout.index.cans_by_overlap(contours, defects["cx"], defects["cy"])
+        else:
+            # Centróides já calculados na extração (sem cv2.moments por contorno)
+            defects["can"] = self.can_layout.cans_at(defects["cx"], defects["cy"])
+        return defects
+
+    def inspect(self, image, contours=False):
+        """
+        Inspects one sheet (BGR image or camera frame, already rectified).
+
+        Args:
+            image (np.ndarray): The sheet.
+            contours (bool): Also trace the defect outlines (for drawing); they are traced anyway
+                when "can_assignment" is "overlap".
+
+        Returns:
+            InspectionResult
+        """
+        total_start = time.perf_counter()
+        result = InspectionResult()
+        timings = result.timings
+        self.refresh()
+        params = self.params
+
+        # 1) Alinhamento com template (com a verificação de qualidade da sessão)
+        t0 = time.perf_counter()
+        try:
+            aligned, result.homography = self.alignment_session.align(image)
+            result.rejection = list(self.alignment_session.last_rejection)
+        except ValueError as e:
+            aligned, result.rejection = None, [str(e)]
+        timings["align"] = time.perf_counter() - t0
+
+        # Alinhamento mau: rejeita a folha já aqui, antes de gastar tempo na deteção
+        if result.rejection:
+            timings["total"] = time.perf_counter() - total_start
+            return result
+
+        # 2) Aplicação da máscara
+        t0 = time.perf_counter()
+        result.aligned = cv2.bitwise_and(aligned, aligned, mask=self.mask_full)
+        timings["mask"] = time.perf_counter() - t0
+
+        # 3) Deteção de defeitos
+        t0 = time.perf_counter()
+        detect_params = self.detect_params()
+        if params["detect_mode"] == "cans" and self.detector.cans:
+            # Só as caixas das latas são processadas; cada defeito já vem com o número da lata
+            outputs = self.detector.detect_by_can(result.aligned, *detect_params)
+            result.by_can = True
+        elif params["detect_mode"] == "screened":
+            # Triagem a 1/4 da resolução; a resolução total só corre à volta dos candidatos
+            outputs = self.detector.detect_screened(result.aligned, *detect_params,
+                                                    scale=params["screening_scale"], relax=params["screening_relax"])
+        else:
+            outputs = self.detector.detect(result.aligned, *detect_params)
+        result.defect_mask, result.defects = outputs[:2]
+        result.masks = dict(zip(("dark", "yellow", "blue", "red"), outputs[2:]))
+        timings["detect"] = time.perf_counter() - t0
+
+        # 4) Contornos só se forem desenhados ou precisos para a atribuição por área
+        if contours or (params["can_assignment"] == "overlap" and not result.by_can):
+            t0 = time.perf_counter()
+            result.contours = self.detector.defect_contours(result.defects)
+            timings["contours"] = time.perf_counter() - t0
+
+        # 5) Latas de cada defeito (na deteção por lata já vêm preenchidas)
+        if not result.by_can:
+            t0 = time.perf_counter()
+            self.assign_cans(result.defects, result.contours)
+            timings["cans"] = time.perf_counter() - t0
+
+        # 6) Estatísticas por lata (base da rejeição e do SPC)
+        if self.can_layout is not None:
+            t0 = time.perf_counter()
+            result.can_stats = self.detector.can_statistics(result.aligned, result.defects, self.can_layout)
+            timings["can_stats"] = time.perf_counter() - t0
+
+        timings["total"] = time.perf_counter() - total_start
+        return result
+
+
+def _image_paths(inputs):
+    # Ficheiros dados diretamente ou imagens (IMAGE_EXTENSIONS) das pastas dadas, por ordem
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(p for p in glob.glob(os.path.join(item, "*"))
+                                if os.path.splitext(p)[1].lower() in IMAGE_EXTENSIONS))
+        else:
+            paths.append(item)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspeção sem interface gráfica de uma ou mais folhas "
+                                                 "(imagens ou pastas), com os tempos de cada etapa")
+    parser.add_argument("images", nargs="+", help="Imagens ou pastas de imagens")
+    parser.add_argument("--template", default=TEMPLATE_IMAGE_PATH)
+    parser.add_argument("--mask", default=MASK_PATH)
+    parser.add_argument("--params", default=PARAMS_PATH)
+    parser.add_argument("--csv", help="Escreve uma linha por folha (InspectionResult.summary) neste ficheiro")
+    args = parser.parse_args()
+
+    engine = InspectionEngine(args.template, args.mask, args.params)
+    rows = []
+    try:
+        for path in _image_paths(args.images):
+            t0 = time.perf_counter()
+            image = cv2.imread(path)
+            read_time = time.perf_counter() - t0
+            if image is None:
+                print(f"[WARN] Imagem ilegível: {path}")
+                continue
+            result = engine.inspect(image)
+            row = dict(image=path, read_ms=round(read_time * 1000, 2), **result.summary())
+            rows.append(row)
+            print(f"{os.path.basename(path)}: {row['status']}, {row['defects']} defeitos, "
+                  f"latas [{row['cans']}], {row['total_ms']} ms")
+    finally:
+        engine.close()
+
+    if rows:
+        # Média de cada etapa nas folhas em que correu
+        for stage in STAGES + ("total",):
+            values = [row[f"{stage}_ms"] for row in rows if row[f"{stage}_ms"] != ""]
+            if values:
+                print(f"[Tempo] {stage}: {np.mean(values):.2f} ms (média de {len(values)} folhas)")
+    if args.csv and rows:
+        os.makedirs(os.path.dirname(args.csv) or ".", exist_ok=True)
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"[INFO] Resultados guardados em {args.csv}")
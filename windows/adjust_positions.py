@@ -10,6 +10,7 @@ from customtkinter import CTkButton
 from ultralytics import YOLO
 from config.config import TEMPLATE_IMAGE_PATH, INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT
 from config.utils import center_window
+from models.can_layout import FORMA_BASE_PATH, INSTANCIAS_PATH, load_forma_base, invalidate_can_layouts
 
 
 
@@ -218,10 +219,8 @@ class AdjustPositionsWindow(ctk.CTkToplevel):
         self.image_label.update()
         self.config(cursor="")
 
-    def load_forma_base(self, path="data/mask/forma_base.json"):
-        with open(path, "r") as f:
-            data = json.load(f)
-        return data  # Lista de pontos normalizados (entre 0 e 1)
+    def load_forma_base(self, path=FORMA_BASE_PATH):
+        return load_forma_base(path)  # Lista de pontos centrados na origem
 
 
     def draw_polygon_on_box(self, image, box, base_shape):
@@ -564,7 +563,7 @@ class AdjustPositionsWindow(ctk.CTkToplevel):
         # Continua salvando os polígonos no txt
         self.salvar_poligonos_txt()'''
 
-    def salvar_poligonos_txt(self, caminho="data/mask/instancias_poligonos.txt"):
+    def salvar_poligonos_txt(self, caminho=INSTANCIAS_PATH):
         """
         Salva os polígonos definidos no formato:
         numero:cx,cy,escala
@@ -584,6 +583,8 @@ class AdjustPositionsWindow(ctk.CTkToplevel):
                     f.write(linha)
 
             print(f"[INFO] Polígonos salvos com sucesso em '{caminho}'.")
+            # A inspeção aberta passa a usar as novas latas na próxima folha
+            invalidate_can_layouts()
 
         except Exception as e:
             print(f"[ERRO] Falha ao salvar polígonos: {e}")
@@ -766,9 +767,10 @@ class CriarFormaWindow(ctk.CTkToplevel):
         forma_normalizada = [(x - cx, y - cy) for x, y in self.pontos]
         self.parent_window.forma_base = forma_normalizada
 
-        os.makedirs("data/mask", exist_ok=True)
-        caminho = "data/mask/forma_base.json"
+        caminho = FORMA_BASE_PATH
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
         with open(caminho, "w") as f:
             json.dump(forma_normalizada, f)
+        invalidate_can_layouts()
 
         self.destroy()
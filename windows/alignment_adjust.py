@@ -2,12 +2,12 @@ import cv2
 import numpy as np
 import customtkinter as ctk
 from PIL import Image, ImageDraw, ImageTk
-import json
 import threading
 import time
 from picamera2 import Picamera2
 
 from config.config import PREVIEW_WIDTH, PREVIEW_HEIGHT
+from config.utils import load_params, save_params
 
 
 class AlignmentWindow(ctk.CTkToplevel):
@@ -116,8 +116,7 @@ class AlignmentWindow(ctk.CTkToplevel):
 
     def _load_alignment_config(self):
         try:
-            with open(self.config_path, "r") as f:
-                self.alignment_config = json.load(f)
+            self.alignment_config = load_params(self.config_path)
         except Exception:
             self.alignment_config = {
                 "max_features": 1000,
@@ -212,8 +211,7 @@ class AlignmentWindow(ctk.CTkToplevel):
             self.alignment_config["y_min"] = int(self.y_min_entry.get())
             self.alignment_config["y_max"] = int(self.y_max_entry.get())
 
-            with open(self.config_path, "w") as f:
-                json.dump(self.alignment_config, f, indent=4)
+            save_params(self.config_path, self.alignment_config)
             print("Configuração guardada com sucesso.")
         except Exception as e:
             print(f"Erro ao guardar configuração: {e}")
@@ -5,6 +5,7 @@ import cv2
 import os
 from picamera2 import Picamera2
 from config.config import INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT
+from models.camera_calibration import load_frame_rectifier
 
 class CaptureSheetWindow(ctk.CTkToplevel):
     def __init__(self, master=None, template_path=None):
@@ -39,10 +40,19 @@ class CaptureSheetWindow(ctk.CTkToplevel):
 
         # Inicializa Picamera2
         self.picam2 = Picamera2()
-        camera_config = self.picam2.create_still_configuration(main={"size": (3473, 2697)})
+        capture_size = (3473, 2697)
+        camera_config = self.picam2.create_still_configuration(main={"size": capture_size})
         self.picam2.configure(camera_config)
         self.picam2.start()
 
+        # Correção de distorção/inclinação (mapas da calibração, se existirem)
+        self.rectifier = load_frame_rectifier()
+        if self.rectifier is not None and self.rectifier.size != capture_size:
+            # Mapas de outra resolução: apply() falharia em cada captura
+            print(f"[WARN] Calibração para {self.rectifier.size[0]}x{self.rectifier.size[1]}, captura em "
+                  f"{capture_size[0]}x{capture_size[1]}: correção de distorção desativada")
+            self.rectifier = None
+
         self.update_frame()
 
         # Quando fechar a janela
@@ -61,6 +71,8 @@ class CaptureSheetWindow(ctk.CTkToplevel):
 
     def capture_photo(self):
         frame = self.picam2.capture_array()
+        if self.rectifier is not None:
+            frame = self.rectifier.apply(frame)
         self.captured_image = frame.copy()
         self.capturing_live = False
         self.show_captured_image()
@@ -1,5 +1,4 @@
 import csv
-import json
 import os
 from datetime import datetime
 
@@ -7,15 +6,19 @@ import customtkinter as ctk
 import cv2
 from PIL import Image
 from customtkinter import CTkImage
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
 
 from config.config import INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT
-from config.utils import center_window
-from models.defect_detector import detect_defects
+from config.utils import center_window, load_params, save_params
+from models.defect_detector import outer_contours, passes_min_area
+from models.incremental_detector import IncrementalDefectDetector
 from widgets.param_entry_simple_numeric import create_param_entry
 
 
 class DefectTunerWindow(ctk.CTkToplevel):
-    def __init__(self, master, tpl_img, aligned_img, mask, reopen_callback=None,user_type="User", user_name=""):
+    def __init__(self, master, tpl_img, aligned_img, mask, reopen_callback=None,user_type="User", user_name="",
+                 threshold_maps=None):
         super().__init__(master)
 
         s = (INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT)
@@ -30,9 +33,18 @@ class DefectTunerWindow(ctk.CTkToplevel):
 
         self.bind("<space>", self._on_space_key)
 
-        self.tpl = tpl_img
         self.aligned = aligned_img
         self.mask = mask
+        # Diferenças brutas calculadas uma vez; cada movimento de slider só refaz as etapas que dependem dele
+        self.detector = IncrementalDefectDetector(tpl_img, mask)
+        if threshold_maps is not None:
+            # Modelo dourado: os mesmos limiares por píxel do motor de inspeção
+            self.detector.set_threshold_maps(threshold_maps)
+            print("[INFO] Modelo dourado: limiares por píxel; os limiares escuro/amarelo/azul/vermelho "
+                  "não alteram a pré-visualização")
+        self._preview_bases = {}
+        self._layer_cache = {}
+        self._curve_canvas = None
 
         # Valores padrão (base)
         self.dark_threshold = 30
@@ -205,7 +217,7 @@ class DefectTunerWindow(ctk.CTkToplevel):
         ctk.CTkOptionMenu(
             container2,
             variable=self.view_mode,
-            values=["Final", "Escuro", "Amarelo", "Azul", "Vermelho", "Todos (colorido)"],
+            values=["Final", "Escuro", "Amarelo", "Azul", "Vermelho", "Todos (colorido)", "Curvas (limiar)"],
             command=lambda _: self._update_preview()
         ).pack(pady=(10, 10), padx=(10, 10), side="right")
 
@@ -264,8 +276,8 @@ class DefectTunerWindow(ctk.CTkToplevel):
             print(f"Erro na conversão dos parâmetros: {e}")
             return
 
-        final_mask, all_contours, darker_mask, bright_mask, blue_mask, red_mask = detect_defects(
-            self.tpl, self.aligned, self.mask,
+        final_mask, defects, darker_mask, bright_mask, blue_mask, red_mask = self.detector.detect(
+            self.aligned,
             dark_th, bright_th,
             dark_kernel, dark_iter,
             bright_kernel, bright_iter,
@@ -274,103 +286,30 @@ class DefectTunerWindow(ctk.CTkToplevel):
         )
 
         selected_mode = self.view_mode.get()
+        if selected_mode == "Curvas (limiar)":
+            self.defect_count_label.configure(text=f"Total de defeitos: {len(defects)}")
+            self._show_threshold_curves(min_area, dark_grad,
+                                        {"dark": dark_th, "bright": bright_th, "blue": blue_th, "red": red_th})
+            return
 
-        # Escolher imagem base
-        if self.display_mode.get() == "PB":
-            preview = cv2.cvtColor(self.aligned, cv2.COLOR_BGR2GRAY)
-            preview = cv2.cvtColor(preview, cv2.COLOR_GRAY2BGR)
-        else:
-            preview = self.aligned.copy()
-
-        # Escolher máscara e cor dos contornos
-        if selected_mode == "Escuro":
-            mask_to_show = darker_mask
-            contours_display, _ = cv2.findContours(mask_to_show, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            color = (255, 0, 0)  # Azul
-            num_defeitos = 0
-            for cnt in contours_display:
-                if cv2.contourArea(cnt) >= int(self.min_defect_area_var.get()):
-                    cv2.drawContours(preview, [cnt], -1, color, 5)
-                    num_defeitos += 1
-
-        elif selected_mode == "Amarelo":
-            mask_to_show = bright_mask
-            contours_display, _ = cv2.findContours(mask_to_show, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            color = (0, 255, 255)  # Amarelo
-            num_defeitos = 0
-            for cnt in contours_display:
-                if cv2.contourArea(cnt) >= int(self.min_defect_area_var.get()):
-                    cv2.drawContours(preview, [cnt], -1, color, 5)
-                    num_defeitos += 1
-
-        elif selected_mode == "Azul":
-            mask_to_show = blue_mask
-            contours_display, _ = cv2.findContours(mask_to_show, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            color = (255, 255, 0)  # Ciano
-            num_defeitos = 0
-            for cnt in contours_display:
-                if cv2.contourArea(cnt) >= int(self.min_defect_area_var.get()):
-                    cv2.drawContours(preview, [cnt], -1, color, 5)
-                    num_defeitos += 1
-
-        elif selected_mode == "Vermelho":
-            mask_to_show = red_mask
-            contours_display, _ = cv2.findContours(mask_to_show, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            color = (0, 0, 255)  # Vermelho
-            num_defeitos = 0
-            for cnt in contours_display:
-                if cv2.contourArea(cnt) >= int(self.min_defect_area_var.get()):
-                    cv2.drawContours(preview, [cnt], -1, color, 5)
-                    num_defeitos += 1
-
-        elif selected_mode == "Todos (colorido)":
-            num_defeitos = 0
-
-            # Escuro – Azul
-            contours_dark, _ = cv2.findContours(darker_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            for cnt in contours_dark:
-                if cv2.contourArea(cnt) >= int(self.min_defect_area_var.get()):
-                    cv2.drawContours(preview, [cnt], -1, (255, 0, 0), 5)
-                    num_defeitos += 1
-
-            # Amarelo – Amarelo
-            contours_bright, _ = cv2.findContours(bright_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            for cnt in contours_bright:
-                if cv2.contourArea(cnt) >= int(self.min_defect_area_var.get()):
-                    cv2.drawContours(preview, [cnt], -1, (0, 255, 255), 5)
-                    num_defeitos += 1
-
-            # Azul – Ciano
-            contours_blue, _ = cv2.findContours(blue_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            for cnt in contours_blue:
-                if cv2.contourArea(cnt) >= int(self.min_defect_area_var.get()):
-                    cv2.drawContours(preview, [cnt], -1, (255, 255, 0), 5)
-                    num_defeitos += 1
-
-            # Vermelho – Vermelho
-            contours_red, _ = cv2.findContours(red_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            for cnt in contours_red:
-                if cv2.contourArea(cnt) >= int(self.min_defect_area_var.get()):
-                    cv2.drawContours(preview, [cnt], -1, (0, 0, 255), 5)
-                    num_defeitos += 1
-
-        else:  # Final combinado
-            mask_to_show = final_mask
-            contours_display, _ = cv2.findContours(mask_to_show, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            color = (0, 255, 0)  # Verde
-            num_defeitos = 0
-            for cnt in contours_display:
-                if cv2.contourArea(cnt) >= int(self.min_defect_area_var.get()):
-                    cv2.drawContours(preview, [cnt], -1, color, 5)
-                    num_defeitos += 1
-
-        # Obter contornos e desenhar com cor apropriada
-        contours_display, _ = cv2.findContours(mask_to_show, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Máscara e cor dos contornos de cada modo (etapa do detetor que a produz, máscara, cor)
+        layers = {
+            "Escuro": [("darker_filtered", darker_mask, (255, 0, 0))],  # Azul
+            "Amarelo": [("brighter", bright_mask, (0, 255, 255))],  # Amarelo
+            "Azul": [("blue", blue_mask, (255, 255, 0))],  # Ciano
+            "Vermelho": [("red", red_mask, (0, 0, 255))],  # Vermelho
+        }
+        layers["Todos (colorido)"] = [layer for mode in ("Escuro", "Amarelo", "Azul", "Vermelho")
+                                      for layer in layers[mode]]
+        # Final combinado: os defeitos extraídos pelo detetor (mesmo critério da inspeção)
+        selected_layers = layers.get(selected_mode, [("defects", final_mask, (0, 255, 0))])  # Verde
+
+        # Escolher imagem base (em cache por modo de cor; só a cópia para desenhar é feita aqui)
+        preview = self._preview_base().copy()
 
         num_defeitos = 0
-        for cnt in contours_display:
-            area = cv2.contourArea(cnt)
-            if area >= int(self.min_defect_area_var.get()):
+        for stage, mask_to_show, color in selected_layers:
+            for cnt in self._layer_contours(stage, mask_to_show, defects, min_area):
                 cv2.drawContours(preview, [cnt], -1, color, 5)
 
                 (x, y), radius = cv2.minEnclosingCircle(cnt)
@@ -385,12 +324,12 @@ class DefectTunerWindow(ctk.CTkToplevel):
         self.defect_count_label.configure(text=f"Total de defeitos: {num_defeitos}")
 
         # Guardar a imagem anotada
-        self.last_preview = preview.copy()
+        self.last_preview = preview
 
-        # Mostrar imagem
-        preview_rgb = cv2.cvtColor(preview, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(preview_rgb)
-        pil_img = pil_img.resize((INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT))
+        # Mostrar imagem (reduzida com o OpenCV antes de passar ao PIL)
+        preview_small = cv2.resize(preview, (INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT),
+                                   interpolation=cv2.INTER_AREA)
+        pil_img = Image.fromarray(cv2.cvtColor(preview_small, cv2.COLOR_BGR2RGB))
 
         ctk_img = CTkImage(light_image=pil_img, size=(INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT))
 
@@ -406,11 +345,71 @@ class DefectTunerWindow(ctk.CTkToplevel):
             "red": red_mask
         }
 
+    def _show_threshold_curves(self, min_area, dark_grad, thresholds):
+        """
+        Defect count vs threshold (0-255) of each channel in graph_frame, with the current thresholds
+        marked. The curves come from one sweep per channel (memoized by the detector), not one
+        detection per threshold, and count the components before the morphological cleaning.
+        """
+        curves = self.detector.threshold_curves(self.aligned, min_area, dark_grad)
+
+        if self._curve_canvas is None:
+            figure = Figure(figsize=(INSPECTION_PREVIEW_WIDTH / 100, INSPECTION_PREVIEW_HEIGHT / 100), dpi=100)
+            self._curve_canvas = FigureCanvasTkAgg(figure, master=self.graph_frame)
+            self._curve_canvas.get_tk_widget().pack(fill="both", expand=True)
+
+        figure = self._curve_canvas.figure
+        figure.clear()
+        ax = figure.add_subplot(111)
+        for name, label, color in (("dark", "Escuro", "tab:blue"), ("bright", "Amarelo", "gold"),
+                                   ("blue", "Azul", "c"), ("red", "Vermelho", "tab:red")):
+            ax.plot(range(256), curves[name], color=color, label=f"{label} ({curves[name][thresholds[name]]})")
+            ax.axvline(thresholds[name], color=color, linestyle="--", linewidth=1)
+        ax.set_yscale("symlog", linthresh=1)
+        ax.set_xlim(0, 255)
+        ax.set_xlabel("Threshold")
+        ax.set_ylabel(f"Defeitos (área >= {min_area} px, antes da morfologia)")
+        ax.grid(True, alpha=0.3)
+        ax.legend()
+        figure.tight_layout()
+        self._curve_canvas.draw_idle()
+
+        self.image_label.pack_forget()
+        self.graph_frame.pack(padx=4, pady=4)
+
+    def _preview_base(self):
+        # Imagem alinhada a preto e branco ("PB") ou a cores, calculada uma vez por modo
+        mode = self.display_mode.get()
+        base = self._preview_bases.get(mode)
+        if base is None:
+            if mode == "PB":
+                base = cv2.cvtColor(cv2.cvtColor(self.aligned, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+            else:
+                base = self.aligned
+            self._preview_bases[mode] = base
+        return base
+
+    def _layer_contours(self, stage, mask, defects, min_area):
+        """
+        Contours of one preview layer, memoized by the parameters of the detector stage that produced
+        its mask: a slider that does not touch that stage reuses them.
+        """
+        key = (self.detector.stage_key(stage), min_area)
+        cached = self._layer_cache.get(stage)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        if stage == "defects":
+            contours = self.detector.defect_contours(defects)
+        else:
+            # A mesma regra de área mínima que os defeitos da camada "Final"
+            contours = [cnt for cnt in outer_contours(mask) if passes_min_area(cnt, min_area)]
+        self._layer_cache[stage] = (key, contours)
+        return contours
+
     def _restore_saved_params(self):
-        import json
         try:
-            with open("config/inspection_params.json", "r") as f:
-                params = json.load(f)
+            params = load_params("config/inspection_params.json")
 
             # Atualiza as StringVars (que disparam os callbacks para atualizar UI e preview)
             self.dark_threshold_var.set(str(params.get("dark_threshold", 30)))
@@ -446,9 +445,10 @@ class DefectTunerWindow(ctk.CTkToplevel):
             "detect_area": self.min_defect_area_var.get()
         }
 
-        # 1. Guardar JSON principal
-        with open("config/inspection_params.json", "w") as f:
-            json.dump(params, f, indent=4)
+        # 1. Guardar JSON principal (mantendo as restantes chaves, ex.: "detect_mode")
+        param_path = "config/inspection_params.json"
+        existing = load_params(param_path) if os.path.exists(param_path) else {}
+        save_params(param_path, dict(existing, **params))
 
         # 2. Adicionar entrada ao log CSV
         user = self.user_name
@@ -1,11 +1,9 @@
-import json
-
 import customtkinter as ctk
 import cv2
 import numpy as np
 from PIL import Image, ImageTk
 
-from config.utils import load_params
+from config.utils import load_params, save_params
 from widgets.param_entry_simple_numeric import create_param_entry
 
 
@@ -197,5 +195,4 @@ class AutoDetectCans(ctk.CTkToplevel):
             "area_max": self.area_max.get(),
             "circularity_min": self.circularity_min.get()
         }
-        with open(self.param_path, "w") as f:
-            json.dump(params, f, indent=4)
\ No newline at end of file
+        save_params(self.param_path, params)
\ No newline at end of file
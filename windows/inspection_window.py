@@ -1,20 +1,32 @@
-import json
 import time
 
 import customtkinter as ctk
 import cv2
+import numpy as np
 from PIL import Image, ImageDraw
 from customtkinter import CTkImage
-from shapely.geometry import Polygon, Point
 
 from config.config import INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT
-from config.utils import load_params
-from models.align_image import align_with_template
-from models.defect_detector import detect_defects
+from config.config_registry import INSPECTION_PARAMS_SCHEMA, subscribe, unsubscribe
+from config.utils import load_params, save_params
+from models.can_layout import NO_CAN
+from models.defect_detector import DEFECT_DTYPE, CAN_STATS_DTYPE
+from src.engine.inspection_engine import InspectionEngine, STAGES
 from widgets.param_entry_hor import create_param_entry
 from windows.defect_tuner_window import DefectTunerWindow
 
 
+# Nome de cada etapa do motor nos registos de tempo
+_STAGE_LABELS = {
+    "align": "Alinhamento com template",
+    "mask": "Aplicação de máscara",
+    "detect": "Detecção de defeitos",
+    "contours": "Contornos dos defeitos",
+    "cans": "Atribuição às latas",
+    "can_stats": "Estatísticas por lata",
+}
+
+
 def _prepare_image_grayscale(img_cv, size, draw_contours=None):
     # redimensiona e converte para grayscale CTkImage; opcionalmente desenha contornos
     resized = cv2.resize(img_cv, size)
@@ -80,17 +92,27 @@ class InspectionWindow(ctk.CTkToplevel):
         self.user_type = user_type
         self.user = user
 
+        self.defects = np.zeros(0, DEFECT_DTYPE)
         self.defect_contours = []
+        # Resumo por lata da última folha (CAN_STATS_DTYPE): base da rejeição e do SPC
+        self.can_stats = np.zeros(0, CAN_STATS_DTYPE)
 
 
         s = (INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT)
-        self.template_full = cv2.imread(self.template_path)
-        self.mask_full = cv2.imread(self.mask_path, cv2.IMREAD_GRAYSCALE)
+        # Motor de inspeção sem interface: template, máscara, latas, alinhamento e detetor preparados uma vez
+        self.engine = InspectionEngine(self.template_path, self.mask_path, "config/inspection_params.json")
+        self.template_full = self.engine.template_full
+        self.mask_full = self.engine.mask_full
+        self.can_layout = self.engine.can_layout
+        self.alignment_session = self.engine.alignment_session
+        self.prepared_template = self.engine.prepared_template
+        self.template_masked = self.prepared_template.image
+        self.defect_detector = self.engine.detector
 
         self.mask1 = cv2.imread("data/mask/leaf_mask1.png", cv2.IMREAD_GRAYSCALE)
         self.mask2 = cv2.imread("data/mask/leaf_mask2.png", cv2.IMREAD_GRAYSCALE)
 
-        self.template_masked = cv2.bitwise_and(self.template_full, self.template_full, mask=self.mask_full)
+        self.defects_by_can = False
         self.tk_template = _prepare_image_grayscale(self.template_masked, s)
 
         '''# Abrir a webcam uma vez
@@ -206,18 +228,7 @@ class InspectionWindow(ctk.CTkToplevel):
     def _load_params(self):
         # parameters adjustable (default values)
         self.param_path = "config/inspection_params.json"
-        params = load_params(self.param_path)
-
-        self.dark_threshold = int(params.get("dark_threshold", 30))
-        self.bright_threshold = int(params.get("bright_threshold", 30))
-        self.dark_morph_kernel_size = int(params.get("dark_morph_kernel_size", 3))
-        self.dark_morph_iterations = int(params.get("dark_morph_iterations", 1))
-        self.bright_morph_kernel_size = int(params.get("bright_morph_kernel_size", 3))
-        self.bright_morph_iterations = int(params.get("bright_morph_iterations", 1))
-        self.min_defect_area = int(params.get("detect_area", 1))
-        self.dark_gradient_threshold = int(params.get("dark_gradient_threshold", 10))
-        self.blue_threshold = int(params.get("blue_threshold", 25))
-        self.red_threshold = int(params.get("red_threshold", 25))
+        self._apply_params(load_params(self.param_path, INSPECTION_PARAMS_SCHEMA))
 
         # Initialize all StringVar and BooleanVar objects here
         self.dark_threshold_var = ctk.StringVar(value=str(self.dark_threshold))
@@ -234,29 +245,55 @@ class InspectionWindow(ctk.CTkToplevel):
         self.blue_threshold_var = ctk.StringVar(value=str(self.blue_threshold))
         self.red_threshold_var = ctk.StringVar(value=str(self.red_threshold))
 
+        # Recebe alterações ao ficheiro (tuner ou edição externa) sem reler por inspeção
+        unsubscribe(self.param_path, self._on_params_changed)
+        subscribe(self.param_path, self._on_params_changed)
+
+    def _apply_params(self, params):
+        self.dark_threshold = params["dark_threshold"]
+        self.bright_threshold = params["bright_threshold"]
+        self.dark_morph_kernel_size = params["dark_morph_kernel_size"]
+        self.dark_morph_iterations = params["dark_morph_iterations"]
+        self.bright_morph_kernel_size = params["bright_morph_kernel_size"]
+        self.bright_morph_iterations = params["bright_morph_iterations"]
+        self.min_defect_area = params["detect_area"]
+        self.dark_gradient_threshold = params["dark_gradient_threshold"]
+        self.blue_threshold = params["blue_threshold"]
+        self.red_threshold = params["red_threshold"]
+
+    def _on_params_changed(self, path, params):
+        self._apply_params(load_params(path, INSPECTION_PARAMS_SCHEMA))
+        self.min_defect_area_var.set(str(self.min_defect_area))
+        if getattr(self, "min_defect_area_label", None) is not None:
+            self.min_defect_area_label.configure(text=f"Tamanho mín. defeito: {self.min_defect_area}")
+
+    def destroy(self):
+        unsubscribe(self.param_path, self._on_params_changed)
+        self.engine.close()
+        super().destroy()
+
     def open_tuner_window(self):
-        # 1) Load images and mask
-        self.template_full = cv2.imread(self.template_path)
+        # 1) Load current image (template and mask are already prepared in __init__)
         self.current_full = cv2.imread(self.current_path)
 
-        self.mask_full = cv2.imread(self.mask_path, cv2.IMREAD_GRAYSCALE)
-
         # 2) Align current image to template
-        self.aligned_full, M = align_with_template(self.current_full, self.template_full)
+        self.aligned_full, M = self.alignment_session.align(self.current_full)
+        if self.alignment_session.last_rejection:
+            print(f"[WARN] Alinhamento fora dos limites: {'; '.join(self.alignment_session.last_rejection)}")
 
         # 3) Apply original mask (template space) to aligned image
         self.current_masked = cv2.bitwise_and(self.aligned_full, self.aligned_full, mask=self.mask_full)
-        self.template_masked = cv2.bitwise_and(self.template_full, self.template_full, mask=self.mask_full)
 
         self.withdraw()  # Esconde a janela de inspeção
         self.tuner_window = DefectTunerWindow(
             master=self,
-            tpl_img=self.template_masked,
+            tpl_img=self.prepared_template,
             aligned_img=self.current_masked,
             mask=self.mask_full,
             reopen_callback=self._on_tuner_close,
             user_type=self.user_type,
-            user_name=self.user
+            user_name=self.user,
+            threshold_maps=self.defect_detector.threshold_maps  # modo "golden" (None com o template)
         )
         self.tuner_window.protocol("WM_DELETE_WINDOW", self._on_tuner_close)
 
@@ -284,6 +321,9 @@ class InspectionWindow(ctk.CTkToplevel):
         total_start = time.perf_counter()
         s = (INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT)
 
+        # 0) Parâmetros (cache em memória; só relê se o ficheiro tiver mudado); o motor relê também as latas
+        self._apply_params(load_params(self.param_path, INSPECTION_PARAMS_SCHEMA))
+
         # 1) Leitura da imagem
         t0 = time.perf_counter()
         self.current_full = cv2.imread(self.current_path)
@@ -291,47 +331,37 @@ class InspectionWindow(ctk.CTkToplevel):
 
         print(f"[Tempo] Leitura da imagem: {time.perf_counter() - t0:.4f} segundos")
 
-        # 2) Alinhamento com template
-        t0 = time.perf_counter()
-        self.aligned_full, M = align_with_template(self.current_full, self.template_full)
-        print(f"[Tempo] Alinhamento com template: {time.perf_counter() - t0:.4f} segundos")
+        # 2) Alinhamento, máscara, deteção, latas e estatísticas por lata (motor sem interface)
+        result = self.engine.inspect(self.current_full, contours=True)
+        for stage in STAGES:
+            if stage in result.timings:
+                print(f"[Tempo] {_STAGE_LABELS[stage]}: {result.timings[stage]:.4f} segundos")
+        print(f"[Tempo] Sessão de alinhamento: {self.alignment_session.hits} hits / "
+              f"{self.alignment_session.misses} misses")
+
+        # Alinhamento mau: a folha é rejeitada antes da deteção
+        if not result.accepted:
+            self._reject_sheet(result.rejection)
+            print(f"[Tempo Total] _show_defects: {time.perf_counter() - total_start:.4f} segundos")
+            return
 
-        # 3) Aplicação da máscara
-        t0 = time.perf_counter()
-        self.current_masked = cv2.bitwise_and(self.aligned_full, self.aligned_full, mask=self.mask_full)
-        print(f"[Tempo] Aplicação de máscara: {time.perf_counter() - t0:.4f} segundos")
+        self.current_masked = result.aligned
+        self.defect_mask, self.defects, self.defect_contours = result.defect_mask, result.defects, result.contours
+        self.darker_mask_filtered, self.yellow_mask = result.masks["dark"], result.masks["yellow"]
+        self.blue_mask, self.red_mask = result.masks["blue"], result.masks["red"]
+        self.defects_by_can = result.by_can
+        self.can_stats = result.can_stats
 
-        # 4) Detecção de defeitos
-        t0 = time.perf_counter()
-        self.defect_mask, self.defect_contours, \
-            self.darker_mask_filtered, self.yellow_mask, \
-            self.blue_mask, self.red_mask = detect_defects(
-            self.template_masked,
-            self.current_masked,
-            self.mask_full,
-            self.dark_threshold,
-            self.bright_threshold,
-            self.dark_morph_kernel_size,
-            self.dark_morph_iterations,
-            self.bright_morph_kernel_size,
-            self.bright_morph_iterations,
-            self.min_defect_area,
-            self.dark_gradient_threshold,
-            self.blue_threshold,
-            self.red_threshold
-        )
-        print(f"[Tempo] Detecção de defeitos: {time.perf_counter() - t0:.4f} segundos")
-
-        # 5) Preparação para visualização
+        # 3) Preparação para visualização
         t0 = time.perf_counter()
         self.tk_aligned = _prepare_image_grayscale(self.current_masked, s)
         self.tk_defect = _prepare_image_grayscale(self.current_masked, s, draw_contours=self.defect_contours)
         print(f"[Tempo] Preparação para visualização: {time.perf_counter() - t0:.4f} segundos")
 
-        # 6) Atualização da interface
+        # 4) Atualização da interface
         t0 = time.perf_counter()
-        self.total_defects_var.set(str(len(self.defect_contours)))
-        self._analisar_latas_com_defeito()
+        self.total_defects_var.set(str(len(self.defects)))
+        self._mostrar_latas_com_defeito(set(result.cans_with_defects))
 
         if self.toggle_contours.get():
             self.lbl_img.configure(image=self.tk_defect)
@@ -343,6 +373,19 @@ class InspectionWindow(ctk.CTkToplevel):
 
         print(f"[Tempo Total] _show_defects: {time.perf_counter() - total_start:.4f} segundos")
 
+    def _reject_sheet(self, reasons):
+        print(f"[WARN] Folha rejeitada (alinhamento): {'; '.join(reasons)}")
+        self.defects = np.zeros(0, DEFECT_DTYPE)
+        self.defect_contours = []
+        self.can_stats = np.zeros(0, CAN_STATS_DTYPE)
+        self.total_defects_var.set("-")
+        self.label_info.configure(text="❌ Alinhamento rejeitado:\n" + "\n".join(reasons))
+
+        s = (INSPECTION_PREVIEW_WIDTH, INSPECTION_PREVIEW_HEIGHT)
+        self.tk_aligned = _prepare_image_grayscale(self.current_full, s)
+        self.lbl_img.configure(image=self.tk_aligned)
+        self.lbl_img.image = self.tk_aligned
+
     def _toggle_defect_contours(self):
         self.show_defect_contours = self.show_contours_var.get()
 
@@ -354,66 +397,19 @@ class InspectionWindow(ctk.CTkToplevel):
             self.lbl_img.image = self.tk_aligned
 
     def _analisar_latas_com_defeito(self):
-        # Carrega forma base
-        try:
-            with open("data/mask/forma_base.json", "r") as f:
-                forma_base = json.load(f)  # lista de [x, y]
-        except Exception as e:
-            print("❌ Erro ao carregar forma base:", e)
-            return
-
-        # Carrega instâncias
-        instancias = []
-        try:
-            with open("data/mask/instancias_poligonos.txt", "r") as f:
-                for line in f:
-                    parts = line.strip().split(":")
-                    if len(parts) != 2:
-                        continue
-                    idx_str, rest = parts
-                    cx_str, cy_str, s_str = rest.split(",")
-                    idx = int(idx_str)
-                    cx = int(cx_str)
-                    cy = int(cy_str)
-                    s = float(s_str)
-
-                    instancias.append({
-                        "center": (cx, cy),
-                        "scale": s,
-                        "numero_lata": idx  # Usa o índice como número da lata
-                    })
-        except Exception as e:
-            print("❌ Erro ao carregar instâncias:", e)
-            return
-
-        # Calcula os polígonos reais
-        poligonos = []
-        for inst in instancias:
-            cx, cy = inst["center"]
-            s = inst["scale"]
-            pontos = [(cx + x * s, cy + y * s) for x, y in forma_base]
-            poligonos.append({
-                "numero_lata": inst["numero_lata"],
-                "polygon": Polygon(pontos)
-            })
-
-        # Analisa defeitos
-        latas_com_defeito = set()
-        if not hasattr(self, "defect_contours") or not self.defect_contours:
-            return
-        for cnt in self.defect_contours:
-            m = cv2.moments(cnt)
-            if m["m00"] == 0:
-                continue
-            cx = int(m["m10"] / m["m00"])
-            cy = int(m["m01"] / m["m00"])
-            ponto_defeito = Point(cx, cy)
-
-            for pol in poligonos:
-                if pol["polygon"].contains(ponto_defeito):
-                    latas_com_defeito.add(pol["numero_lata"])
-                    break
-
+        # Deteção por lata: o número da lata de cada defeito já é conhecido; senão o motor atribui-os
+        # (pelo mapa das latas ou, com "can_assignment": "overlap", pela área sobre os polígonos)
+        if not self.defects_by_can:
+            if self.can_layout is None:
+                print("❌ Mapa das latas indisponível")
+                return
+            self.engine.refresh()
+            self.engine.assign_cans(self.defects, self.defect_contours)
+
+        cans = self.defects["can"]
+        self._mostrar_latas_com_defeito(set(cans[cans != NO_CAN].tolist()))
+
+    def _mostrar_latas_com_defeito(self, latas_com_defeito):
         if latas_com_defeito:
             texto = f"⚠️ Latas com defeitos: {self.total_defects_var.get()}\n\r" + ", ".join(
                 str(n) for n in sorted(latas_com_defeito))
@@ -518,8 +514,8 @@ class InspectionWindow(ctk.CTkToplevel):
         if val != "":
             self.min_defect_area = int(val)
             self.min_defect_area_label.configure(text=f"Tamanho mín. defeito: {self.min_defect_area}")
-            self._show_defects()
             self._save_params()
+            self._show_defects()
 
     #toggle template or image
     def _toggle_image(self):
@@ -549,6 +545,6 @@ class InspectionWindow(ctk.CTkToplevel):
             "dark_gradient_threshold": self.dark_gradient_threshold,
             "detect_area": self.min_defect_area
         }
-        with open(self.param_path, "w") as f:
-            json.dump(params, f, indent=4)
+        # Mantém as restantes chaves do ficheiro (ex.: "detect_mode")
+        save_params(self.param_path, dict(load_params(self.param_path), **params))
 